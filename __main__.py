@@ -1,21 +1,75 @@
 """A Python Pulumi program for Addi-Aire Infrastructure"""
 
+from src.diagnostics import ImportProfiler
+
+# Opt-in import profiling: `pulumi config set profileImports true` or ADDI_AIRE_PROFILE_IMPORTS=1
+import_profiler = ImportProfiler.from_env()
+
 import pulumi
 from src.networking import NetworkingStack
-from src.compute import ContainerStack
+from src.compute import AppArgs, ContainerStack
 from src.monitoring import MonitoringStack
 from src.storage import StorageStack
 from pulumi import Output
-from src.security.vault import VaultStack, AutoVault
-from src.registry import Registry
+from src.security.vault import VaultStack, AutoVault, AUTO_VAULT_IMAGE
+from src.registry import Registry, RegistryArgs, DEFAULT_KEEP_PATTERN
 from src.registry.certs import generate_registry_certs
-from src.registry.auth import generate_htpasswd
+from src.registry.auth import generate_htpasswd, DEFAULT_COST
+from src.catalog import ServiceCatalog
+from src.images import ImageLock, ImagePuller
+from src.profiles import select_profile
+from src.proxy import NginxProxy
+from src.proxy.sites import AppSite, CacheArgs
+from src.capacity import plan_resources
 from pathlib import Path
 
 # Get configuration
 config = pulumi.Config()
 environment = config.get("environment", "dev")
 
+# Environment profile (minimal/dev/prod), only when `profile` is set: decides which
+# stacks and services are built and sets heap sizes, retention and scrape intervals
+profile = select_profile(config)
+pulumi.export("profile", profile.name)
+
+# Service catalog shared by the container stacks (config/services.yaml + serviceOverrides)
+catalog = profile.apply(ServiceCatalog.load(config))
+
+# Pull-through Docker Hub mirror next to the registry: `registryMirror` is true or
+# {"port": "5001", "ttl": "168h", "remote": "..."}; Docker Hub credentials are optional
+registry_mirror = config.get_object("registryMirror") if profile.includes("registry") else None
+if registry_mirror is True:
+    registry_mirror = {}
+# Registry retention: {"keep_last": 10, "keep_pattern": "^(latest|v\\d+.*)$", "schedule": "03:30"}
+registry_retention = config.get_object("registryRetention") or {}
+# Redis blob-descriptor cache shared by the registry and its mirror
+registry_redis = bool(config.get_bool("registryRedis")) and profile.includes("registry")
+
+# The Next.js app is only built when its checkout is configured (`appContext`)
+app_context = config.get("appContext")
+build_app = bool(app_context) and profile.includes("compute") and profile.includes("registry")
+
+app_replicas = config.get_int("appReplicas") or 1
+
+# Size every container against the declared host capacity (`hostCapacity`);
+# fails the preview when the memory/CPU floors do not fit. Each app replica gets
+# its own share, reserved twice: both colors run side by side during a flip
+resource_plan = plan_resources(config, profile.stacks, catalog,
+                               extra=(["registry-mirror"] if isinstance(registry_mirror, dict) else [])
+                               + (["registry-redis"] if registry_redis else [])
+                               + (["app"] if build_app else []),
+                               instances={"app": app_replicas * 2})
+if resource_plan is not None:
+    pulumi.export("resource_allocation", resource_plan.table())
+
+# Image lock (config/images.lock.json): every image is pinned to the digest
+# recorded there; tags missing from it are resolved and added on `up` (a
+# preview only warns). `imageLockRefresh` re-resolves every tag, e.g. to pick
+# up new :latest builds
+image_lock = ImageLock.load()
+refresh_images = bool(config.get_bool("imageLockRefresh"))
+resolve_images = refresh_images or not pulumi.runtime.is_dry_run()
+
 # Registry configuration
 registry_config = {
     "server": config.require_secret("registryServer"),
@@ -23,58 +77,189 @@ registry_config = {
     "password": config.require_secret("registryPassword")
 }
 
+# Create networking stack
+network = NetworkingStack("main")
+network_ids = {
+    "prod": network.prod_network.id,
+    "dev": network.dev_network.id,
+    "mgmt": network.mgmt_network.id
+}
+
 # Set up registry
 registry_config_dir = Path('config/registry')
 hostname = '192.168.3.26'
 
-# Generate certificates
-key_path, cert_path = generate_registry_certs(registry_config_dir / 'certs', hostname)
+if profile.includes("registry"):
+    # Generate certificates (reused until close to expiry, then rotated in-process)
+    registry_certs = generate_registry_certs(
+        registry_config_dir / 'certs',
+        hostname,
+        key_type=config.get("registryCertKeyType") or "ecdsa-p256",
+        renew_before_days=config.get_int("registryCertRenewDays") or 30,
+        ports=["5000"] + ([str(registry_mirror.get("port", "5001"))] if isinstance(registry_mirror, dict) else []),
+        # A preview only reports a rotation; the live pair is replaced on `up`
+        dry_run=pulumi.runtime.is_dry_run()
+    )
+    pending = "will be " if pulumi.runtime.is_dry_run() and registry_certs.action != 'reused' else ""
+    if registry_certs.action == 'rotated':
+        pulumi.log.info(f"Registry certificate {pending}rotated: {registry_certs.reason}")
+    else:
+        pulumi.log.info(f"Registry certificate {pending}{registry_certs.action}, "
+                        f"valid until {registry_certs.not_after:%Y-%m-%d}")
 
-# Generate auth credentials
-registry_password = generate_htpasswd(registry_config_dir / 'auth', 'admin')
+    # Generate auth credentials; a stable registryAdminPassword lets repeat runs reuse the cached entry.
+    # The password stays a secret Output, so it never shows up in plain text in state or outputs
+    registry_admin_password = config.get_secret("registryAdminPassword")
+    if registry_admin_password is None:
+        pulumi.log.warn("registryAdminPassword is not set; generating a new registry password on every run")
+    htpasswd_cost = config.get_int("registryHtpasswdCost") or DEFAULT_COST
+    registry_password = Output.secret(registry_admin_password).apply(
+        lambda password: generate_htpasswd(registry_config_dir / 'auth', 'admin', password=password, cost=htpasswd_cost)
+    )
 
-# Create networking stack
-network = NetworkingStack("main")
+    registry_args = RegistryArgs(
+        host=hostname,
+        cert_fingerprint=registry_certs.fingerprint,
+        limits=resource_plan.container_args("registry") if resource_plan else None,
+        redis=registry_redis,
+        redis_limits=resource_plan.container_args("registry-redis") if resource_plan else None,
+        mirror=isinstance(registry_mirror, dict),
+        mirror_port=str((registry_mirror or {}).get("port", "5001")),
+        mirror_remote=(registry_mirror or {}).get("remote", "https://registry-1.docker.io"),
+        mirror_ttl=(registry_mirror or {}).get("ttl", "168h"),
+        mirror_username=config.get_secret("dockerHubUsername"),
+        mirror_password=config.get_secret("dockerHubPassword"),
+        mirror_limits=resource_plan.container_args("registry-mirror") if resource_plan else None,
+        admin_password=registry_password,
+        keep_last=int(registry_retention.get("keep_last", 10)),
+        keep_pattern=registry_retention.get("keep_pattern", DEFAULT_KEEP_PATTERN),
+        maintenance_schedule=registry_retention.get("schedule", "03:30"),
+        maintenance_limits=resource_plan.container_args("registry-maintenance") if resource_plan else None
+    )
+
+    # The registry's own images are pulled straight from Docker Hub, before the mirror exists
+    image_lock.update(registry_args.required_images(), refresh=refresh_images, resolve=resolve_images)
+    registry_images = ImagePuller("registry-images", registry_args.required_images(), image_lock)
+    registry_args.images = registry_images.refs
 
-# Create registry instance
-registry = Registry('registry', network_id=network.mgmt_network.id)
+    # Create registry instance
+    registry = Registry('registry',
+        network_id=network.mgmt_network.id,
+        args=registry_args
+    )
+    # Every Docker Hub image of the stacks below is pulled through the mirror
+    if registry.mirror is not None:
+        catalog.image_mirror = registry.mirror_address
+        pulumi.export('registry_mirror_url', f'https://{hostname}:{registry_mirror.get("port", "5001")}')
 
-# Store registry credentials securely
-pulumi.export('registry_username', 'admin')
-pulumi.export('registry_password', registry_password)
-pulumi.export('registry_url', f'https://{hostname}:5000')
+    # Store registry credentials securely
+    pulumi.export('registry_username', 'admin')
+    pulumi.export('registry_password', Output.secret(registry_password))
+    pulumi.export('registry_url', f'https://{hostname}:5000')
+
+# Pre-pull every image of the stacks concurrently (through the mirror when there is
+# one); containers then reference the pulled digests instead of floating tags
+stack_images = catalog.images_of(profile.stacks) + ([AUTO_VAULT_IMAGE] if profile.includes("vault") else [])
+image_lock.update(stack_images, refresh=refresh_images, resolve=resolve_images)
+images = ImagePuller("images", stack_images, image_lock, mirror=catalog.image_mirror)
+catalog.image_refs = images.refs
+pulumi.export("image_digests", image_lock.digests)
+
+# Next.js app: built from the checkout at `appContext` and pushed to the local registry
+# with its layer cache; `appBuildArgs` holds public build-time values (NEXT_PUBLIC_*),
+# `appSecrets` the server-side secrets the container gets as environment
+app_args = None
+if build_app:
+    app_args = AppArgs(
+        context=app_context,
+        registry_server=registry.container.id.apply(lambda _: f"{hostname}:5000"),
+        registry_username="admin",
+        registry_password=Output.secret(registry_password),
+        build_args=config.get_object("appBuildArgs"),
+        secrets={key: Output.secret(str(value)) for key, value in (config.get_object("appSecrets") or {}).items()},
+        limits=resource_plan.container_args("app") if resource_plan else None,
+        # Behind the proxy the replicas are only reached through the nginx upstream;
+        # `pulumi config set appColor green` rolls out a new set next to the old one
+        publish=not profile.includes("proxy"),
+        replicas=app_replicas,
+        color=config.get("appColor") or "blue"
+    )
 
 # Create container stack with appropriate network
-containers = ContainerStack("main",
-    network_ids={
-        "prod": network.prod_network.id,
-        "dev": network.dev_network.id,
-        "mgmt": network.mgmt_network.id
-    },
-    registry_config=registry_config,
-    environment=environment
-)
-
-# Create monitoring stack
-monitoring = MonitoringStack("main",
-    network_ids={
-        "prod": network.prod_network.id,
-        "dev": network.dev_network.id,
-        "mgmt": network.mgmt_network.id
-    }
-)
+if profile.includes("compute"):
+    containers = ContainerStack("main",
+        network_ids=network_ids,
+        registry_config=registry_config,
+        environment=environment,
+        catalog=catalog,
+        app=app_args
+    )
+
+# Create the reverse proxy; the app upstream is repointed once its replicas are healthy
+if profile.includes("proxy"):
+    app_sites = []
+    if profile.includes("compute") and containers.app_upstream is not None:
+        app_sites.append(AppSite.from_upstream(containers.app_upstream,
+                                               server_name=config.get("appServerName")))
+    # Response cache per app, e.g. `pulumi config set --path proxyCache.max_size 4g`;
+    # `proxyCache.enabled false` turns it off. A new app image purges its cache
+    proxy = NginxProxy("main", network.mgmt_network.id,
+        catalog=catalog,
+        apps=app_sites,
+        app_containers=containers.app_replicas if profile.includes("compute") else None,
+        cache=CacheArgs(**(config.get_object("proxyCache") or {})),
+        revisions={site.upstream: containers.app_image.repo_digest for site in app_sites},
+        # Only for an nginx image built with ngx_brotli; .gz siblings are always served
+        brotli_static=bool(config.get_bool("proxyBrotliStatic")),
+        # Tune from nginx_connections_active / nginx_connections_waiting (nginx-exporter)
+        worker_processes=config.get("proxyWorkerProcesses") or "auto",
+        worker_connections=config.get_int("proxyWorkerConnections") or 1024,
+        worker_rlimit_nofile=config.get_int("proxyWorkerRlimitNofile")
+    )
+    pulumi.export("app_upstreams", proxy.sites)
 
 # Create storage stack
-storage = StorageStack("main",
-    network_ids={
-        "prod": network.prod_network.id,
-        "dev": network.dev_network.id,
-        "mgmt": network.mgmt_network.id
-    }
-)
+if profile.includes("storage"):
+    storage = StorageStack("main",
+        network_ids=network_ids,
+        catalog=catalog,
+        recovery_token=config.get_secret("recoveryToken")
+    )
 
 # Create Vault stack
-vault = AutoVault("main", network.mgmt_network.id)
+if profile.includes("vault"):
+    vault = AutoVault("main", network.mgmt_network.id,
+        limits=resource_plan.container_args("vault") if resource_plan else None,
+        image=catalog.resolve_image(AUTO_VAULT_IMAGE)
+    )
+
+# Create monitoring stack last so the health prober covers every container created above
+if profile.includes("monitoring"):
+    # Containers of the other stacks: probed by health-check and, when they
+    # declare `metrics`, scraped by Prometheus
+    probe_targets = {}
+    if profile.includes("registry"):
+        probe_targets["registry"] = registry.container
+        if registry.mirror is not None:
+            probe_targets["registry-mirror"] = registry.mirror
+        if registry.maintenance is not None:
+            probe_targets["registry-maintenance"] = registry.maintenance
+    if profile.includes("compute"):
+        probe_targets.update(containers.containers)
+        if containers.app is not None:
+            probe_targets["app"] = containers.app
+    if profile.includes("storage"):
+        probe_targets.update(storage.containers)
+    if profile.includes("vault"):
+        probe_targets["vault"] = vault.vault
+    if profile.includes("proxy"):
+        probe_targets.update(proxy.containers)
+    monitoring = MonitoringStack("main",
+        network_ids=network_ids,
+        catalog=catalog,
+        probe_targets=probe_targets,
+        scrape_targets=probe_targets
+    )
 
 # Export outputs
 pulumi.export("networks", {
@@ -105,3 +290,11 @@ pulumi.export("internal_endpoints", {
 
 # Export vault token
 pulumi.export("vault_token", "addi-aire-now")
+
+# Import-time report, including providers loaded lazily by the components above
+if import_profiler is not None:
+    import_profiler.stop()
+    pulumi.log.info(import_profiler.report())
+    import_budget_ms = config.get_float("importBudgetMs")
+    if import_profiler.over_budget(import_budget_ms):
+        pulumi.log.warn(f"Imports took {import_profiler.total * 1000:.0f} ms, over the {import_budget_ms:.0f} ms budget")
@@ -0,0 +1,69 @@
+"""Ship in-repo Python agents into stock Python containers.
+
+Agents are stdlib-only packages kept next to the component that deploys
+them (e.g. `src/monitoring/prober`). Their sources are uploaded into the
+container under AGENT_ROOT, so no image has to be built or pushed and a
+change to an agent replaces the container on the next `pulumi up`. Shared
+modules (`modules`, e.g. DOCKER_MODULE) are uploaded at their repository
+path, so agents import them as `src.agents.docker` in the container too.
+"""
+
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+import hashlib
+
+from pulumi_docker import ContainerLabelArgs, ContainerUploadArgs
+
+AGENT_ROOT = "/opt/addi-aire"
+REPO_ROOT = Path(__file__).resolve().parents[2]
+# Shared stdlib-only Docker socket client, imported as `src.agents.docker`
+DOCKER_MODULE = Path(__file__).resolve().parent / "docker.py"
+AGENT_ENVS = [f"PYTHONPATH={AGENT_ROOT}", "PYTHONUNBUFFERED=1", "PYTHONDONTWRITEBYTECODE=1"]
+
+
+def _sources(package: Path) -> List[Path]:
+    return sorted(path for path in package.rglob("*.py") if "__pycache__" not in path.parts)
+
+
+def agent_uploads(package: Path, root: str = AGENT_ROOT) -> List[ContainerUploadArgs]:
+    """One upload per module of `package`, placed at <root>/<package name>/..."""
+    return [
+        ContainerUploadArgs(
+            file=f"{root}/{package.name}/{path.relative_to(package).as_posix()}",
+            content=path.read_text()
+        )
+        for path in _sources(package)
+    ]
+
+
+def module_uploads(modules: Iterable[Path], root: str = AGENT_ROOT) -> List[ContainerUploadArgs]:
+    """One upload per shared module, placed at <root>/<path in the repository>"""
+    return [
+        ContainerUploadArgs(file=f"{root}/{path.relative_to(REPO_ROOT).as_posix()}", content=path.read_text())
+        for path in modules
+    ]
+
+
+def agent_digest(package: Path, modules: Iterable[Path] = ()) -> str:
+    """Digest of the agent's sources and shared modules, e.g. for a container label"""
+    digest = hashlib.sha256()
+    for path in _sources(package):
+        digest.update(path.relative_to(package).as_posix().encode() + b"\0")
+        digest.update(path.read_bytes())
+    for path in modules:
+        digest.update(path.relative_to(REPO_ROOT).as_posix().encode() + b"\0")
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def agent_args(package: Path,
+               envs: Optional[Iterable[Any]] = None,
+               uploads: Optional[Iterable[ContainerUploadArgs]] = None,
+               modules: Iterable[Path] = ()) -> Dict[str, Any]:
+    """Container arguments that run `package` as an agent, merged with the service's own envs and uploads"""
+    modules = list(modules)
+    return {
+        "envs": AGENT_ENVS + list(envs or []),
+        "uploads": agent_uploads(package) + module_uploads(modules) + list(uploads or []),
+        "labels": [ContainerLabelArgs(label="addi-aire.agent-hash", value=agent_digest(package, modules))]
+    }
@@ -0,0 +1,112 @@
+"""Docker Engine API over the unix socket: inspect, clone, start/stop, exec and archive.
+
+Stdlib only and shared by the host-side tools (`python -m src.proxy`) and
+the agents that drive Docker from their container (registry maintenance,
+backup recovery); `agent_args(..., modules=[DOCKER_MODULE])` ships it.
+"""
+
+import http.client
+import json
+import socket
+import struct
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+DOCKER_SOCKET = "/var/run/docker.sock"
+
+
+class DockerError(Exception):
+    pass
+
+
+class _UnixConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float) -> None:
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = path
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def _demultiplex(stream: bytes) -> bytes:
+    """Payload of a non-TTY attach/exec stream (8-byte frame headers)"""
+    output, offset = [], 0
+    while offset + 8 <= len(stream):
+        size = struct.unpack(">I", stream[offset + 4:offset + 8])[0]
+        output.append(stream[offset + 8:offset + 8 + size])
+        offset += 8 + size
+    return b"".join(output)
+
+
+class DockerClient:
+    def __init__(self, socket_path: str = DOCKER_SOCKET, timeout: float = 600.0) -> None:
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def _request(self, method: str, path: str, body: Optional[Dict[str, Any]] = None) -> Tuple[int, bytes]:
+        connection = _UnixConnection(self.socket_path, self.timeout)
+        try:
+            payload = json.dumps(body).encode() if body is not None else None
+            connection.request(method, path, body=payload,
+                               headers={"Content-Type": "application/json"} if payload else {})
+            response = connection.getresponse()
+            data = response.read()
+        finally:
+            connection.close()
+        if response.status >= 400:
+            raise DockerError(f"{method} {path}: {response.status} {data[:200]!r}")
+        return response.status, data
+
+    def containers_using(self, volumes: List[str]) -> List[Dict[str, Any]]:
+        """Running containers that mount any of the named volumes"""
+        found: Dict[str, Dict[str, Any]] = {}
+        for volume in volumes:
+            filters = quote(json.dumps({"volume": [volume], "status": ["running"]}))
+            for container in json.loads(self._request("GET", f"/containers/json?filters={filters}")[1]):
+                found[container["Id"]] = container
+        return list(found.values())
+
+    def inspect(self, name: str) -> Dict[str, Any]:
+        return json.loads(self._request("GET", f"/containers/{quote(name)}/json")[1])
+
+    def clone(self, source: Dict[str, Any], name: str, extra_env: List[str]) -> str:
+        """Create a container like `source` (image, command, mounts, ports, network aliases) with extra env"""
+        config, host = source["Config"], source["HostConfig"]
+        networks = {network: {"Aliases": [alias for alias in (endpoint.get("Aliases") or [])
+                                          if not source["Id"].startswith(alias)]}
+                    for network, endpoint in source["NetworkSettings"]["Networks"].items()}
+        body = {
+            "Image": config["Image"],
+            "Entrypoint": config.get("Entrypoint"),
+            "Cmd": config.get("Cmd"),
+            "Env": (config.get("Env") or []) + extra_env,
+            "Healthcheck": config.get("Healthcheck"),
+            "Labels": {"addi-aire.maintenance-clone": source["Name"].lstrip("/")},
+            "HostConfig": {key: host.get(key) for key in ("Binds", "Mounts", "PortBindings")},
+            "NetworkingConfig": {"EndpointsConfig": networks},
+        }
+        return json.loads(self._request("POST", f"/containers/create?name={quote(name)}", body)[1])["Id"]
+
+    def start(self, container: str) -> None:
+        self._request("POST", f"/containers/{quote(container)}/start")
+
+    def stop(self, container: str, timeout: int = 30) -> None:
+        self._request("POST", f"/containers/{quote(container)}/stop?t={timeout}")
+
+    def remove(self, container: str) -> None:
+        self._request("DELETE", f"/containers/{quote(container)}?force=true")
+
+    def exec(self, container: str, command: List[str]) -> Tuple[int, str]:
+        """Run `command` in a running container; (exit code, combined output)"""
+        _, created = self._request("POST", f"/containers/{quote(container)}/exec",
+                                   {"Cmd": command, "AttachStdout": True, "AttachStderr": True})
+        exec_id = json.loads(created)["Id"]
+        _, stream = self._request("POST", f"/exec/{exec_id}/start", {"Detach": False, "Tty": False})
+        state = json.loads(self._request("GET", f"/exec/{exec_id}/json")[1])
+        return state["ExitCode"], _demultiplex(stream).decode(errors="replace")
+
+    def archive(self, container: str, path: str) -> bytes:
+        """Tar stream of `path` in a container"""
+        return self._request("GET", f"/containers/{quote(container)}/archive?path={quote(path)}")[1]
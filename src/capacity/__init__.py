@@ -0,0 +1,226 @@
+"""Host-capacity resource planner.
+
+Every container declares a `resources` demand in the service catalog (a
+weight, a memory floor and optional ceiling, a CPU floor and, for JVM
+services, the catalog variable holding its heap size). Given the host's
+declared capacity the planner hands each container its memory floor, shares
+the remaining memory out by weight, derives JVM heaps from the resulting
+limits and refuses to plan when the floors do not fit on the host.
+Services that run several identical containers (the app replicas) reserve
+their demand once per container and every container gets an equal share.
+"""
+
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Mapping, Optional
+
+from pulumi import RunError
+
+from src.catalog import ServiceCatalog
+from src.catalog.specs import ResourceSpec, parse_memory
+
+# Relative CPU weight Docker gives a container by default
+DEFAULT_CPU_SHARES = 1024
+# Components built outside the catalog, keyed by the profile stack that creates them
+COMPONENTS = {"registry": "registry", "registry-maintenance": "registry", "vault": "vault"}
+
+
+class CapacityError(RunError):
+    """The declared demands do not fit on the host"""
+
+
+@dataclass(slots=True)
+class HostCapacity:
+    cpus: float
+    memory: int
+    reserved_memory: int = 0
+
+    @classmethod
+    def from_config(cls, config) -> Optional["HostCapacity"]:
+        """`hostCapacity` stack config, e.g. {"cpus": 8, "memory": "16g", "reserved": "1g"}"""
+        value = config.get_object("hostCapacity") if config is not None else None
+        if not value:
+            return None
+        return cls(
+            cpus=float(value["cpus"]),
+            memory=parse_memory(value["memory"]),
+            reserved_memory=parse_memory(value.get("reserved", 0))
+        )
+
+    @property
+    def available_memory(self) -> int:
+        return self.memory - self.reserved_memory
+
+
+@dataclass(slots=True)
+class Allocation:
+    service: str
+    memory: int
+    cpus: float
+    cpu_shares: int
+    heap: Optional[int] = None
+    heap_variable: Optional[str] = None
+    # Identical containers sharing this allocation; memory and cpus are per container
+    instances: int = 1
+
+    def container_args(self) -> Dict[str, int]:
+        # memory_swap equal to memory keeps containers out of swap entirely
+        return {"memory": self.memory, "memory_swap": self.memory, "cpu_shares": self.cpu_shares}
+
+
+class ResourcePlan:
+    def __init__(self, capacity: HostCapacity, allocations: Mapping[str, Allocation]) -> None:
+        self.capacity = capacity
+        self.allocations = dict(allocations)
+
+    def container_args(self, service: str) -> Dict[str, int]:
+        allocation = self.allocations.get(service)
+        return allocation.container_args() if allocation else {}
+
+    def apply(self, catalog: ServiceCatalog) -> ServiceCatalog:
+        """Write limits onto catalog services and size the JVM heap variables"""
+        catalog_services = set(catalog.names())
+        for name, allocation in self.allocations.items():
+            if name in catalog_services:
+                catalog.override(name, {"limits": allocation.container_args()})
+            if allocation.heap_variable:
+                catalog.variables[allocation.heap_variable] = f"{allocation.heap}m"
+        return catalog
+
+    def table(self) -> Dict[str, Dict[str, Any]]:
+        """Allocation per service, suitable for a stack export"""
+        table = {}
+        for name, allocation in self.allocations.items():
+            row = {
+                "memory": f"{allocation.memory}m",
+                "cpus": round(allocation.cpus, 2),
+                "cpu_shares": allocation.cpu_shares
+            }
+            if allocation.heap is not None:
+                row["heap"] = f"{allocation.heap}m"
+            if allocation.instances > 1:
+                row["instances"] = allocation.instances
+            table[name] = row
+        return table
+
+
+class ResourcePlanner:
+    def __init__(self, capacity: HostCapacity) -> None:
+        self.capacity = capacity
+        self.demands: Dict[str, ResourceSpec] = {}
+        self.heap_floors: Dict[str, int] = {}
+        self.instances: Dict[str, int] = {}
+
+    def add(self, service: str, demand: ResourceSpec, heap: Optional[Any] = None, instances: int = 1) -> None:
+        """Register a container, or `instances` identical ones; `heap` is the smallest heap the profile asks for"""
+        self.demands[service] = demand
+        self.instances[service] = max(1, int(instances))
+        if heap is not None and demand.heap_variable:
+            self.heap_floors[service] = parse_memory(heap)
+
+    def _floor(self, service: str) -> int:
+        # Floors, ceilings, CPU floors and weights below cover every instance
+        demand = self.demands[service]
+        floor = demand.min_memory
+        if service in self.heap_floors:
+            floor = max(floor, int(self.heap_floors[service] / demand.heap_ratio))
+        return floor * self.instances[service]
+
+    def _ceiling(self, service: str) -> Optional[int]:
+        demand = self.demands[service]
+        return demand.max_memory * self.instances[service] if demand.max_memory is not None else None
+
+    def _weight(self, service: str) -> float:
+        return self.demands[service].weight * self.instances[service]
+
+    def _check(self, floors: Mapping[str, int]) -> None:
+        problems: List[str] = []
+        available = self.capacity.available_memory
+        if sum(floors.values()) > available:
+            detail = ", ".join(f"{name}={floor}m" for name, floor in
+                               sorted(floors.items(), key=lambda item: -item[1]))
+            problems.append(f"memory floors total {sum(floors.values())}m but only {available}m "
+                            f"is available ({detail})")
+        min_cpus = sum(demand.min_cpus * self.instances[name] for name, demand in self.demands.items())
+        if min_cpus > self.capacity.cpus:
+            problems.append(f"CPU floors total {min_cpus:g} but the host has {self.capacity.cpus:g}")
+        if problems:
+            raise CapacityError("Host capacity is oversubscribed: " + "; ".join(problems))
+
+    def _share_memory(self, floors: Mapping[str, int]) -> Dict[str, float]:
+        # Water-fill the memory left after floors by weight; services that hit
+        # their ceiling drop out and their share goes to the rest
+        memory = {name: float(floor) for name, floor in floors.items()}
+        spare = float(self.capacity.available_memory - sum(floors.values()))
+        growing = {name for name in self.demands
+                   if self._weight(name) > 0 and (self._ceiling(name) is None or self._ceiling(name) > memory[name])}
+        while spare >= 1 and growing:
+            total_weight = sum(self._weight(name) for name in growing)
+            capped = set()
+            handed_out = 0.0
+            for name in growing:
+                ceiling = self._ceiling(name)
+                share = spare * self._weight(name) / total_weight
+                if ceiling is not None and memory[name] + share >= ceiling:
+                    share = ceiling - memory[name]
+                    capped.add(name)
+                memory[name] += share
+                handed_out += share
+            spare -= handed_out
+            if not capped:
+                break
+            growing -= capped
+        return memory
+
+    def plan(self) -> ResourcePlan:
+        floors = {name: self._floor(name) for name in self.demands}
+        self._check(floors)
+        memory = self._share_memory(floors)
+        total_weight = sum(self._weight(name) for name in self.demands) or 1.0
+
+        allocations = {}
+        for name, demand in self.demands.items():
+            instances = self.instances[name]
+            limit = int(memory[name] / instances)
+            allocations[name] = Allocation(
+                service=name,
+                memory=limit,
+                cpus=max(demand.min_cpus, self.capacity.cpus * demand.weight / total_weight),
+                cpu_shares=max(2, round(DEFAULT_CPU_SHARES * demand.weight)),
+                heap=int(limit * demand.heap_ratio) if demand.heap_variable else None,
+                heap_variable=demand.heap_variable,
+                instances=instances
+            )
+        return ResourcePlan(self.capacity, allocations)
+
+
+def plan_resources(config,
+                   stacks: Iterable[str],
+                   catalog: ServiceCatalog,
+                   extra: Iterable[str] = (),
+                   instances: Optional[Mapping[str, int]] = None) -> Optional[ResourcePlan]:
+    """Plan every container the given stacks will create, plus optional `extra`
+    components declared under `resources`; None without `hostCapacity`.
+
+    `instances` reserves a service's demand for several identical containers,
+    e.g. {"app": 6} for three replicas of both blue/green colors.
+    """
+    capacity = HostCapacity.from_config(config)
+    if capacity is None:
+        return None
+
+    stacks = list(stacks)
+    planner = ResourcePlanner(capacity)
+    for stack in stacks:
+        for spec in catalog.services(stack):
+            heap = catalog.variables.get(spec.resources.heap_variable) if spec.resources.heap_variable else None
+            planner.add(spec.name, spec.resources, heap=heap)
+    for name, stack in COMPONENTS.items():
+        if stack in stacks:
+            planner.add(name, catalog.resources(name))
+    instances = instances or {}
+    for name in extra:
+        planner.add(name, catalog.resources(name), instances=instances.get(name, 1))
+
+    plan = planner.plan()
+    plan.apply(catalog)
+    return plan
@@ -0,0 +1,182 @@
+"""Declarative service catalog shared by the container-based stacks.
+
+Services, volumes and their defaults live in `config/services.yaml` (or an
+inline `serviceCatalog` object in stack config). Entries are kept as raw
+mappings until a stack asks for them, so only enabled services are turned
+into specs and Docker resources.
+"""
+
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Union
+from pulumi import Output
+import yaml
+
+from .specs import (
+    HealthcheckSpec,
+    MetricsSpec,
+    MountSpec,
+    PortSpec,
+    ProbeSpec,
+    ResourceSpec,
+    ServiceSpec,
+    VolumeSpec,
+    deep_merge,
+    docker_hub_path,
+    image_repository,
+)
+
+DEFAULT_CATALOG_PATH = Path(__file__).resolve().parents[2] / "config" / "services.yaml"
+
+
+class ServiceCatalog:
+    def __init__(self,
+                 services: Mapping[str, Mapping[str, Any]],
+                 volumes: Optional[Mapping[str, Mapping[str, Any]]] = None,
+                 defaults: Optional[Mapping[str, Any]] = None,
+                 variables: Optional[Mapping[str, Any]] = None,
+                 resources: Optional[Mapping[str, Mapping[str, Any]]] = None,
+                 probes: Optional[Mapping[str, Mapping[str, Any]]] = None,
+                 metrics: Optional[Mapping[str, Mapping[str, Any]]] = None,
+                 images: Optional[Mapping[str, Mapping[str, Any]]] = None) -> None:
+        self._raw_services = dict(services)
+        self._raw_volumes = dict(volumes or {})
+        self._raw_resources = dict(resources or {})
+        self._raw_probes = dict(probes or {})
+        self._raw_metrics = dict(metrics or {})
+        self.images = dict(images or {})
+        self.defaults = dict(defaults or {})
+        self.variables = dict(variables or {})
+        self._specs: Dict[str, ServiceSpec] = {}
+        # host:port of a Docker Hub pull-through mirror, set once the registry stack has created it
+        self.image_mirror: Optional[Union[str, Output[str]]] = None
+        # Digest references of pre-pulled images (src/images), by image as written in the catalog
+        self.image_refs: Dict[str, Union[str, Output[str]]] = {}
+
+    @classmethod
+    def from_yaml(cls, path: Path) -> "ServiceCatalog":
+        with open(path) as handle:
+            return cls.from_dict(yaml.safe_load(handle) or {})
+
+    @classmethod
+    def from_dict(cls, data: Mapping[str, Any]) -> "ServiceCatalog":
+        return cls(
+            services=data.get("services", {}),
+            volumes=data.get("volumes", {}),
+            defaults=data.get("defaults", {}),
+            variables=data.get("variables", {}),
+            resources=data.get("resources", {}),
+            probes=data.get("probes", {}),
+            metrics=data.get("metrics", {}),
+            images=data.get("images", {})
+        )
+
+    @classmethod
+    def load(cls, config=None) -> "ServiceCatalog":
+        """Load the catalog from stack config, falling back to the YAML file.
+
+        `serviceCatalog` may be an inline catalog object or a path to a YAML
+        file; `serviceOverrides` is merged over individual services, e.g.
+        `{"tempo": {"enabled": false}}`.
+        """
+        source = config.get_object("serviceCatalog") if config is not None else None
+        if isinstance(source, Mapping):
+            catalog = cls.from_dict(source)
+        else:
+            catalog = cls.from_yaml(Path(source) if source else DEFAULT_CATALOG_PATH)
+
+        overrides = config.get_object("serviceOverrides") if config is not None else None
+        for name, override in (overrides or {}).items():
+            catalog.override(name, override)
+        return catalog
+
+    def override(self, name: str, values: Mapping[str, Any]) -> None:
+        """Merge `values` over a service definition before it is materialised"""
+        self._raw_services[name] = deep_merge(self._raw_services.get(name, {}), values)
+        self._specs.pop(name, None)
+
+    def names(self, stack: Optional[str] = None) -> List[str]:
+        return [name for name, raw in self._raw_services.items()
+                if stack is None or raw.get("stack", self.defaults.get("stack")) == stack]
+
+    def is_enabled(self, name: str) -> bool:
+        return bool(self._raw_services[name].get("enabled", True))
+
+    def spec(self, name: str) -> ServiceSpec:
+        if name not in self._specs:
+            self._specs[name] = ServiceSpec.parse(name, self._raw_services[name], self.defaults)
+        return self._specs[name]
+
+    def services(self,
+                 stack: Optional[str] = None,
+                 enabled: Optional[Iterable[str]] = None) -> List[ServiceSpec]:
+        """Specs for the enabled services of `stack`, in catalog order.
+
+        `enabled`, when given, further restricts the result to those names.
+        """
+        allowed = set(enabled) if enabled is not None else None
+        return [self.spec(name) for name in self.names(stack)
+                if self.is_enabled(name) and (allowed is None or name in allowed)]
+
+    def resources(self, name: str) -> ResourceSpec:
+        """Resource demand of a catalog service or of a component declared under `resources`"""
+        if name in self._raw_services:
+            return self.spec(name).resources
+        return ResourceSpec.parse(self._raw_resources.get(name, {}), self.defaults.get("resources", {}))
+
+    def dependents(self, name: str) -> List[str]:
+        """Enabled services that list `name` in their depends_on"""
+        return [other for other, raw in self._raw_services.items()
+                if name in raw.get("depends_on", []) and self.is_enabled(other)]
+
+    def probe_tools(self, image: str) -> Optional[List[str]]:
+        """Binaries a healthcheck may run in `image`, or None when the image is not declared"""
+        raw = self.images.get(image_repository(image))
+        return list(raw.get("probe_tools", [])) if raw is not None else None
+
+    def resolve_image(self, image: str) -> Union[str, Output[str]]:
+        """`image` as containers use it: the pre-pulled digest reference when there is one,
+        else Docker Hub images go through the mirror when there is one"""
+        if image in self.image_refs:
+            return self.image_refs[image]
+        path = docker_hub_path(image)
+        if self.image_mirror is None or path is None:
+            return image
+        return Output.from_input(self.image_mirror).apply(lambda mirror: f"{mirror}/{path}")
+
+    def images_of(self, stacks: Iterable[str]) -> List[str]:
+        """Images of the enabled services of `stacks`, without duplicates"""
+        return list(dict.fromkeys(spec.image for stack in stacks for spec in self.services(stack)))
+
+    def probe(self, name: str) -> Optional[ProbeSpec]:
+        """Health probe of a catalog service or of a component declared under `probes`"""
+        if name in self._raw_services:
+            return self.spec(name).probe
+        raw = self._raw_probes.get(name)
+        return ProbeSpec.parse(raw) if raw else None
+
+    def metrics(self, name: str) -> Optional[MetricsSpec]:
+        """Scrape endpoint of a catalog service or of a component declared under `metrics`"""
+        if name in self._raw_services:
+            return self.spec(name).metrics
+        raw = self._raw_metrics.get(name)
+        return MetricsSpec.parse(raw) if raw else None
+
+    def volume(self, key: str) -> VolumeSpec:
+        """Volume spec by key; unknown keys are treated as external volume names"""
+        raw = self._raw_volumes.get(key)
+        if raw is None:
+            return VolumeSpec(key=key, name=key)
+        return VolumeSpec(key=key, name=raw.get("name", key), stack=raw.get("stack"),
+                          protect=bool(raw.get("protect", False)))
+
+
+__all__ = [
+    "HealthcheckSpec",
+    "MountSpec",
+    "PortSpec",
+    "ProbeSpec",
+    "ResourceSpec",
+    "ServiceCatalog",
+    "ServiceSpec",
+    "VolumeSpec",
+]
@@ -0,0 +1,232 @@
+from pulumi import Output, Resource, ResourceOptions
+from pulumi_docker import (
+    Container,
+    ContainerCapabilitiesArgs,
+    ContainerHealthcheckArgs,
+    ContainerNetworksAdvancedArgs,
+    ContainerPortArgs,
+    ContainerVolumeArgs,
+    Volume,
+)
+import inspect
+import re
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Union
+
+from . import ServiceCatalog
+from .specs import HealthcheckSpec, MountSpec, ProbeSpec, ServiceSpec
+
+_PLACEHOLDER = re.compile(r"\$\{([A-Za-z_][A-Za-z0-9_]*)\}")
+_DURATION = re.compile(r"^(\d+)(s|m|h)$")
+_DURATION_SECONDS = {"s": 1, "m": 60, "h": 3600}
+
+# Older providers do not know start_interval (Docker Engine 25+); it is only passed when supported
+_START_INTERVAL_SUPPORTED = "start_interval" in inspect.signature(ContainerHealthcheckArgs.__init__).parameters
+
+# Healthcheck commands per probe tool, given the URL on the container's loopback
+_PROBE_COMMANDS = {
+    "wget": lambda url, probe: ["CMD", "wget", "-q", "-O", "/dev/null"]
+                               + (["--no-check-certificate"] if probe.scheme == "https" else []) + [url],
+    "curl": lambda url, probe: ["CMD", "curl", "-fsS", "-o", "/dev/null"]
+                               + (["-k"] if probe.scheme == "https" else []) + [url],
+    "python": lambda url, probe: ["CMD", "python", "-c",
+                                  f"import urllib.request; urllib.request.urlopen('{url}', timeout=5)"],
+    # TCP connect only, for images without an HTTP client
+    "bash": lambda url, probe: ["CMD", "bash", "-c", f": > /dev/tcp/127.0.0.1/{probe.port}"],
+}
+# Commands a CMD-SHELL test may use without them being image binaries
+_SHELL_BUILTINS = {"test", "[", "exit", "true", "false", "echo", ":"}
+
+
+def _seconds(duration: str) -> int:
+    match = _DURATION.match(duration)
+    if not match:
+        raise ValueError(f"Invalid duration {duration!r}, expected e.g. 90s, 5m or 1h")
+    return int(match.group(1)) * _DURATION_SECONDS[match.group(2)]
+
+
+def render(text: str, variables: Mapping[str, Any]) -> Union[str, Output[str]]:
+    """Substitute ${var} placeholders that name a variable; Output values yield an Output.
+
+    Anything else, including shell syntax such as $1 or ${#list[@]}, is left as is.
+    """
+    used = [name for name in dict.fromkeys(_PLACEHOLDER.findall(text)) if name in variables]
+    if not used:
+        return text
+
+    def substitute(values: Mapping[str, Any]) -> str:
+        return _PLACEHOLDER.sub(
+            lambda match: str(values[match.group(1)]) if match.group(1) in values else match.group(0),
+            text
+        )
+
+    if not any(isinstance(variables[name], Output) for name in used):
+        return substitute(variables)
+    return Output.all(*[variables[name] for name in used]).apply(
+        lambda values: substitute(dict(zip(used, values)))
+    )
+
+
+class ServiceBuilder:
+    """Turns catalog specs into Docker volumes and containers under `parent`"""
+
+    def __init__(self,
+                 parent: Resource,
+                 stack: str,
+                 network_ids: Mapping[str, Union[str, Output[str]]],
+                 catalog: Optional[ServiceCatalog] = None,
+                 variables: Optional[Mapping[str, Any]] = None) -> None:
+        self.parent = parent
+        self.stack = stack
+        self.network_ids = network_ids
+        self.catalog = catalog or ServiceCatalog.load()
+        self.variables = {**self.catalog.variables, **(variables or {})}
+        self.volumes: Dict[str, Volume] = {}
+        self.containers: Dict[str, Container] = {}
+
+    def volume(self, key: str) -> Union[Volume, str]:
+        """The volume for `key`; volumes owned by other stacks are referenced by name"""
+        spec = self.catalog.volume(key)
+        if spec.stack != self.stack:
+            return spec.name
+        if key not in self.volumes:
+            self.volumes[key] = Volume(key,
+                name=spec.name,
+                opts=ResourceOptions(parent=self.parent, protect=spec.protect or None,
+                                     retain_on_delete=spec.protect or None)
+            )
+        return self.volumes[key]
+
+    def _mount(self, mount: MountSpec) -> ContainerVolumeArgs:
+        if mount.volume is not None:
+            volume = self.volume(mount.volume)
+            return ContainerVolumeArgs(
+                volume_name=volume.name if isinstance(volume, Volume) else volume,
+                container_path=mount.container_path,
+                read_only=mount.read_only or None
+            )
+        return ContainerVolumeArgs(
+            host_path=render(mount.host_path, self.variables),
+            container_path=mount.container_path,
+            read_only=mount.read_only or None
+        )
+
+    def container_args(self, spec: ServiceSpec) -> Dict[str, Any]:
+        """Keyword arguments for the Container resource of `spec`"""
+        variables = self.variables
+        args: Dict[str, Any] = {
+            "image": self.catalog.resolve_image(spec.image),
+            "restart": spec.restart,
+            "user": spec.user,
+            "privileged": spec.privileged or None,
+            "ports": [ContainerPortArgs(internal=port.internal, external=port.external, protocol=port.protocol,
+                                        ip=port.ip)
+                      for port in spec.ports] or None,
+            "volumes": [self._mount(mount) for mount in spec.mounts] or None,
+            "envs": [render(env, variables) for env in spec.envs] or None,
+            "command": [render(arg, variables) for arg in spec.command] or None,
+            "networks_advanced": [ContainerNetworksAdvancedArgs(
+                name=self.network_ids[network],
+                aliases=spec.aliases or None
+            ) for network in spec.networks],
+        }
+        if spec.container_name:
+            args["name"] = spec.container_name
+        if spec.capabilities:
+            args["capabilities"] = ContainerCapabilitiesArgs(adds=spec.capabilities)
+        if spec.healthcheck:
+            healthcheck = spec.healthcheck
+            options = {"start_interval": healthcheck.start_interval} if _START_INTERVAL_SUPPORTED else {}
+            args["healthcheck"] = ContainerHealthcheckArgs(
+                tests=[render(arg, variables) for arg in self.healthcheck_test(spec)],
+                interval=healthcheck.interval,
+                timeout=healthcheck.timeout,
+                retries=healthcheck.retries,
+                start_period=healthcheck.start_period,
+                **options
+            )
+            # Readiness gating: creating dependants waits until this container is healthy
+            wait = healthcheck.wait
+            if wait is None:
+                wait = bool(self.catalog.dependents(spec.name))
+            if wait:
+                args["wait"] = True
+                args["wait_timeout"] = _seconds(healthcheck.wait_timeout)
+        args.update(spec.limits)
+        return {key: value for key, value in args.items() if value is not None}
+
+    def healthcheck_test(self, spec: ServiceSpec) -> List[str]:
+        """The healthcheck test of `spec`, generated from its probe when not given.
+
+        Raises ValueError when the test needs a binary the image does not ship
+        (per the catalog's `images` section).
+        """
+        healthcheck: HealthcheckSpec = spec.healthcheck
+        tools = self.catalog.probe_tools(spec.image)
+        if not healthcheck.test:
+            return self._probe_test(spec, spec.probe, tools)
+
+        test = healthcheck.test
+        if tools is not None and test[0] in ("CMD", "CMD-SHELL") and len(test) > 1:
+            binary = test[1] if test[0] == "CMD" else test[1].split()[0]
+            if binary not in tools and binary not in _SHELL_BUILTINS:
+                raise ValueError(f"Healthcheck of {spec.name!r} runs {binary!r}, which {spec.image} does not "
+                                 f"provide (available: {', '.join(tools) or 'none'})")
+        return test
+
+    def _probe_test(self, spec: ServiceSpec, probe: Optional[ProbeSpec], tools: Optional[List[str]]) -> List[str]:
+        if probe is None:
+            raise ValueError(f"Healthcheck of {spec.name!r} has no test and the service has no probe")
+        if tools is None:
+            raise ValueError(f"Cannot generate a healthcheck for {spec.name!r}: "
+                             f"{spec.image} is not declared under `images`")
+        url = f"{probe.scheme}://127.0.0.1:{probe.port}{probe.path}"
+        for tool in tools:
+            if tool in _PROBE_COMMANDS:
+                return _PROBE_COMMANDS[tool](url, probe)
+        raise ValueError(f"Cannot generate a healthcheck for {spec.name!r}: {spec.image} has none of "
+                         f"{', '.join(_PROBE_COMMANDS)}")
+
+    def container(self, spec: ServiceSpec, **overrides: Any) -> Container:
+        """Create the container for `spec`; `overrides` replace generated arguments"""
+        depends_on: List[Resource] = [self.containers[name] for name in spec.depends_on
+                                      if name in self.containers]
+        container = Container(spec.name,
+            opts=ResourceOptions(parent=self.parent, depends_on=depends_on or None),
+            **{**self.container_args(spec), **overrides}
+        )
+        self.containers[spec.name] = container
+        return container
+
+    def build(self,
+              enabled: Optional[Iterable[str]] = None,
+              overrides: Optional[Mapping[str, Mapping[str, Any]]] = None) -> Dict[str, Container]:
+        """Create every enabled service of this stack, in catalog order with
+        dependencies first.
+
+        `overrides` maps service names to Container arguments that replace the
+        generated ones.
+        """
+        overrides = overrides or {}
+        for spec in self._dependency_order(self.catalog.services(self.stack, enabled)):
+            self.container(spec, **overrides.get(spec.name, {}))
+        return self.containers
+
+    @staticmethod
+    def _dependency_order(specs: List[ServiceSpec]) -> List[ServiceSpec]:
+        """Catalog order, moving each service after the services it depends on"""
+        by_name = {spec.name: spec for spec in specs}
+        ordered: Dict[str, ServiceSpec] = {}
+
+        def visit(spec: ServiceSpec, path: tuple) -> None:
+            if spec.name in ordered:
+                return
+            if spec.name in path:
+                raise ValueError(f"Dependency cycle: {' -> '.join(path + (spec.name,))}")
+            for name in spec.depends_on:
+                if name in by_name:
+                    visit(by_name[name], path + (spec.name,))
+            ordered[spec.name] = spec
+
+        for spec in specs:
+            visit(spec, ())
+        return list(ordered.values())
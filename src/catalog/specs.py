@@ -0,0 +1,266 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Mapping, Optional
+import re
+
+_SIZE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([kmgt]?)i?b?\s*$", re.IGNORECASE)
+_SIZE_MIB = {"k": 1 / 1024, "": 1, "m": 1, "g": 1024, "t": 1024 * 1024}
+
+
+def parse_memory(value: Any) -> int:
+    """Memory size such as "512m", "1.5g" or a bare number of MiB, in MiB"""
+    if isinstance(value, (int, float)):
+        return int(value)
+    match = _SIZE.match(str(value))
+    if not match:
+        raise ValueError(f"Invalid memory size {value!r}")
+    return int(float(match.group(1)) * _SIZE_MIB[match.group(2).lower()])
+
+
+def parse_limits(value: Mapping[str, Any]) -> Dict[str, int]:
+    """Container limits: memory and memory_swap sizes in MiB, cpu_shares as given"""
+    limits = {key: parse_memory(value[key]) for key in ("memory", "memory_swap") if value.get(key) is not None}
+    if value.get("cpu_shares") is not None:
+        limits["cpu_shares"] = int(value["cpu_shares"])
+    return limits
+
+
+@dataclass(slots=True)
+class PortSpec:
+    internal: int
+    external: int
+    protocol: str = "tcp"
+    ip: Optional[str] = None         # host address to bind, all interfaces when unset
+
+    @classmethod
+    def parse(cls, value: Any) -> "PortSpec":
+        """Accept "[ip:]external:internal[/protocol]" or a mapping"""
+        if isinstance(value, Mapping):
+            return cls(int(value["internal"]), int(value["external"]), value.get("protocol", "tcp"), value.get("ip"))
+        ports, _, protocol = str(value).partition("/")
+        parts = ports.split(":")
+        ip = parts.pop(0) if len(parts) == 3 else None
+        external, internal = parts[0], parts[-1]
+        return cls(int(internal), int(external), protocol or "tcp", ip)
+
+
+@dataclass(slots=True)
+class MountSpec:
+    container_path: str
+    volume: Optional[str] = None     # catalog volume key or docker volume name
+    host_path: Optional[str] = None
+    read_only: bool = False
+
+    @classmethod
+    def parse(cls, value: Any) -> "MountSpec":
+        """Accept compose-style "source:target[:ro]" or a mapping.
+
+        Sources starting with "/" or "${" are host paths, anything else is a volume.
+        """
+        if isinstance(value, Mapping):
+            return cls(
+                container_path=value["container_path"],
+                volume=value.get("volume"),
+                host_path=value.get("host_path"),
+                read_only=bool(value.get("read_only", False))
+            )
+        source, target, *mode = str(value).split(":")
+        read_only = mode == ["ro"]
+        if source.startswith(("/", "${")):
+            return cls(container_path=target, host_path=source, read_only=read_only)
+        return cls(container_path=target, volume=source, read_only=read_only)
+
+
+@dataclass(slots=True)
+class HealthcheckSpec:
+    """Docker healthcheck; an empty `test` is generated from the service's probe"""
+    test: List[str] = field(default_factory=list)
+    tier: Optional[str] = None
+    interval: str = "30s"
+    timeout: str = "10s"
+    retries: int = 3
+    start_period: Optional[str] = None
+    start_interval: Optional[str] = None
+    # Block dependants until the container is healthy; None decides from depends_on
+    wait: Optional[bool] = None
+    wait_timeout: str = "60s"
+
+    @classmethod
+    def parse(cls,
+              value: Mapping[str, Any],
+              defaults: Mapping[str, Any],
+              tiers: Optional[Mapping[str, Mapping[str, Any]]] = None) -> "HealthcheckSpec":
+        tier = value.get("tier", defaults.get("tier"))
+        if tier is not None and tier not in (tiers or {}):
+            raise ValueError(f"Unknown healthcheck tier {tier!r}, expected one of {', '.join(sorted(tiers or {}))}")
+        merged = {**defaults, **((tiers or {}).get(tier) or {}), **value}
+        return cls(
+            test=list(merged.get("test", [])),
+            tier=tier,
+            interval=merged.get("interval", "30s"),
+            timeout=merged.get("timeout", "10s"),
+            retries=int(merged.get("retries", 3)),
+            start_period=merged.get("start_period"),
+            start_interval=merged.get("start_interval"),
+            wait=merged.get("wait"),
+            wait_timeout=str(merged.get("wait_timeout", "60s"))
+        )
+
+
+@dataclass(slots=True)
+class ProbeSpec:
+    """HTTP endpoint the health prober checks on the service's container"""
+    port: int
+    path: str = "/"
+    scheme: str = "http"
+    timeout: str = "5s"
+    verify: bool = True
+    expect: List[int] = field(default_factory=list)
+
+    @classmethod
+    def parse(cls, value: Mapping[str, Any]) -> "ProbeSpec":
+        return cls(
+            port=int(value["port"]),
+            path=value.get("path", "/"),
+            scheme=value.get("scheme", "http"),
+            timeout=str(value.get("timeout", "5s")),
+            verify=bool(value.get("verify", True)),
+            expect=[int(status) for status in value.get("expect", [])]
+        )
+
+
+@dataclass(slots=True)
+class MetricsSpec:
+    """Prometheus endpoint scraped on the service's container over the mgmt network"""
+    port: int
+    path: str = "/metrics"
+    scheme: str = "http"
+    job: Optional[str] = None
+    interval: Optional[str] = None
+
+    @classmethod
+    def parse(cls, value: Mapping[str, Any]) -> "MetricsSpec":
+        return cls(
+            port=int(value["port"]),
+            path=value.get("path", "/metrics"),
+            scheme=value.get("scheme", "http"),
+            job=value.get("job"),
+            interval=str(value["interval"]) if value.get("interval") else None
+        )
+
+
+@dataclass(slots=True)
+class ResourceSpec:
+    """Capacity demand used by the resource planner (memory in MiB)"""
+    weight: float = 1.0
+    min_memory: int = 64
+    max_memory: Optional[int] = None
+    min_cpus: float = 0.0
+    heap_variable: Optional[str] = None
+    heap_ratio: float = 0.5
+
+    @classmethod
+    def parse(cls, value: Mapping[str, Any], defaults: Mapping[str, Any]) -> "ResourceSpec":
+        merged = {**defaults, **value}
+        return cls(
+            weight=float(merged.get("weight", 1.0)),
+            min_memory=parse_memory(merged.get("min_memory", 64)),
+            max_memory=parse_memory(merged["max_memory"]) if merged.get("max_memory") else None,
+            min_cpus=float(merged.get("min_cpus", 0.0)),
+            heap_variable=merged.get("heap_variable"),
+            heap_ratio=float(merged.get("heap_ratio", 0.5))
+        )
+
+
+@dataclass(slots=True)
+class VolumeSpec:
+    key: str
+    name: str
+    stack: Optional[str] = None
+    # Data volumes: Pulumi refuses to delete them, and the Docker volume is
+    # kept even once protection is lifted
+    protect: bool = False
+
+
+@dataclass(slots=True)
+class ServiceSpec:
+    name: str
+    image: str
+    stack: str
+    container_name: Optional[str] = None
+    ports: List[PortSpec] = field(default_factory=list)
+    mounts: List[MountSpec] = field(default_factory=list)
+    envs: List[str] = field(default_factory=list)
+    command: List[str] = field(default_factory=list)
+    healthcheck: Optional[HealthcheckSpec] = None
+    probe: Optional[ProbeSpec] = None
+    metrics: Optional[MetricsSpec] = None
+    networks: List[str] = field(default_factory=lambda: ["mgmt"])
+    aliases: List[str] = field(default_factory=list)
+    capabilities: List[str] = field(default_factory=list)
+    user: Optional[str] = None
+    privileged: bool = False
+    restart: Optional[str] = None
+    depends_on: List[str] = field(default_factory=list)
+    resources: ResourceSpec = field(default_factory=ResourceSpec)
+    limits: Dict[str, int] = field(default_factory=dict)
+    enabled: bool = True
+
+    @classmethod
+    def parse(cls, name: str, value: Mapping[str, Any], defaults: Mapping[str, Any]) -> "ServiceSpec":
+        merged = {**defaults, **value}
+        healthcheck = value.get("healthcheck")
+        return cls(
+            name=name,
+            image=merged["image"],
+            stack=merged["stack"],
+            container_name=merged.get("container_name"),
+            ports=[PortSpec.parse(port) for port in merged.get("ports", [])],
+            mounts=[MountSpec.parse(mount) for mount in merged.get("mounts", [])],
+            envs=[str(env) for env in merged.get("envs", [])],
+            command=[str(arg) for arg in merged.get("command", [])],
+            healthcheck=HealthcheckSpec.parse(healthcheck, defaults.get("healthcheck", {}),
+                                              defaults.get("healthcheck_tiers")) if healthcheck else None,
+            probe=ProbeSpec.parse(value["probe"]) if value.get("probe") else None,
+            metrics=MetricsSpec.parse(value["metrics"]) if value.get("metrics") else None,
+            networks=list(merged.get("networks", ["mgmt"])),
+            aliases=list(merged.get("aliases", [])),
+            capabilities=list(merged.get("capabilities", [])),
+            user=merged.get("user"),
+            privileged=bool(merged.get("privileged", False)),
+            restart=merged.get("restart"),
+            depends_on=list(merged.get("depends_on", [])),
+            resources=ResourceSpec.parse(value.get("resources", {}), defaults.get("resources", {})),
+            limits=parse_limits(merged.get("limits", {})),
+            enabled=bool(merged.get("enabled", True))
+        )
+
+
+def image_repository(image: str) -> str:
+    """`image` without its tag or digest, e.g. "grafana/loki:2.9.3" -> "grafana/loki" """
+    name = image.split("@", 1)[0]
+    repository, _, tag = name.rpartition(":")
+    return repository if repository and "/" not in tag else name
+
+
+def docker_hub_path(image: str) -> Optional[str]:
+    """Repository path of a Docker Hub image, e.g. "elasticsearch:8.12.1" -> "library/elasticsearch:8.12.1";
+    None for images hosted on another registry"""
+    first, _, rest = image.partition("/")
+    if rest and first in ("docker.io", "index.docker.io", "registry-1.docker.io"):
+        image, (first, _, rest) = rest, rest.partition("/")
+    if not rest:
+        return f"library/{image}"
+    if "." in first or ":" in first or first == "localhost":
+        return None
+    return image
+
+
+def deep_merge(base: Mapping[str, Any], override: Mapping[str, Any]) -> Dict[str, Any]:
+    """Merge `override` into a copy of `base`, recursing into nested mappings"""
+    merged = dict(base)
+    for key, value in override.items():
+        if isinstance(value, Mapping) and isinstance(merged.get(key), Mapping):
+            merged[key] = deep_merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
@@ -1,59 +1,191 @@
 from pulumi import ComponentResource, ResourceOptions, Output
-from pulumi_docker import Image, Container, Volume, ContainerCapabilitiesArgs, ContainerNetworksAdvancedArgs
-from typing import Dict, List, Union
+from pulumi_docker import (
+    BuilderVersion,
+    CacheFromArgs,
+    Container,
+    ContainerHealthcheckArgs,
+    ContainerNetworksAdvancedArgs,
+    ContainerPortArgs,
+    DockerBuildArgs,
+    Image,
+    RegistryArgs,
+)
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Union
+from src.catalog import ServiceCatalog
+from src.catalog.builder import ServiceBuilder
+
+APP_DOCKERFILE = Path(__file__).resolve().parents[2] / "config" / "app" / "Dockerfile"
+
+class AppArgs:
+    def __init__(self,
+                 context: str,
+                 registry_server: Union[str, Output[str]],
+                 registry_username: Union[str, Output[str]],
+                 registry_password: Union[str, Output[str]],
+                 name: str = "addi-aire-nextjs",
+                 dockerfile: Optional[str] = None,
+                 build_args: Optional[Dict[str, str]] = None,
+                 secrets: Optional[Dict[str, Union[str, Output[str]]]] = None,
+                 port: str = "3000",
+                 publish: bool = True,
+                 replicas: int = 1,
+                 color: str = "blue",
+                 platform: str = "linux/amd64",
+                 limits: Optional[Dict[str, int]] = None):
+        # Checkout of the Next.js app, used as build context
+        self.context = context
+        # Local registry the image and its layer cache are pushed to; pass an
+        # Output derived from the registry container so builds wait for it
+        self.registry_server = registry_server
+        self.registry_username = registry_username
+        self.registry_password = registry_password
+        self.name = name
+        self.dockerfile = dockerfile or str(APP_DOCKERFILE)
+        # Public build-time values (NEXT_PUBLIC_*); secrets never become build args
+        self.build_args = build_args or {}
+        # Server-side secrets, passed to the container environment only
+        self.secrets = secrets or {}
+        self.port = port
+        # Publish the port on the host; off behind NginxProxy, which reaches
+        # the replicas over the mgmt network
+        self.publish = publish
+        # Replicas of the active color (blue or green). Flipping the color
+        # creates the new set, waits until it is healthy, repoints the nginx
+        # upstream and only then removes the old set
+        self.replicas = replicas
+        self.color = color
+        self.platform = platform
+        self.limits = limits or {}
 
 class ContainerStack(ComponentResource):
-    def __init__(self, 
+    def __init__(self,
                  name: str,
                  network_ids: Dict[str, Union[str, Output[str]]],
                  registry_config: Dict[str, str] = None,
                  environment: str = "dev",
+                 catalog: Optional[ServiceCatalog] = None,
+                 services: Optional[Iterable[str]] = None,
+                 app: Optional[AppArgs] = None,
                  opts: ResourceOptions = None):
         super().__init__("addi-aire:compute:ContainerStack", name, None, opts)
 
-        # Create volumes
-        self.jenkins_volume = Volume("jenkins-data",
-            name="jenkins_home",
-            opts=ResourceOptions(parent=self)
-        )
+        registry_config = registry_config or {}
 
-        # Create Jenkins container
-        self.jenkins = Container("jenkins",
-            image="jenkins/jenkins:lts-jdk17",
-            name="jenkins",
-            ports=[
-                {"internal": "8080", "external": "8080"},
-                {"internal": "50000", "external": "50000"}
-            ],
-            volumes=[
-                {"volume_name": self.jenkins_volume.name, "container_path": "/var/jenkins_home"},
-                {"host_path": "/var/run/docker.sock", "container_path": "/var/run/docker.sock"}
-            ],
-            envs=[
-                f"JENKINS_OPTS=--prefix=/jenkins",
-                f"REGISTRY_USERNAME={registry_config['username']}",
-                f"REGISTRY_PASSWORD={registry_config['password']}",
-                f"DOCKER_HOST=unix:///var/run/docker.sock",
-                f"DOCKER_CERT_PATH=/certs/client",
-                f"DOCKER_TLS_VERIFY=1"
-            ],
-            networks_advanced=[ContainerNetworksAdvancedArgs(
-                name=network_ids["mgmt"],
-                aliases=["jenkins"]
-            )],
-            healthcheck={
-                "test": ["CMD", "curl", "-f", "http://localhost:8080 || exit 1"],
-                "interval": "30s",
-                "timeout": "10s",
-                "retries": "3",
-                "start_period": "60s"
-            },
-            restart="unless-stopped",
-            opts=ResourceOptions(parent=self)
-        )
+        # Jenkins and its volume are declared in config/services.yaml
+        self.builder = ServiceBuilder(self, "compute", network_ids, catalog, variables={
+            "registry_username": registry_config.get("username", ""),
+            "registry_password": registry_config.get("password", ""),
+            "environment": environment
+        })
+        self.containers = self.builder.build(enabled=services)
+        self.jenkins = self.containers.get("jenkins")
+        self.jenkins_volume = self.builder.volumes.get("jenkins-data")
+
+        # Next.js app, built from its checkout and pushed to the local registry
+        self.app_image = None
+        self.app = None
+        self.app_replicas: List[Container] = []
+        self.app_upstream = None
+        if app is not None:
+            self._create_app(name, network_ids, environment, app)
 
         self.register_outputs({
             "external_url": "http://192.168.3.26:8080",
             "internal_url": "http://jenkins:8080",
-            "container_id": self.jenkins.id
-        }) 
\ No newline at end of file
+            "container_id": self.jenkins.id if self.jenkins else None,
+            "app_image": self.app_image.repo_digest if self.app_image else None
+        })
+
+    def _create_app(self,
+                    name: str,
+                    network_ids: Dict[str, Union[str, Output[str]]],
+                    environment: str,
+                    app: AppArgs) -> None:
+        repository = Output.concat(app.registry_server, "/", app.name)
+        registry = RegistryArgs(
+            server=app.registry_server,
+            username=app.registry_username,
+            password=app.registry_password
+        )
+
+        def build(target: Optional[str], cache_from: List[Output[str]]) -> DockerBuildArgs:
+            return DockerBuildArgs(
+                context=app.context,
+                dockerfile=app.dockerfile,
+                target=target,
+                platform=app.platform,
+                builder_version=BuilderVersion.BUILDER_BUILD_KIT,
+                # Inline cache metadata makes every pushed image usable as cache_from
+                args={"BUILDKIT_INLINE_CACHE": "1", **app.build_args},
+                cache_from=CacheFromArgs(images=cache_from)
+            )
+
+        # The dependency stage is pushed as its own tag: inline cache only
+        # covers the final stage, so without it a cold builder reinstalls
+        # node_modules even when the lockfile is unchanged
+        self.app_deps_image = Image(
+            f"{name}-app-deps",
+            image_name=Output.concat(repository, ":deps"),
+            build=build("deps", [Output.concat(repository, ":deps")]),
+            registry=registry,
+            opts=ResourceOptions(parent=self)
+        )
+        self.app_image = Image(
+            f"{name}-app",
+            image_name=Output.concat(repository, f":{environment}"),
+            build=build(None, [Output.concat(repository, ":deps"), Output.concat(repository, f":{environment}")]),
+            registry=registry,
+            opts=ResourceOptions(parent=self, depends_on=[self.app_deps_image])
+        )
+
+        # One Node.js event loop per replica; `app_upstream` lists them for NginxProxy
+        self.app_replicas = []
+        self.app_upstream = {
+            "name": app.name,
+            "environment": environment,
+            "color": app.color,
+            "servers": [],
+            # Content-hashed build output (WORKDIR /app in config/app/Dockerfile)
+            "assets": "/app/.next/static"
+        }
+        for index in range(app.replicas):
+            container_name = f"{app.name}_{environment}_{app.color}_{index}"
+            container_config = {
+                'name': container_name,
+                # The pushed digest: a rebuild with changes replaces the container
+                'image': self.app_image.repo_digest,
+                'ports': [ContainerPortArgs(internal=int(app.port), external=int(app.port))]
+                         if app.publish and index == 0 else None,
+                # `next start` expects NODE_ENV=production; the stack environment is APP_ENV
+                'envs': ["NODE_ENV=production", f"APP_ENV={environment}", f"PORT={app.port}"]
+                        + [Output.secret(Output.concat(key, "=", value)) for key, value in app.secrets.items()],
+                'networks_advanced': [
+                    ContainerNetworksAdvancedArgs(name=network_ids.get(environment, network_ids["prod"]),
+                                                  aliases=["app", f"app-{app.color}"]),
+                    ContainerNetworksAdvancedArgs(name=network_ids["mgmt"], aliases=["app", f"app-{app.color}"])
+                ],
+                'healthcheck': ContainerHealthcheckArgs(
+                    tests=["CMD", "wget", "-q", "-O", "/dev/null", f"http://127.0.0.1:{app.port}/api/health"],
+                    interval="10s",
+                    timeout="5s",
+                    retries=3,
+                    start_period="30s"
+                ),
+                # Creation returns once the replica is healthy, so the upstream
+                # is only repointed at replicas that serve
+                'wait': True,
+                'wait_timeout': 180,
+                'restart': 'unless-stopped'
+            }
+            container_config.update(app.limits)
+
+            # Each replica waits for the previous one: an in-place image update
+            # replaces them one at a time while the others keep serving
+            self.app_replicas.append(Container(
+                f"{name}-app-{app.color}-{index}",
+                opts=ResourceOptions(parent=self, depends_on=self.app_replicas[-1:]),
+                **{key: value for key, value in container_config.items() if value is not None}
+            ))
+            self.app_upstream["servers"].append(f"{container_name}:{app.port}")
+        self.app = self.app_replicas[0] if self.app_replicas else None
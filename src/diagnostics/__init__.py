@@ -0,0 +1,131 @@
+"""Startup diagnostics for the Pulumi program.
+
+Kept free of third-party imports so it can be installed before `pulumi` and
+the provider SDKs are loaded.
+"""
+
+from typing import Dict, List, Optional, Tuple
+import importlib.abc
+import json
+import os
+import sys
+import time
+
+PROFILE_ENV = "ADDI_AIRE_PROFILE_IMPORTS"
+PROFILE_CONFIG_KEY = "profileImports"
+
+
+def _enabled(value) -> bool:
+    return str(value).lower() not in ("", "0", "false", "no", "none")
+
+
+def profiling_requested() -> bool:
+    """True when the env var or the `profileImports` stack config flag is set"""
+    if _enabled(os.environ.get(PROFILE_ENV, "")):
+        return True
+    # Read the stack config the way the Pulumi SDK does, without importing it
+    try:
+        stack_config = json.loads(os.environ.get("PULUMI_CONFIG", "{}"))
+    except ValueError:
+        return False
+    return any(key.split(":")[-1] == PROFILE_CONFIG_KEY and _enabled(value)
+               for key, value in stack_config.items())
+
+
+class _TimedLoader:
+    """Loader proxy that reports how long a module takes to load"""
+
+    def __init__(self, loader, profiler: "ImportProfiler", name: str) -> None:
+        self._loader = loader
+        self._profiler = profiler
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(self._loader, attr)
+
+    def create_module(self, spec):
+        # Extension modules do their real work here
+        self._profiler._enter(self._name)
+        try:
+            return self._loader.create_module(spec)
+        finally:
+            self._profiler._exit(self._name)
+
+    def exec_module(self, module):
+        self._profiler._enter(self._name)
+        try:
+            self._loader.exec_module(module)
+        finally:
+            # Hand the real loader back once the module is live
+            module.__loader__ = self._loader
+            if getattr(module, "__spec__", None) is not None:
+                module.__spec__.loader = self._loader
+            self._profiler._exit(self._name)
+
+
+class ImportProfiler(importlib.abc.MetaPathFinder):
+    """Records inclusive and self time for every module imported while active"""
+
+    def __init__(self) -> None:
+        self.timings: Dict[str, Tuple[float, float]] = {}
+        self.total = 0.0
+        self._stack: List[List] = []
+
+    @classmethod
+    def from_env(cls) -> Optional["ImportProfiler"]:
+        """Start a profiler if profiling was requested, else return None"""
+        if not profiling_requested():
+            return None
+        profiler = cls()
+        profiler.start()
+        return profiler
+
+    def start(self) -> "ImportProfiler":
+        if self not in sys.meta_path:
+            sys.meta_path.insert(0, self)
+        return self
+
+    def stop(self) -> None:
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    def find_spec(self, fullname, path=None, target=None):
+        index = sys.meta_path.index(self) if self in sys.meta_path else -1
+        for finder in sys.meta_path[index + 1:]:
+            find_spec = getattr(finder, "find_spec", None)
+            if find_spec is None:
+                continue
+            spec = find_spec(fullname, path, target)
+            if spec is None:
+                continue
+            if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                spec.loader = _TimedLoader(spec.loader, self, fullname)
+            return spec
+        return None
+
+    def _enter(self, name: str) -> None:
+        self._stack.append([name, time.perf_counter(), 0.0])
+
+    def _exit(self, name: str) -> None:
+        if not self._stack or self._stack[-1][0] != name:
+            return
+        _, started, children = self._stack.pop()
+        inclusive = time.perf_counter() - started
+        previous_inclusive, previous_self = self.timings.get(name, (0.0, 0.0))
+        self.timings[name] = (previous_inclusive + inclusive, previous_self + inclusive - children)
+        if self._stack:
+            self._stack[-1][2] += inclusive
+        else:
+            self.total += inclusive
+
+    def report(self, limit: int = 25) -> str:
+        """Format the slowest modules by self time"""
+        rows = sorted(self.timings.items(), key=lambda item: item[1][1], reverse=True)[:limit]
+        lines = [f"Imported {len(self.timings)} modules in {self.total * 1000:.0f} ms",
+                 f"{'self ms':>9} {'incl ms':>9}  module"]
+        for name, (inclusive, self_time) in rows:
+            lines.append(f"{self_time * 1000:9.1f} {inclusive * 1000:9.1f}  {name}")
+        return "\n".join(lines)
+
+    def over_budget(self, budget_ms: Optional[float]) -> bool:
+        return budget_ms is not None and self.total * 1000 > budget_ms
@@ -0,0 +1,124 @@
+"""Image digest lock and pre-pull stage.
+
+Every image the stacks reference is resolved to a manifest digest once and
+recorded in `config/images.lock.json`, which is committed with the stack
+(`python -m src.images` pins every image the catalog can run).
+Containers then run `repository@sha256:...`, so a tag moving upstream no
+longer replaces containers mid-deploy. `ImagePuller` pulls the pinned
+images as RemoteImage resources, which Pulumi creates concurrently before
+any container that uses them.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Union
+import json
+import re
+
+import pulumi
+from pulumi import ComponentResource, Output, ResourceOptions
+from pulumi_docker import RemoteImage
+
+from src.catalog.specs import docker_hub_path, image_repository
+from .resolve import ResolveError, resolve_digest
+
+DEFAULT_LOCK_PATH = Path(__file__).resolve().parents[2] / "config" / "images.lock.json"
+
+
+class ImageLock:
+    """Tag -> digest map backed by the lockfile"""
+
+    def __init__(self, path: Path = DEFAULT_LOCK_PATH, digests: Optional[Dict[str, str]] = None) -> None:
+        self.path = path
+        self.digests = dict(digests or {})
+
+    @classmethod
+    def load(cls, path: Path = DEFAULT_LOCK_PATH) -> "ImageLock":
+        digests = json.loads(path.read_text()) if path.exists() else {}
+        return cls(path, digests)
+
+    def save(self) -> None:
+        text = json.dumps(dict(sorted(self.digests.items())), indent=2) + "\n"
+        if not self.path.exists() or self.path.read_text() != text:
+            self.path.write_text(text)
+
+    def update(self,
+               images: Iterable[str],
+               refresh: bool = False,
+               workers: int = 8,
+               resolve: bool = True) -> List[str]:
+        """Resolve the images missing from the lock (all of them with `refresh`) concurrently
+        and save; returns the images that could not be resolved.
+
+        Without `resolve` (previews) nothing is fetched: missing images are
+        only reported and run by tag until the lock is updated.
+        """
+        pending = [image for image in dict.fromkeys(images)
+                   if "@" not in image and (refresh or image not in self.digests)]
+        if not pending:
+            return []
+        if not resolve:
+            for image in pending:
+                pulumi.log.warn(f"{image} is not in {self.path.name}; `pulumi up` or `python -m src.images` "
+                                f"pins it, using the tag until then")
+            return pending
+
+        def resolve(image: str) -> Union[str, ResolveError]:
+            try:
+                return resolve_digest(image)
+            except (ResolveError, OSError, ValueError, KeyError) as error:
+                return ResolveError(str(error))
+
+        failed = []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for image, result in zip(pending, executor.map(resolve, pending)):
+                if isinstance(result, ResolveError):
+                    failed.append(image)
+                    pulumi.log.warn(f"Cannot resolve {image} to a digest ({result}); using the tag")
+                else:
+                    if self.digests.get(image, result) != result:
+                        pulumi.log.info(f"{image}: {self.digests[image]} -> {result}")
+                    self.digests[image] = result
+        self.save()
+        return failed
+
+    def pin(self, image: str) -> str:
+        """`repository@digest` for a locked image, `image` unchanged otherwise"""
+        digest = self.digests.get(image)
+        return f"{image_repository(image)}@{digest}" if digest and "@" not in image else image
+
+
+def _slug(image: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "-", image.lower()).strip("-")
+
+
+class ImagePuller(ComponentResource):
+    """Pre-pulls pinned images; `refs` maps each image to the digest reference containers should use"""
+
+    def __init__(self,
+                 name: str,
+                 images: Iterable[str],
+                 lock: ImageLock,
+                 mirror: Optional[Union[str, Output[str]]] = None,
+                 opts: Optional[ResourceOptions] = None):
+        super().__init__("addi-aire:images:ImagePuller", name, None, opts)
+
+        self.images: Dict[str, RemoteImage] = {}
+        self.refs: Dict[str, Output[str]] = {}
+        for image in dict.fromkeys(images):
+            reference: Union[str, Output[str]] = lock.pin(image)
+            # Docker Hub images come through the pull-through mirror when there is one
+            path = docker_hub_path(reference)
+            if mirror is not None and path is not None:
+                reference = Output.from_input(mirror).apply(lambda host, path=path: f"{host}/{path}")
+            self.images[image] = RemoteImage(f"{name}-{_slug(image)}",
+                name=reference,
+                # Dropping an image from the stack must not delete it under a running container
+                keep_locally=True,
+                opts=ResourceOptions(parent=self)
+            )
+            self.refs[image] = self.images[image].repo_digest
+
+        self.register_outputs({
+            "images": self.refs
+        })
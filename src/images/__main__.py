@@ -0,0 +1,45 @@
+import argparse
+import logging
+import sys
+
+from src.catalog import ServiceCatalog
+from src.profiles import STACKS
+from src.registry import MAINTENANCE_IMAGE, MIRROR_IMAGE, REDIS_IMAGE, REGISTRY_IMAGE
+from src.security.vault import AUTO_VAULT_IMAGE
+from . import DEFAULT_LOCK_PATH, ImageLock
+
+log = logging.getLogger("images")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="images",
+                                     description="Pin every image the stacks can run in config/images.lock.json")
+    parser.add_argument("--refresh", action="store_true", help="re-resolve tags that are already locked")
+    parser.add_argument("--check", action="store_true",
+                        help="only report images missing from the lock, without resolving them")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--log-level", default="info")
+    return parser.parse_args()
+
+
+def main(args: argparse.Namespace) -> int:
+    # Every catalog service of every stack, whichever profile a stack selects
+    images = ServiceCatalog.load().images_of(STACKS)
+    images += [REGISTRY_IMAGE, MIRROR_IMAGE, REDIS_IMAGE, MAINTENANCE_IMAGE, AUTO_VAULT_IMAGE]
+    lock = ImageLock.load()
+    if args.check:
+        missing = lock.update(images, resolve=False)
+        log.info("%s: %d images locked, %d missing", DEFAULT_LOCK_PATH, len(lock.digests), len(missing))
+        return 1 if missing else 0
+    failed = lock.update(images, refresh=args.refresh, workers=args.workers)
+    log.info("%s: %d images locked", DEFAULT_LOCK_PATH, len(lock.digests))
+    if failed:
+        log.error("Could not resolve %s", ", ".join(failed))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    logging.basicConfig(level=arguments.log_level.upper(), format="%(asctime)s %(levelname)s %(message)s")
+    sys.exit(main(arguments))
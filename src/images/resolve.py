@@ -0,0 +1,82 @@
+"""Resolve image tags to manifest digests through the registry v2 API (stdlib only)"""
+
+from typing import Dict, Optional, Tuple
+import hashlib
+import json
+import re
+import ssl
+import urllib.error
+import urllib.parse
+import urllib.request
+
+DOCKER_HUB = "registry-1.docker.io"
+_DOCKER_HUB_ALIASES = ("docker.io", "index.docker.io", DOCKER_HUB)
+# Multi-arch indexes first, so the digest covers every platform
+MANIFEST_TYPES = ", ".join([
+    "application/vnd.oci.image.index.v1+json",
+    "application/vnd.docker.distribution.manifest.list.v2+json",
+    "application/vnd.oci.image.manifest.v1+json",
+    "application/vnd.docker.distribution.manifest.v2+json",
+])
+_CHALLENGE_PARAM = re.compile(r'(\w+)="([^"]*)"')
+
+
+class ResolveError(Exception):
+    pass
+
+
+def parse_reference(image: str) -> Tuple[str, str, str]:
+    """(registry, repository, tag) of `image`, e.g. "loki:2.9" -> ("registry-1.docker.io", "library/loki", "2.9")"""
+    if "@" in image:
+        raise ResolveError(f"{image} is already pinned to a digest")
+    first, _, rest = image.partition("/")
+    if rest and ("." in first or ":" in first or first == "localhost"):
+        registry, path = first, rest
+    else:
+        registry, path = DOCKER_HUB, image
+    if registry in _DOCKER_HUB_ALIASES:
+        registry = DOCKER_HUB
+        if "/" not in path:
+            path = f"library/{path}"
+    repository, _, tag = path.rpartition(":")
+    if not repository or "/" in tag:
+        repository, tag = path, "latest"
+    return registry, repository, tag
+
+
+def _token(challenge: str, timeout: float, context: Optional[ssl.SSLContext]) -> str:
+    """Anonymous pull token for a `Bearer realm=...,service=...,scope=...` challenge"""
+    params = dict(_CHALLENGE_PARAM.findall(challenge))
+    if "realm" not in params:
+        raise ResolveError(f"Unsupported auth challenge: {challenge}")
+    query = urllib.parse.urlencode({key: params[key] for key in ("service", "scope") if key in params})
+    with urllib.request.urlopen(f"{params['realm']}?{query}", timeout=timeout, context=context) as response:
+        body = json.load(response)
+    return body.get("token") or body["access_token"]
+
+
+def resolve_digest(image: str, timeout: float = 10.0, verify: bool = True) -> str:
+    """Manifest digest (sha256:...) the tag of `image` currently points to"""
+    registry, repository, tag = parse_reference(image)
+    url = f"https://{registry}/v2/{repository}/manifests/{tag}"
+    context = None if verify else ssl._create_unverified_context()
+    headers: Dict[str, str] = {"Accept": MANIFEST_TYPES}
+    # HEAD does not count against Docker Hub's pull rate limit; GET is the
+    # fallback for registries that omit Docker-Content-Digest
+    method = "HEAD"
+    for _ in range(3):
+        request = urllib.request.Request(url, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(request, timeout=timeout, context=context) as response:
+                digest = response.headers.get("Docker-Content-Digest")
+                if digest:
+                    return digest
+                if method == "GET":
+                    return f"sha256:{hashlib.sha256(response.read()).hexdigest()}"
+                method = "GET"
+        except urllib.error.HTTPError as error:
+            challenge = error.headers.get("WWW-Authenticate", "")
+            if error.code != 401 or "Authorization" in headers or not challenge.startswith("Bearer "):
+                raise ResolveError(f"{image}: {registry} answered {error.code} {error.reason}") from error
+            headers["Authorization"] = f"Bearer {_token(challenge, timeout, context)}"
+    raise ResolveError(f"{image}: {registry} returned no manifest digest")
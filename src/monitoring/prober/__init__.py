@@ -0,0 +1,10 @@
+"""Concurrent HTTP health prober exposing Prometheus metrics.
+
+Runs inside a stock python image (stdlib only) and is shipped into the
+container by the monitoring stack. Targets are read from a JSON file
+rendered by the Pulumi program from the containers it created:
+
+    {"interval": 15, "targets": [{"name": "grafana", "url": "http://grafana-1a2b:3000/api/health"}]}
+
+Start it with `python -m prober --config targets.json --listen :9115`.
+"""
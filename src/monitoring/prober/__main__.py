@@ -0,0 +1,42 @@
+import argparse
+import asyncio
+import json
+import logging
+import signal
+
+from .probe import Prober, Target, parse_duration
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="prober", description="Concurrent HTTP health prober")
+    parser.add_argument("--config", default="/etc/prober/targets.json", help="JSON file with interval and targets")
+    parser.add_argument("--listen", default=":9115", help="[host]:port for /metrics")
+    parser.add_argument("--interval", help="override the configured probe interval, e.g. 15s")
+    parser.add_argument("--log-level", default="INFO")
+    return parser.parse_args()
+
+
+async def main(args: argparse.Namespace) -> None:
+    with open(args.config) as handle:
+        config = json.load(handle)
+    targets = [Target.parse(value) for value in config.get("targets", [])]
+    interval = parse_duration(args.interval or config.get("interval", 15))
+
+    prober = Prober(targets, interval)
+    host, _, port = args.listen.rpartition(":")
+    server = await prober.serve(host, int(port))
+    logging.getLogger("prober").info("Probing %d targets every %.0fs, metrics on %s",
+                                     len(targets), interval, args.listen)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    async with server:
+        await prober.run(stop)
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    logging.basicConfig(level=arguments.log_level.upper(), format="%(asctime)s %(levelname)s %(message)s")
+    asyncio.run(main(arguments))
@@ -0,0 +1,158 @@
+"""Minimal HTTP/1.1 client on asyncio streams with pooled keep-alive connections"""
+
+import asyncio
+import ssl
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+from urllib.parse import urlsplit
+
+USER_AGENT = "addi-aire-prober/1"
+# Bodies are drained so the connection can be reused, but only this much is kept
+MAX_BODY = 64 * 1024
+
+Stream = Tuple[asyncio.StreamReader, asyncio.StreamWriter]
+
+
+class HTTPError(Exception):
+    """Malformed or truncated response"""
+
+
+@dataclass
+class Response:
+    status: int
+    headers: Dict[str, str] = field(default_factory=dict)
+    body: bytes = b""
+
+
+class ConnectionPool:
+    """Keeps idle connections per (scheme, host, port, verify) for reuse across probes"""
+
+    def __init__(self, max_idle_per_host: int = 2) -> None:
+        self.max_idle_per_host = max_idle_per_host
+        self._idle: Dict[tuple, List[Stream]] = {}
+        self._contexts: Dict[bool, ssl.SSLContext] = {}
+
+    def _ssl_context(self, verify: bool) -> ssl.SSLContext:
+        if verify not in self._contexts:
+            context = ssl.create_default_context()
+            if not verify:
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+            self._contexts[verify] = context
+        return self._contexts[verify]
+
+    async def request(self, url: str, method: str = "GET", verify: bool = True) -> Response:
+        parts = urlsplit(url)
+        secure = parts.scheme == "https"
+        host = parts.hostname or "localhost"
+        port = parts.port or (443 if secure else 80)
+        target = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        key = (parts.scheme, host, port, verify)
+        idle = self._idle.setdefault(key, [])
+
+        # A pooled connection may have been closed by the server while idle;
+        # retry once on a fresh connection when that happens
+        while True:
+            reused = bool(idle)
+            if reused:
+                reader, writer = idle.pop()
+            else:
+                reader, writer = await asyncio.open_connection(
+                    host, port, ssl=self._ssl_context(verify) if secure else None)
+            try:
+                response, keep_alive = await _exchange(reader, writer, method, host, port, target)
+            except (ConnectionError, asyncio.IncompleteReadError, HTTPError):
+                writer.close()
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                # Timeouts cancel mid-response; the stream is unusable afterwards
+                writer.close()
+                raise
+            if keep_alive and len(idle) < self.max_idle_per_host:
+                idle.append((reader, writer))
+            else:
+                writer.close()
+            return response
+
+    def close(self) -> None:
+        for streams in self._idle.values():
+            for _, writer in streams:
+                writer.close()
+        self._idle.clear()
+
+
+async def _exchange(reader: asyncio.StreamReader,
+                    writer: asyncio.StreamWriter,
+                    method: str,
+                    host: str,
+                    port: int,
+                    target: str) -> Tuple[Response, bool]:
+    writer.write((
+        f"{method} {target} HTTP/1.1\r\n"
+        f"Host: {host}:{port}\r\n"
+        f"User-Agent: {USER_AGENT}\r\n"
+        "Accept: */*\r\n"
+        "Connection: keep-alive\r\n\r\n"
+    ).encode("latin-1"))
+    await writer.drain()
+
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed before response")
+    try:
+        version, status, _ = (status_line.decode("latin-1").rstrip("\r\n") + " ").split(" ", 2)
+        status_code = int(status)
+    except ValueError:
+        raise HTTPError(f"bad status line {status_line[:80]!r}")
+
+    headers: Dict[str, str] = {}
+    while True:
+        line = await reader.readline()
+        if not line:
+            raise HTTPError("connection closed in headers")
+        if line in (b"\r\n", b"\n"):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+    if method == "HEAD" or status_code in (204, 304) or 100 <= status_code < 200:
+        return Response(status_code, headers), keep_alive
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        body = await _read_chunked(reader)
+    elif "content-length" in headers:
+        body = await _read_exact(reader, int(headers["content-length"]))
+    else:
+        body = (await reader.read())[:MAX_BODY]
+        keep_alive = False
+    return Response(status_code, headers, body), keep_alive
+
+
+async def _read_exact(reader: asyncio.StreamReader, length: int) -> bytes:
+    kept = bytearray()
+    while length > 0:
+        chunk = await reader.readexactly(min(length, 65536))
+        length -= len(chunk)
+        if len(kept) < MAX_BODY:
+            kept += chunk[:MAX_BODY - len(kept)]
+    return bytes(kept)
+
+
+async def _read_chunked(reader: asyncio.StreamReader) -> bytes:
+    kept = bytearray()
+    while True:
+        size_line = await reader.readline()
+        if not size_line:
+            raise HTTPError("connection closed in chunked body")
+        size = int(size_line.split(b";", 1)[0].strip() or b"0", 16)
+        if size == 0:
+            # Trailers end with an empty line
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            return bytes(kept)
+        chunk = await _read_exact(reader, size)
+        if len(kept) < MAX_BODY:
+            kept += chunk[:MAX_BODY - len(kept)]
+        await reader.readexactly(2)
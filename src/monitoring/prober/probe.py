@@ -0,0 +1,149 @@
+"""Probe scheduling, target state and the /metrics endpoint"""
+
+import asyncio
+import logging
+import re
+import ssl
+import time
+from dataclasses import dataclass, field
+from typing import Any, List, Mapping, Optional
+
+from .http import ConnectionPool, HTTPError
+from .metrics import Counter, Gauge, Histogram, Registry
+
+log = logging.getLogger("prober")
+
+_DURATION = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*(ms|s|m|h)?\s*$")
+_DURATION_SECONDS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600, None: 1}
+
+
+def parse_duration(value: Any) -> float:
+    """Seconds from a number or a Docker/Prometheus style duration such as "500ms" or "15s" """
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = _DURATION.match(str(value))
+    if not match:
+        raise ValueError(f"Invalid duration {value!r}")
+    return float(match.group(1)) * _DURATION_SECONDS[match.group(2)]
+
+
+@dataclass
+class Target:
+    name: str
+    url: str
+    timeout: float = 5.0
+    verify: bool = True
+    # Accepted status codes; any status below 400 when empty
+    expect: List[int] = field(default_factory=list)
+    up: Optional[bool] = None
+
+    @classmethod
+    def parse(cls, value: Mapping[str, Any]) -> "Target":
+        return cls(
+            name=value["name"],
+            url=value["url"],
+            timeout=parse_duration(value.get("timeout", 5)),
+            verify=bool(value.get("verify", True)),
+            expect=[int(status) for status in value.get("expect", [])]
+        )
+
+    def accepts(self, status: int) -> bool:
+        return status in self.expect if self.expect else status < 400
+
+
+class Prober:
+    def __init__(self, targets: List[Target], interval: float = 15.0) -> None:
+        self.targets = targets
+        self.interval = interval
+        self.pool = ConnectionPool()
+        self.registry = Registry()
+        self.up = self.registry.register(Gauge(
+            "addi_aire_probe_up", "Whether the last probe of the target succeeded", ["target"]))
+        self.duration = self.registry.register(Histogram(
+            "addi_aire_probe_duration_seconds", "Probe latency including connection setup", ["target"]))
+        self.status = self.registry.register(Gauge(
+            "addi_aire_probe_http_status_code", "HTTP status of the last probe, 0 without a response", ["target"]))
+        self.failures = self.registry.register(Counter(
+            "addi_aire_probe_failures_total", "Failed probes by reason", ["target", "reason"]))
+        self.last_success = self.registry.register(Gauge(
+            "addi_aire_probe_last_success_timestamp_seconds", "Unix time of the last successful probe", ["target"]))
+        self.cycle_duration = self.registry.register(Gauge(
+            "addi_aire_probe_cycle_duration_seconds", "Wall time of the last probe cycle"))
+
+    async def probe(self, target: Target) -> None:
+        started = time.monotonic()
+        status, reason = 0, None
+        try:
+            response = await asyncio.wait_for(self.pool.request(target.url, verify=target.verify), target.timeout)
+            status = response.status
+            if not target.accepts(status):
+                reason = "status"
+        except asyncio.TimeoutError:
+            reason = "timeout"
+        except ssl.SSLError:
+            reason = "tls"
+        except (OSError, asyncio.IncompleteReadError):
+            reason = "connect"
+        except HTTPError:
+            reason = "protocol"
+        elapsed = time.monotonic() - started
+
+        ok = reason is None
+        self.duration.observe(elapsed, target=target.name)
+        self.status.set(status, target=target.name)
+        self.up.set(1 if ok else 0, target=target.name)
+        if ok:
+            self.last_success.set(time.time(), target=target.name)
+        else:
+            self.failures.inc(target=target.name, reason=reason)
+
+        # Only state changes are logged so a healthy stack stays quiet in Loki
+        if ok != target.up:
+            if ok:
+                log.info("%s is up (%d in %.0f ms)", target.name, status, elapsed * 1000)
+            else:
+                log.warning("%s is down: %s (status %d, %.0f ms)", target.name, reason, status, elapsed * 1000)
+            target.up = ok
+
+    async def run_cycle(self) -> None:
+        started = time.monotonic()
+        await asyncio.gather(*(self.probe(target) for target in self.targets))
+        self.cycle_duration.set(time.monotonic() - started)
+
+    async def run(self, stop: asyncio.Event) -> None:
+        while not stop.is_set():
+            started = time.monotonic()
+            await self.run_cycle()
+            delay = max(0.0, self.interval - (time.monotonic() - started))
+            try:
+                await asyncio.wait_for(stop.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+        self.pool.close()
+
+    async def serve(self, host: str, port: int) -> asyncio.AbstractServer:
+        """Serve /metrics and /healthz"""
+
+        async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+            try:
+                request = await asyncio.wait_for(reader.readline(), 5)
+                while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+                    pass
+                path = request.split(b" ")[1].split(b"?")[0] if request.count(b" ") >= 2 else b""
+                if path == b"/metrics":
+                    status, body, kind = "200 OK", self.registry.render(), "text/plain; version=0.0.4"
+                elif path == b"/healthz":
+                    status, body, kind = "200 OK", "ok\n", "text/plain"
+                else:
+                    status, body, kind = "404 Not Found", "not found\n", "text/plain"
+                payload = body.encode()
+                writer.write(
+                    f"HTTP/1.1 {status}\r\nContent-Type: {kind}\r\n"
+                    f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload)
+                await writer.drain()
+            except (asyncio.TimeoutError, ConnectionError):
+                pass
+            finally:
+                writer.close()
+
+        return await asyncio.start_server(handle, host or None, port)
@@ -0,0 +1,103 @@
+from pathlib import Path
+from typing import Any, Dict, List, Mapping, Optional
+import hashlib
+import json
+import urllib.request
+import yaml
+
+from src.catalog.specs import MetricsSpec
+
+SOURCE_CONFIG = "prometheus.yml"
+GENERATED_CONFIG = "prometheus.generated.yml"
+TARGETS_DIR = "targets"
+# Digest of the config and targets Prometheus last reloaded successfully
+RELOADED_MARKER = ".reloaded"
+# Where Prometheus sees the config directory
+CONTAINER_CONFIG_DIR = "/etc/prometheus"
+
+
+def _write(path: Path, text: str, dry_run: bool = False) -> str:
+    """Write `text` unless the file already holds it and return its digest; a dry run only digests it"""
+    if not dry_run and (not path.exists() or path.read_text() != text):
+        path.write_text(text)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def render_prometheus_config(config_dir: Path,
+                             variables: Mapping[str, Any],
+                             jobs: Optional[Mapping[str, MetricsSpec]] = None,
+                             dry_run: bool = False) -> str:
+    """Write prometheus.generated.yml from prometheus.yml and return its digest.
+
+    Every job in `jobs` reads its targets from targets/<job>.json and takes
+    extra settings from the source job of the same name. Source jobs without
+    targets of their own are dropped when nothing discovers them.
+    `scrape_interval` and `evaluation_interval` set the global values and
+    `<job>_scrape_interval` overrides a single job. The file is only
+    rewritten when its content changes, and never on a dry run (preview).
+    """
+    source = config_dir / SOURCE_CONFIG
+    data = yaml.safe_load(source.read_text()) or {}
+    global_config = data.setdefault("global", {})
+    for key in ("scrape_interval", "evaluation_interval"):
+        if key in variables:
+            global_config[key] = str(variables[key])
+
+    declared = {job["job_name"]: job for job in data.get("scrape_configs", [])}
+    scrape_configs: List[Dict[str, Any]] = []
+    for name, spec in (jobs or {}).items():
+        job: Dict[str, Any] = {"job_name": name, "metrics_path": spec.path, "scheme": spec.scheme}
+        if spec.interval:
+            job["scrape_interval"] = spec.interval
+        job.update(declared.pop(name, {}))
+        job["file_sd_configs"] = [{"files": [f"{CONTAINER_CONFIG_DIR}/{TARGETS_DIR}/{name}.json"]}]
+        scrape_configs.append(job)
+    scrape_configs += [job for job in declared.values()
+                       if "static_configs" in job or "file_sd_configs" in job]
+
+    for job in scrape_configs:
+        interval = variables.get(f"{job['job_name'].replace('-', '_')}_scrape_interval")
+        if interval is not None:
+            job["scrape_interval"] = str(interval)
+    data["scrape_configs"] = scrape_configs
+
+    text = f"# Generated from {SOURCE_CONFIG} by the Pulumi program; do not edit\n"
+    text += yaml.safe_dump(data, sort_keys=False)
+    return _write(config_dir / GENERATED_CONFIG, text, dry_run)
+
+
+def write_targets(config_dir: Path, targets: Mapping[str, List[Dict[str, Any]]], dry_run: bool = False) -> str:
+    """Write targets/<job>.json for each job, remove files of vanished jobs and return a digest of all of them.
+
+    A dry run only computes the digest: Prometheus watches these files, so
+    writing them would change the live targets.
+    """
+    directory = config_dir / TARGETS_DIR
+    if not dry_run:
+        directory.mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha256()
+    for job in sorted(targets):
+        digest.update(f"{job}:".encode())
+        digest.update(_write(directory / f"{job}.json", json.dumps(targets[job], indent=2) + "\n", dry_run).encode())
+    if not dry_run:
+        for stale in directory.glob("*.json"):
+            if stale.stem not in targets:
+                stale.unlink()
+    return digest.hexdigest()
+
+
+def reload_prometheus(config_dir: Path, url: str, digest: str, timeout: float = 10.0) -> bool:
+    """POST /-/reload unless Prometheus already loaded `digest`; True when it reloaded.
+
+    A reload (--web.enable-lifecycle) applies new jobs and targets without a
+    restart, so the TSDB head block stays in memory. The digest is recorded
+    only after a successful reload, so a failed one is retried next run.
+    """
+    marker = config_dir / RELOADED_MARKER
+    if marker.exists() and marker.read_text() == digest:
+        return False
+    request = urllib.request.Request(f"{url.rstrip('/')}/-/reload", data=b"", method="POST")
+    with urllib.request.urlopen(request, timeout=timeout):
+        pass
+    marker.write_text(digest)
+    return True
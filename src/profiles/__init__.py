@@ -0,0 +1,79 @@
+"""Environment profiles that decide which stacks and services are built."""
+
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Mapping
+import yaml
+
+from src.catalog import ServiceCatalog
+from src.catalog.specs import deep_merge
+
+DEFAULT_PROFILES_PATH = Path(__file__).resolve().parents[2] / "config" / "profiles.yaml"
+# Used when no `profile` is set: the default stacks with the catalog defaults
+DEFAULT_PROFILE = "full"
+STACKS = ("registry", "compute", "monitoring", "storage", "vault", "proxy")
+# Stacks of profiles that do not list theirs. The proxy binds host ports 80/443
+# and needs ssl/server.crt and server.key, so only profiles naming it build it
+DEFAULT_STACKS = tuple(stack for stack in STACKS if stack != "proxy")
+
+
+@dataclass(slots=True)
+class Profile:
+    name: str
+    stacks: List[str] = field(default_factory=lambda: list(DEFAULT_STACKS))
+    services: Dict[str, List[str]] = field(default_factory=dict)
+    disabled: List[str] = field(default_factory=list)
+    variables: Dict[str, Any] = field(default_factory=dict)
+
+    @classmethod
+    def parse(cls, name: str, value: Mapping[str, Any]) -> "Profile":
+        stacks = list(value.get("stacks", DEFAULT_STACKS))
+        unknown = sorted(set(stacks) - set(STACKS))
+        if unknown:
+            raise ValueError(f"Profile {name!r} names unknown stacks: {', '.join(unknown)}")
+        return cls(
+            name=name,
+            stacks=stacks,
+            services={stack: list(names) for stack, names in value.get("services", {}).items()},
+            disabled=list(value.get("disabled", [])),
+            variables=dict(value.get("variables", {}))
+        )
+
+    def includes(self, stack: str) -> bool:
+        return stack in self.stacks
+
+    def apply(self, catalog: ServiceCatalog) -> ServiceCatalog:
+        """Disable services outside this profile and override catalog variables"""
+        for stack, allowed in self.services.items():
+            for name in catalog.names(stack):
+                if name not in allowed:
+                    catalog.override(name, {"enabled": False})
+        for name in self.disabled:
+            catalog.override(name, {"enabled": False})
+        catalog.variables.update(self.variables)
+        return catalog
+
+
+def load_profiles(config=None, path: Path = DEFAULT_PROFILES_PATH) -> Dict[str, Profile]:
+    """Profiles from config/profiles.yaml merged with the `profiles` stack config object"""
+    with open(path) as handle:
+        raw = (yaml.safe_load(handle) or {}).get("profiles", {})
+    overrides = config.get_object("profiles") if config is not None else None
+    raw = deep_merge(raw, overrides or {})
+    return {name: Profile.parse(name, value or {}) for name, value in raw.items()}
+
+
+def select_profile(config) -> Profile:
+    """The profile named by `profile`; the default stacks with unchanged catalog variables without one.
+
+    `environment` is deliberately not used as a fallback: stacks that set it
+    before profiles existed would otherwise lose whole stacks, and their
+    volumes, on the next update.
+    """
+    profiles = load_profiles(config)
+    name = config.get("profile")
+    if not name:
+        return profiles.get(DEFAULT_PROFILE) or Profile(DEFAULT_PROFILE)
+    if name not in profiles:
+        raise ValueError(f"Unknown profile {name!r}, expected one of {', '.join(sorted(profiles))}")
+    return profiles[name]
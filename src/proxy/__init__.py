@@ -1,116 +1,173 @@
-from pulumi import ComponentResource, ResourceOptions
-from pulumi_docker import Container, Volume, ContainerPortArgs, ContainerMountArgs
-from typing import Dict, List
+from pulumi import ComponentResource, ResourceOptions, Output
+from pulumi_docker import Container, ContainerUlimitArgs
+from pathlib import Path
+from typing import Dict, List, Mapping, Optional, Union
+from src.catalog import ServiceCatalog
+from src.catalog.builder import ServiceBuilder
+from src.agents.docker import DockerError
+from .assets import export_assets, precompress
+from .generator import (
+    TEMPLATE_DIR,
+    CachePurger,
+    NginxError,
+    ReloadCoalescer,
+    SiteGenerator,
+    render_cloudflare_config,
+    render_main_config,
+)
+import hashlib
+from .sites import APP_REGISTRY, AppRegistry, AppSite, CacheArgs
+import json
 import os
+import pulumi
+
+# Revision (e.g. image digest) per app whose cache was last purged for it
+CACHE_REVISIONS = ".cache-revisions.json"
+# Digest of nginx.generated.conf and cloudflare.conf nginx last reloaded with
+CONFIG_RELOADED = ".reloaded"
 
 class NginxProxy(ComponentResource):
     def __init__(self, 
                  name: str,
                  network_id: str,
                  config_dir: str = "/home/james/pulumi/config/nginx",
+                 catalog: Optional[ServiceCatalog] = None,
+                 apps: Optional[List[AppSite]] = None,
+                 app_containers: Optional[List[Container]] = None,
+                 cache: Optional[CacheArgs] = None,
+                 revisions: Optional[Mapping[str, Union[str, Output[str]]]] = None,
+                 brotli_static: bool = False,
+                 worker_processes: Union[int, str] = "auto",
+                 worker_connections: int = 1024,
+                 worker_rlimit_nofile: Optional[int] = None,
                  opts: ResourceOptions = None):
         super().__init__("addi-aire:proxy:NginxProxy", name, None, opts)
-        
-        # Create volumes for Nginx
-        self.config_volume = Volume(f"{name}-config",
-            name="nginx_config",
-            opts=ResourceOptions(parent=self)
-        )
-        
-        self.logs_volume = Volume(f"{name}-logs",
-            name="nginx_logs",
-            opts=ResourceOptions(parent=self)
-        )
 
-        # Ensure SSL directory exists
-        os.makedirs(f"{config_dir}/ssl", exist_ok=True)
-        os.makedirs(f"{config_dir}/cloudflare", exist_ok=True)
+        # The config directory is live (bind-mounted into nginx): a preview
+        # only renders in memory, `up` writes before nginx is created
+        dry_run = pulumi.runtime.is_dry_run()
+        if not dry_run:
+            os.makedirs(f"{config_dir}/ssl", exist_ok=True)
+            os.makedirs(f"{config_dir}/assets", exist_ok=True)
+
+        # nginx.conf with the worker settings and the Cloudflare real IP ranges
+        # (config/nginx/cloudflare-ips.json), both written before nginx starts;
+        # a change is applied with a reload below. Proxied requests hold two
+        # descriptors (client and upstream)
+        worker_rlimit_nofile = worker_rlimit_nofile or 2 * worker_connections
+        main_digest = render_main_config(Path(config_dir), {
+            "WORKER_PROCESSES": str(worker_processes),
+            "WORKER_CONNECTIONS": str(worker_connections),
+            "WORKER_RLIMIT_NOFILE": str(worker_rlimit_nofile)
+        }, dry_run=dry_run)
+        cloudflare_digest = render_cloudflare_config(Path(config_dir), dry_run=dry_run)
+        self.config_digest = hashlib.sha256(f"{main_digest}:{cloudflare_digest}".encode()).hexdigest()
+
+        # Nginx, its exporter sidecar and their volumes are declared in config/services.yaml
+        self.builder = ServiceBuilder(self, "proxy", {"mgmt": network_id}, catalog, variables={
+            "nginx_config_dir": config_dir
+        })
+        self.cache_volume = self.builder.volume("nginx-cache")
+        self.logs_volume = self.builder.volume("nginx-logs")
+        self.containers = self.builder.build(overrides={"nginx": {
+            "ulimits": [ContainerUlimitArgs(name="nofile", soft=worker_rlimit_nofile, hard=worker_rlimit_nofile)]
+        }})
+        self.nginx = self.containers["nginx"]
+        self.exporter = self.containers.get("nginx-exporter")
+
+        # Upstream and server block per app, for the apps in config/nginx/apps.yaml and
+        # `apps`. They are written once the app containers exist (and are
+        # healthy), so flipping an app to its other color only repoints the
+        # upstream after the new replicas serve. `cache` is the response
+        # cache of apps that do not size their own
+        self.brotli_static = brotli_static
+        self.apps = AppRegistry.load(TEMPLATE_DIR / APP_REGISTRY)
+        for site in apps or []:
+            if site.cache is None:
+                site.cache = cache
+            self.apps.add(site)
+        self.sites = self._sync_sites(Path(config_dir), app_containers or [], revisions or {})
 
-        # Nginx container
-        self.nginx = Container("nginx",
-            image="nginx:mainline",
-            ports=[
-                ContainerPortArgs(
-                    internal=80,
-                    external=80
-                ),
-                ContainerPortArgs(
-                    internal=443,
-                    external=443
-                )
-            ],
-            volumes=[
-                # Main nginx config
-                ContainerMountArgs(
-                    host_path=f"{config_dir}/nginx.conf",
-                    container_path="/etc/nginx/nginx.conf",
-                    read_only=True
-                ),
-                # App configurations
-                ContainerMountArgs(
-                    host_path=f"{config_dir}/conf.d",
-                    container_path="/etc/nginx/conf.d",
-                    read_only=True
-                ),
-                # SSL certificates
-                ContainerMountArgs(
-                    host_path=f"{config_dir}/ssl",
-                    container_path="/etc/nginx/ssl",
-                    read_only=True
-                ),
-                # Cloudflare configuration
-                ContainerMountArgs(
-                    host_path=f"{config_dir}/cloudflare",
-                    container_path="/etc/nginx/cloudflare",
-                    read_only=True
-                ),
-                # MIME types
-                ContainerMountArgs(
-                    host_path=f"{config_dir}/mime.types",
-                    container_path="/etc/nginx/mime.types",
-                    read_only=True
-                ),
-                # Logs
-                ContainerMountArgs(
-                    volume_name=self.logs_volume.name,
-                    container_path="/var/log/nginx"
-                )
-            ],
-            envs=[
-                "NGINX_ENVSUBST_TEMPLATE_DIR=/etc/nginx/templates",
-                "NGINX_ENVSUBST_TEMPLATE_SUFFIX=.template",
-                "NGINX_ENVSUBST_OUTPUT_DIR=/etc/nginx/conf.d/apps",
-                "TZ=UTC"
-            ],
-            network_id=network_id,
-            restart="unless-stopped",
-            healthcheck={
-                "test": ["CMD", "curl", "-f", "http://localhost/health"],
-                "interval": "30s",
-                "timeout": "10s",
-                "retries": 3
-            },
-            capabilities={
-                "add": ["NET_ADMIN"]
-            },
-            command=[
-                "sh", "-c",
-                """
-                # Wait for Cloudflare config
-                while [ ! -f /etc/nginx/cloudflare/cloudflare.conf ]; do
-                    echo "Waiting for Cloudflare configuration..."
-                    sleep 5
-                done
-                
-                # Start Nginx
-                nginx -g 'daemon off;'
-                """
-            ],
-            opts=ResourceOptions(parent=self)
-        )
-        
         self.register_outputs({
             "container_id": self.nginx.id,
-            "config_volume": self.config_volume.name,
-            "logs_volume": self.logs_volume.name
-        }) 
\ No newline at end of file
+            "exporter_id": self.exporter.id if self.exporter else None,
+            "cache_volume": self.cache_volume.name,
+            "logs_volume": self.logs_volume.name,
+            "upstreams": {site.upstream: site.servers for site in self.apps}
+        })
+
+    def _sync_sites(self,
+                    config_dir: Path,
+                    app_containers: List[Container],
+                    revisions: Mapping[str, Union[str, Output[str]]]) -> Output[Dict[str, str]]:
+        apps = self.apps
+
+        def sync(values: list) -> Dict[str, str]:
+            container, current = values[0], values[1]
+            if not pulumi.runtime.is_dry_run():
+                # Assets first, so the new upstream never points at missing files
+                self._sync_assets(config_dir)
+                # All sites in one pass: a single `nginx -t` and reload for the whole update
+                generator = SiteGenerator(config_dir, brotli_static=self.brotli_static)
+                reloader = ReloadCoalescer(config_dir, container, delay=0)
+                try:
+                    changed = generator.apply(apps, reloader)
+                except (OSError, DockerError, NginxError) as error:
+                    raise RuntimeError(f"Reloading nginx failed, previous app config restored: {error}")
+                if changed:
+                    pulumi.log.info(f"nginx reloaded: {', '.join(str(path) for path in changed)}")
+                self._reload_config(config_dir, reloader, bool(changed))
+                self._purge_caches(config_dir, container, current)
+            return {site.upstream: site.color for site in apps}
+
+        return Output.all(self.nginx.name, Output.from_input(dict(revisions)),
+                          *[container.id for container in app_containers]).apply(sync)
+
+    def _reload_config(self, config_dir: Path, reloader: ReloadCoalescer, reloaded: bool) -> None:
+        """Reload for a changed nginx.conf or cloudflare.conf unless the site update already did"""
+        marker = config_dir / CONFIG_RELOADED
+        if not reloaded and (not marker.exists() or marker.read_text() != self.config_digest):
+            try:
+                reloader.request()
+            except (OSError, DockerError, NginxError) as error:
+                # Not recorded, so the next update retries
+                pulumi.log.warn(f"nginx reload for the updated nginx.conf/cloudflare.conf failed: {error}")
+                return
+            pulumi.log.info("nginx reloaded with the updated nginx.conf/cloudflare.conf")
+        marker.write_text(self.config_digest)
+
+    def _sync_assets(self, config_dir: Path) -> None:
+        """Copy each app's build assets out of a replica and precompress the new ones"""
+        for site in self.apps:
+            if not site.assets or not site.servers:
+                continue
+            container = site.servers[0].rsplit(":", 1)[0]
+            try:
+                copied = export_assets(container, site.assets, config_dir / site.assets_dir)
+                # Threads: forking the program would copy its gRPC channels
+                stats = precompress(config_dir / site.assets_root, processes=False)
+            except (OSError, DockerError) as error:
+                # nginx falls back to the app for assets missing on disk
+                pulumi.log.warn(f"Cannot export the {site.upstream} assets: {error}")
+                continue
+            if copied or stats.compressed:
+                pulumi.log.info(f"{site.upstream}: {copied} assets copied, {len(stats.compressed)} compressed, "
+                                f"{stats.saved // 1024} KiB saved")
+
+    def _purge_caches(self, config_dir: Path, container: str, revisions: Mapping[str, str]) -> None:
+        """Drop the cache of every app deployed with a new revision since its last purge"""
+        marker = config_dir / CACHE_REVISIONS
+        purged = json.loads(marker.read_text()) if marker.exists() else {}
+        purger = CachePurger(container)
+        for site in self.apps:
+            revision = revisions.get(site.upstream)
+            if site.cache is None or not site.cache.enabled or not revision or purged.get(site.upstream) == revision:
+                continue
+            try:
+                purger.purge(site)
+            except (OSError, DockerError, NginxError) as error:
+                # Not recorded, so the next update retries
+                pulumi.log.warn(f"Cannot purge the {site.upstream} cache: {error}")
+                continue
+            purged[site.upstream] = revision
+            marker.write_text(json.dumps(purged, indent=2) + "\n")
@@ -0,0 +1,108 @@
+import argparse
+import logging
+import sys
+from pathlib import Path
+
+from src.agents.docker import DockerError
+from .assets import precompress
+from .generator import (
+    CLOUDFLARE_CONFIG,
+    CLOUDFLARE_RANGES,
+    TEMPLATE_DIR,
+    CachePurger,
+    NginxError,
+    ReloadCoalescer,
+    SiteGenerator,
+    render_cloudflare_config,
+    update_cloudflare_ranges,
+)
+from .sites import APP_REGISTRY, AppRegistry, AppSite
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="proxy", description="Render nginx app sites and reload nginx once")
+    parser.add_argument("--config-dir", type=Path, default=TEMPLATE_DIR, help="host directory mounted into nginx")
+    parser.add_argument("--registry", type=Path, help=f"app registry (default config/nginx/{APP_REGISTRY})")
+    parser.add_argument("--app", nargs=3, action="append", default=[], metavar=("NAME", "ENVIRONMENT", "SERVERS"),
+                        help="add or replace an app; SERVERS is a comma-separated list of host:port")
+    parser.add_argument("--server-name", help="server_name of the --app entries")
+    parser.add_argument("--remove", nargs=2, action="append", default=[], metavar=("NAME", "ENVIRONMENT"),
+                        help="drop an app and delete its site, e.g. after a failed deploy")
+    parser.add_argument("--purge", nargs=2, action="append", default=[], metavar=("NAME", "ENVIRONMENT"),
+                        help="invalidate the response cache of an app after the update, e.g. on deploy")
+    parser.add_argument("--url", action="append", default=[],
+                        help="purge only this path or URL (repeatable); the whole cache otherwise")
+    parser.add_argument("--precompress", type=Path, action="append", default=[], metavar="DIR",
+                        help="write .gz/.br siblings for the changed files under DIR before rendering")
+    parser.add_argument("--workers", type=int, help="compression processes (default: one per CPU)")
+    parser.add_argument("--brotli-static", action="store_true", help="nginx has ngx_brotli; serve .br siblings")
+    parser.add_argument("--update-cloudflare-ips", action="store_true",
+                        help=f"refresh config/nginx/{CLOUDFLARE_RANGES} from the Cloudflare API (commit the result)")
+    parser.add_argument("--container", default="nginx", help="nginx container to validate and reload")
+    parser.add_argument("--debounce", type=float, default=2.0,
+                        help="seconds to wait for further changes before reloading")
+    parser.add_argument("--log-level", default="INFO")
+    return parser.parse_args()
+
+
+def main(args: argparse.Namespace) -> int:
+    log = logging.getLogger("proxy")
+    if args.update_cloudflare_ips:
+        try:
+            changed = update_cloudflare_ranges()
+        except (OSError, ValueError, KeyError) as error:
+            log.error("Cannot fetch the Cloudflare ranges: %s", error)
+            return 1
+        log.info("%s %s", CLOUDFLARE_RANGES, "updated" if changed else "unchanged")
+        return 0
+
+    registry_path = args.registry or TEMPLATE_DIR / APP_REGISTRY
+    registry = AppRegistry.load(registry_path)
+    listed = set(registry.sites)
+    for name, environment, servers in args.app:
+        registry.add(AppSite(name, environment, servers.split(","), server_name=args.server_name))
+    removed = [AppSite(name, environment) for name, environment in args.remove]
+    for site in removed:
+        registry.remove(site)
+        if site.path in listed:
+            log.warning("%s is listed in %s; remove it there too or the next run renders it again",
+                        site.upstream, registry_path)
+
+    for root in args.precompress:
+        stats = precompress(root, args.workers)
+        log.info("%s: %d compressed, %d unchanged, %d KiB saved",
+                 root, len(stats.compressed), stats.unchanged, stats.saved // 1024)
+
+    cloudflare = args.config_dir / CLOUDFLARE_CONFIG
+    previous = cloudflare.read_text() if cloudflare.exists() else None
+    render_cloudflare_config(args.config_dir)
+
+    generator = SiteGenerator(args.config_dir, brotli_static=args.brotli_static)
+    reloader = ReloadCoalescer(args.config_dir, args.container, args.debounce)
+    try:
+        changed = generator.apply(registry, reloader, removed)
+        if not changed and previous != cloudflare.read_text():
+            reloader.request()
+            changed = [CLOUDFLARE_CONFIG]
+    except (OSError, DockerError, NginxError) as error:
+        log.error("Reloading nginx failed, previous app config restored: %s", error)
+        return 1
+
+    purger = CachePurger(args.container)
+    for name, environment in args.purge:
+        try:
+            purger.purge(AppSite(name, environment), args.url)
+        except (OSError, DockerError, NginxError) as error:
+            log.error("%s", error)
+            return 1
+        log.info("Purged %s %s", f"{name}_{environment}", ", ".join(args.url) or "cache")
+    if changed:
+        log.info("Updated %s", ", ".join(str(path) for path in changed))
+    else:
+        log.info("%d app configs unchanged, nginx not reloaded", len(registry))
+    return 0
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    logging.basicConfig(level=arguments.log_level.upper(), format="%(asctime)s %(levelname)s %(message)s")
+    sys.exit(main(arguments))
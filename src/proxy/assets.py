@@ -0,0 +1,123 @@
+"""Precompressed static assets for nginx `gzip_static` / `brotli_static`.
+
+Files under an asset root get `.gz` (and, with the `brotli` package,
+`.br`) siblings at the highest levels, written on a process pool. A
+manifest of content hashes skips files that did not change since the last
+run, so a deploy only compresses new bundles.
+"""
+
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path, PurePosixPath
+from typing import Dict, Iterable, List, Optional, Tuple
+import gzip
+import hashlib
+import io
+import json
+import tarfile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from src.agents.docker import DockerClient
+
+MANIFEST = ".precompress.json"
+COMPRESSIBLE = (".js", ".mjs", ".css", ".html", ".json", ".map", ".svg", ".txt", ".xml", ".wasm", ".ico", ".woff", ".ttf")
+# Below this the compressed response saves less than the extra file costs
+MIN_SIZE = 1024
+
+
+@dataclass
+class PrecompressStats:
+    compressed: List[str] = field(default_factory=list)
+    unchanged: int = 0
+    saved: int = 0
+
+
+def _compress(path: Path) -> Tuple[str, int]:
+    """Write the siblings of `path`; returns its content hash and the bytes saved.
+    A sibling that is not smaller than the file is removed, nginx then sends the file"""
+    data = path.read_bytes()
+    saved = 0
+    encoders = [(".gz", lambda raw: gzip.compress(raw, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        encoders.append((".br", lambda raw: brotli.compress(raw, quality=11)))
+    for suffix, encode in encoders:
+        sibling = path.with_name(path.name + suffix)
+        encoded = encode(data)
+        if len(encoded) < len(data):
+            sibling.write_bytes(encoded)
+            saved += len(data) - len(encoded)
+        else:
+            sibling.unlink(missing_ok=True)
+    return hashlib.sha256(data).hexdigest(), saved
+
+
+def _candidates(root: Path) -> Iterable[Path]:
+    for path in sorted(root.rglob("*")):
+        if path.is_file() and path.suffix in COMPRESSIBLE and path.stat().st_size >= MIN_SIZE:
+            yield path
+
+
+def precompress(root: Path, workers: Optional[int] = None, processes: bool = True) -> PrecompressStats:
+    """Compress the changed files under `root` in parallel and update the manifest.
+
+    `processes=False` uses threads instead, for callers that must not fork
+    (the Pulumi program holds gRPC channels); zlib and brotli release the
+    GIL while compressing, so threads still use every core.
+    """
+    manifest_path = root / MANIFEST
+    manifest: Dict[str, str] = json.loads(manifest_path.read_text()) if manifest_path.exists() else {}
+    stats = PrecompressStats()
+
+    pending = []
+    current: Dict[str, str] = {}
+    for path in _candidates(root):
+        name = path.relative_to(root).as_posix()
+        digest = hashlib.sha256(path.read_bytes()).hexdigest()
+        if manifest.get(name) == digest:
+            current[name] = digest
+            stats.unchanged += 1
+        else:
+            pending.append(path)
+
+    if pending:
+        executor: Executor = ProcessPoolExecutor(workers) if processes else ThreadPoolExecutor(workers)
+        with executor:
+            for path, (digest, saved) in zip(pending, executor.map(_compress, pending, chunksize=8)):
+                name = path.relative_to(root).as_posix()
+                current[name] = digest
+                stats.compressed.append(name)
+                stats.saved += saved
+
+    text = json.dumps(current, indent=2, sort_keys=True) + "\n"
+    if not manifest_path.exists() or manifest_path.read_text() != text:
+        manifest_path.write_text(text)
+    return stats
+
+
+def export_assets(container: str, source: str, target: Path, docker: Optional[DockerClient] = None) -> int:
+    """Copy the directory `source` of a container into `target`; returns the number of files written.
+
+    Files are only added or replaced, never removed: build assets are
+    content-hashed, so pages rendered by the previous release keep finding
+    theirs during a rollout.
+    """
+    stream = (docker or DockerClient(timeout=120)).archive(container, source)
+    prefix = PurePosixPath(source).name
+    count = 0
+    with tarfile.open(fileobj=io.BytesIO(stream)) as archive:
+        for member in archive.getmembers():
+            parts = PurePosixPath(member.name).parts
+            if not member.isfile() or not parts or parts[0] != prefix or ".." in parts:
+                continue
+            destination = target.joinpath(*parts[1:])
+            data = archive.extractfile(member).read()
+            if destination.exists() and destination.read_bytes() == data:
+                continue
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            destination.write_bytes(data)
+            count += 1
+    return count
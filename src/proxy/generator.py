@@ -0,0 +1,298 @@
+"""Render every app site in one pass and reload nginx once.
+
+Each site is the upstream from `nginx.tmpl` followed by the server block
+from `templates/app.conf.template`. Only `${NAME}` placeholders the
+generator knows are substituted (as with `envsubst` and a variable list),
+so nginx variables such as `$host` pass through. Files whose content is
+unchanged are not rewritten and do not trigger a reload.
+"""
+
+from pathlib import Path
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+import hashlib
+import json
+import re
+import time
+import urllib.parse
+import urllib.request
+import uuid
+
+from src.agents.docker import DockerClient
+from .sites import CONTAINER_ASSETS_DIR, AppRegistry, AppSite
+
+# Templates and app registry ship with this checkout
+TEMPLATE_DIR = Path(__file__).resolve().parents[2] / "config" / "nginx"
+MAIN_CONFIG = "nginx.conf"
+GENERATED_MAIN_CONFIG = "nginx.generated.conf"
+# Vendored Cloudflare edge ranges, rendered to cloudflare/cloudflare.conf
+CLOUDFLARE_RANGES = "cloudflare-ips.json"
+CLOUDFLARE_CONFIG = Path("cloudflare") / "cloudflare.conf"
+CLOUDFLARE_IPS_URL = "https://api.cloudflare.com/client/v4/ips"
+UPSTREAM_TEMPLATE = "nginx.tmpl"
+SERVER_TEMPLATE = Path("templates") / "app.conf.template"
+# Token of the latest reload request; see ReloadCoalescer
+PENDING_MARKER = ".reload-pending"
+_PLACEHOLDER = re.compile(r"\$\{(\w+)\}")
+# A placeholder alone on its line: multi-line values keep its indentation and
+# empty values drop the line
+_LINE_PLACEHOLDER = re.compile(r"^([ \t]*)\$\{(\w+)\}[ \t]*\n", re.MULTILINE)
+
+
+class NginxError(Exception):
+    pass
+
+
+def substitute(template: str, variables: Mapping[str, str]) -> str:
+    """Replace `${NAME}` for the names in `variables`, leaving anything else as is"""
+    def line(match: "re.Match[str]") -> str:
+        indent, name = match.groups()
+        if name not in variables:
+            return match.group(0)
+        lines = str(variables[name]).splitlines()
+        return "".join(f"{indent}{value}\n" if value else "\n" for value in lines)
+
+    template = _LINE_PLACEHOLDER.sub(line, template)
+    return _PLACEHOLDER.sub(lambda match: str(variables.get(match.group(1), match.group(0))), template)
+
+
+def render_main_config(config_dir: Path,
+                       variables: Mapping[str, str],
+                       template_dir: Path = TEMPLATE_DIR,
+                       dry_run: bool = False) -> str:
+    """Write nginx.generated.conf from nginx.conf and return its digest; unchanged files are left alone.
+    Written in place, so the single-file bind mount keeps seeing it. A dry run only digests the text"""
+    text = substitute((template_dir / MAIN_CONFIG).read_text(), variables)
+    path = config_dir / GENERATED_MAIN_CONFIG
+    if not dry_run and (not path.exists() or path.read_text() != text):
+        path.write_text(text)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def render_cloudflare_config(config_dir: Path, template_dir: Path = TEMPLATE_DIR, dry_run: bool = False) -> str:
+    """Write cloudflare/cloudflare.conf from cloudflare-ips.json and return its digest; a dry run only digests it"""
+    ranges = json.loads((template_dir / CLOUDFLARE_RANGES).read_text())
+    lines = [f"# Generated from {CLOUDFLARE_RANGES} (version {ranges['version']}) by src/proxy; do not edit"]
+    for family, key in (("IPv4", "ipv4_cidrs"), ("IPv6", "ipv6_cidrs")):
+        lines += ["", f"# Cloudflare {family}"] + [f"set_real_ip_from {cidr};" for cidr in ranges[key]]
+    text = "\n".join(lines + ["", "real_ip_header CF-Connecting-IP;", ""])
+    path = config_dir / CLOUDFLARE_CONFIG
+    if not dry_run:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if not path.exists() or path.read_text() != text:
+            path.write_text(text)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def update_cloudflare_ranges(template_dir: Path = TEMPLATE_DIR, timeout: float = 10.0) -> bool:
+    """Refresh cloudflare-ips.json from the Cloudflare API; True when the ranges changed.
+    The file is committed, so a change is reviewed before it is deployed"""
+    with urllib.request.urlopen(CLOUDFLARE_IPS_URL, timeout=timeout) as response:
+        result = json.load(response)["result"]
+    path = template_dir / CLOUDFLARE_RANGES
+    current = json.loads(path.read_text())
+    if all(current[key] == result[key] for key in ("ipv4_cidrs", "ipv6_cidrs")):
+        return False
+    updated = {**current, "version": time.strftime("%Y-%m-%d"),
+               "ipv4_cidrs": result["ipv4_cidrs"], "ipv6_cidrs": result["ipv6_cidrs"]}
+    path.write_text(json.dumps(updated, indent=2) + "\n")
+    return True
+
+
+def cache_directives(site: AppSite) -> Tuple[str, str]:
+    """(http-level proxy_cache_path, location-level directives) of the site's cache; empty when disabled"""
+    cache = site.cache
+    if cache is None or not cache.enabled:
+        return "", ""
+    path = f"""proxy_cache_path {site.cache_dir} levels=1:2 keys_zone={site.upstream}:{cache.keys_zone} max_size={cache.max_size} inactive={cache.inactive} use_temp_path=off;
+# API routes are per user and send no Cache-Control by default: never cached
+map $request_uri ${site.upstream}_no_cache {{
+    default "";
+    ~^/api/ 1;
+}}"""
+    location = f"""
+# Only responses that ask for it (Cache-Control public/max-age/s-maxage, as
+# Next.js sends for static and ISR pages) are cached; there is no
+# proxy_cache_valid fallback. The key has no cookie, so requests carrying
+# credentials neither read nor fill the cache
+proxy_cache {site.upstream};
+proxy_cache_key $host$request_uri;
+# One request per key fills a missing entry; the others wait for it
+proxy_cache_lock on;
+proxy_cache_lock_timeout 5s;
+# Expired entries are served while one background request refreshes them,
+# and also while the upstream is failing
+proxy_cache_use_stale error timeout updating http_500 http_502 http_503 http_504;
+proxy_cache_background_update on;
+proxy_cache_revalidate on;
+proxy_cache_bypass $http_authorization $http_cookie ${site.upstream}_no_cache;
+proxy_no_cache $http_authorization $http_cookie ${site.upstream}_no_cache;"""
+    return path, location
+
+
+
+class ReloadCoalescer:
+    """Coalesces reload requests into a single `nginx -t` and graceful reload.
+
+    A request records its token in `.reload-pending` and waits `delay`
+    seconds. Only the request whose token is still there afterwards
+    validates and reloads, so deploying several apps back to back (also
+    from separate processes) respawns the workers once.
+    """
+
+    def __init__(self, config_dir: Path, container: str, delay: float = 2.0,
+                 docker: Optional[DockerClient] = None) -> None:
+        self.marker = config_dir / PENDING_MARKER
+        self.container = container
+        self.delay = delay
+        self.docker = docker or DockerClient(timeout=60)
+
+    def request(self) -> bool:
+        """True when this request reloaded nginx, False when a later one took over"""
+        token = uuid.uuid4().hex
+        self.marker.write_text(token)
+        if self.delay > 0:
+            time.sleep(self.delay)
+        if not self.marker.exists() or self.marker.read_text() != token:
+            return False
+        try:
+            self.reload()
+        finally:
+            self.marker.unlink(missing_ok=True)
+        return True
+
+    def reload(self) -> None:
+        code, output = self.docker.exec(self.container, ["nginx", "-t"])
+        if code != 0:
+            raise NginxError(f"nginx -t failed in {self.container}: {output.strip()}")
+        code, output = self.docker.exec(self.container, ["nginx", "-s", "reload"])
+        if code != 0:
+            raise NginxError(f"nginx reload failed in {self.container}: {output.strip()}")
+
+
+def cache_file(site: AppSite, url: str) -> str:
+    """Cache file of `url` (a path on the site's host or a full URL) inside the nginx container"""
+    parts = urllib.parse.urlsplit(url)
+    uri = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+    key = hashlib.md5(f"{parts.netloc or site.hostname}{uri}".encode(), usedforsecurity=False).hexdigest()
+    # levels=1:2 nests by the last character, then the two before it
+    return f"{site.cache_dir}/{key[-1]}/{key[-3:-1]}/{key}"
+
+
+def asset_directives(site: AppSite, brotli_static: bool = False) -> str:
+    """Locations serving the site's precompressed assets from disk; empty without assets"""
+    if not site.assets:
+        return ""
+    brotli = "\n    brotli_static on;" if brotli_static else ""
+    return f"""# Build assets from disk with their .gz/.br siblings; misses go to the app
+location ^~ {site.assets_prefix} {{
+    root {CONTAINER_ASSETS_DIR}/{site.upstream};
+    gzip_static on;{brotli}
+    expires max;
+    try_files $uri @{site.upstream};
+}}
+
+location @{site.upstream} {{
+    proxy_pass http://{site.upstream};
+    proxy_http_version 1.1;
+    proxy_set_header Connection "";
+    proxy_set_header Host $host;
+}}
+
+"""
+
+
+class CachePurger:
+    """Invalidates cached responses by removing their files in the nginx container.
+
+    Open-source nginx has no proxy_cache_purge; a missing file is a cache
+    miss, and the cache manager drops the stale key when it evicts.
+    """
+
+    def __init__(self, container: str, docker: Optional[DockerClient] = None) -> None:
+        self.container = container
+        self.docker = docker or DockerClient(timeout=60)
+
+    def purge(self, site: AppSite, urls: Iterable[str] = ()) -> None:
+        """Remove the cached `urls` of `site`, or its whole cache without any"""
+        files = [cache_file(site, url) for url in urls]
+        if files:
+            command = ["rm", "-f", *files]
+        else:
+            command = ["sh", "-c", 'test ! -d "$1" || find "$1" -type f -delete', "purge", site.cache_dir]
+        code, output = self.docker.exec(self.container, command)
+        if code != 0:
+            raise NginxError(f"Purging the {site.upstream} cache failed in {self.container}: {output.strip()}")
+
+
+class SiteGenerator:
+    def __init__(self, config_dir: Path, template_dir: Path = TEMPLATE_DIR, brotli_static: bool = False) -> None:
+        self.config_dir = config_dir
+        # Needs an nginx built with ngx_brotli; the official image only has gzip_static
+        self.brotli_static = brotli_static
+        self.upstream_template = (template_dir / UPSTREAM_TEMPLATE).read_text()
+        self.server_template = (template_dir / SERVER_TEMPLATE).read_text()
+
+    def render(self, site: AppSite) -> str:
+        cache_path, cache = cache_directives(site)
+        variables = {
+            "CACHE_PATH": cache_path,
+            "CACHE": cache,
+            "ASSETS": asset_directives(site, self.brotli_static),
+            "APP_NAME": site.name,
+            "ENVIRONMENT": site.environment,
+            "SERVER_NAME": site.hostname,
+            "UPSTREAM": site.upstream,
+            "KEEPALIVE": str(site.keepalive),
+            "SERVERS": "\n".join(f"server {server} max_fails={site.max_fails} "
+                                 f"fail_timeout={site.fail_timeout} resolve;" for server in site.servers)
+        }
+        header = f"# Generated for {site.name} ({site.environment}, {site.color}) by src/proxy; do not edit\n"
+        return header + substitute(self.upstream_template, variables) + "\n" + substitute(self.server_template, variables)
+
+    def render_all(self, registry: AppRegistry) -> Dict[Path, str]:
+        return {site.path: self.render(site) for site in registry}
+
+    def write(self, registry: AppRegistry) -> Dict[Path, str]:
+        """Write the sites whose content changed; returns their previous content ("" for new files)"""
+        changes = {}
+        for path, text in self.render_all(registry).items():
+            target = self.config_dir / path
+            previous = target.read_text() if target.exists() else ""
+            if previous == text:
+                continue
+            target.parent.mkdir(parents=True, exist_ok=True)
+            target.write_text(text)
+            changes[path] = previous
+        return changes
+
+    def remove(self, sites: Iterable[AppSite]) -> Dict[Path, str]:
+        """Delete the sites of removed apps; returns their previous content"""
+        changes = {}
+        for site in sites:
+            target = self.config_dir / site.path
+            if target.exists():
+                changes[site.path] = target.read_text()
+                target.unlink()
+        return changes
+
+    def restore(self, changes: Mapping[Path, str]) -> None:
+        for path, previous in changes.items():
+            if previous:
+                (self.config_dir / path).write_text(previous)
+            else:
+                (self.config_dir / path).unlink(missing_ok=True)
+
+    def apply(self,
+              registry: AppRegistry,
+              reloader: ReloadCoalescer,
+              removed: Iterable[AppSite] = ()) -> List[Path]:
+        """Write changed sites, delete those of `removed` apps and request one reload;
+        a rejected config is restored. Returns the changed paths"""
+        changes = {**self.write(registry), **self.remove(removed)}
+        if changes:
+            try:
+                reloader.request()
+            except Exception:
+                self.restore(changes)
+                raise
+        return list(changes)
@@ -0,0 +1,110 @@
+"""Apps served by NginxProxy and the registry they are rendered from"""
+
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional
+import yaml
+
+# Relative to the nginx config directory; nginx.conf includes conf.d/apps/*/*.conf
+APPS_DIR = Path("conf.d") / "apps"
+APP_REGISTRY = "apps.yaml"
+# On the nginx-cache volume; one directory and keys zone per app
+CACHE_DIR = "/var/cache/nginx/proxy"
+# Precompressed build assets, one root per app: assets/<upstream> on the host
+ASSETS_DIR = "assets"
+CONTAINER_ASSETS_DIR = "/usr/share/nginx/assets"
+
+
+@dataclass
+class CacheArgs:
+    """Response cache of an app: keys in shared memory, bodies on the nginx-cache volume"""
+    enabled: bool = True
+    # Disk budget; the cache manager evicts least recently used entries above it
+    max_size: str = "1g"
+    # Shared memory for keys, about 8000 entries per megabyte
+    keys_zone: str = "10m"
+    # Entries not requested for this long are removed regardless of freshness
+    inactive: str = "7d"
+
+
+@dataclass
+class AppSite:
+    name: str
+    environment: str
+    servers: List[str] = field(default_factory=list)
+    color: str = "blue"
+    server_name: Optional[str] = None
+    # Idle connections each worker keeps open to the upstream
+    keepalive: int = 32
+    # Passive health: a replica failing `max_fails` times is skipped for `fail_timeout`
+    max_fails: int = 3
+    fail_timeout: str = "10s"
+    cache: Optional[CacheArgs] = None
+    # Build asset directory in the app container (e.g. /app/.next/static),
+    # copied out, precompressed and served by nginx under `assets_prefix`
+    assets: Optional[str] = None
+    assets_prefix: str = "/_next/static/"
+
+    def __post_init__(self) -> None:
+        if isinstance(self.cache, Mapping):
+            self.cache = CacheArgs(**self.cache)
+
+    @classmethod
+    def from_upstream(cls, upstream: Mapping[str, Any], **overrides: Any) -> "AppSite":
+        """AppSite for a ContainerStack `app_upstream`"""
+        return cls(name=upstream["name"], environment=upstream["environment"],
+                   servers=list(upstream["servers"]), color=upstream.get("color", "blue"),
+                   assets=upstream.get("assets"), **overrides)
+
+    @property
+    def upstream(self) -> str:
+        return f"{self.name}_{self.environment}"
+
+    @property
+    def hostname(self) -> str:
+        return self.server_name or f"{self.name}.{self.environment}.addidaire.com"
+
+    @property
+    def cache_dir(self) -> str:
+        return f"{CACHE_DIR}/{self.upstream}"
+
+    @property
+    def assets_root(self) -> Path:
+        """Host directory nginx serves the assets from, relative to the config directory"""
+        return Path(ASSETS_DIR) / self.upstream
+
+    @property
+    def assets_dir(self) -> Path:
+        """Where the container's `assets` directory is copied to"""
+        return self.assets_root / self.assets_prefix.strip("/")
+
+    @property
+    def path(self) -> Path:
+        return APPS_DIR / self.environment / f"{self.name}.conf"
+
+
+class AppRegistry:
+    """Apps by config path; adding an app with the same name and environment replaces it"""
+
+    def __init__(self, sites: Iterable[AppSite] = ()) -> None:
+        self.sites: Dict[Path, AppSite] = {}
+        for site in sites:
+            self.add(site)
+
+    @classmethod
+    def load(cls, path: Path) -> "AppRegistry":
+        data = yaml.safe_load(path.read_text()) if path.exists() else None
+        return cls(AppSite(**entry) for entry in (data or {}).get("apps") or [])
+
+    def add(self, site: AppSite) -> None:
+        self.sites[site.path] = site
+
+    def remove(self, site: AppSite) -> bool:
+        """Drop the app with the same name and environment; False if it was not registered"""
+        return self.sites.pop(site.path, None) is not None
+
+    def __iter__(self) -> Iterator[AppSite]:
+        return iter(self.sites.values())
+
+    def __len__(self) -> int:
+        return len(self.sites)
@@ -1,17 +1,104 @@
-from pulumi import ComponentResource, ResourceOptions, Config, Output
+from pulumi import ComponentResource, ResourceOptions, Config, Input, Output
 import pulumi_docker as docker
 import os
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Union
+from src.agents import DOCKER_MODULE, agent_args
+from .config import (
+    GENERATED_CONFIG,
+    GENERATED_MIRROR_CONFIG,
+    REDIS_ALIAS,
+    mirror_config,
+    registry_config,
+    write_config,
+)
+
+DOCKER_HUB = "https://registry-1.docker.io"
+REGISTRY_IMAGE = "registry:2"
+# distribution 3 (registry:3) is the first release that honours proxy.ttl
+MIRROR_IMAGE = "registry:3"
+REDIS_IMAGE = "redis:7-alpine"
+MAINTENANCE_IMAGE = "python:3.12-alpine"
+MAINTENANCE_PACKAGE = Path(__file__).resolve().parent / "maintenance"
+MAINTENANCE_PORT = 9116
+# Tags retention never deletes: moving tags, the app's layer cache (:deps) and
+# environment images (:dev/:prod, which running replicas reference) and semantic versions
+DEFAULT_KEEP_PATTERN = r"^(latest|stable|main|deps|dev|prod|v?\d+\.\d+\.\d+)$"
 
 class RegistryArgs:
     def __init__(self,
                  host: str = "192.168.3.26",
                  port: str = "5000",
-                 config_path: Optional[str] = None) -> None:
+                 config_path: Optional[str] = None,
+                 cert_fingerprint: Optional[str] = None,
+                 limits: Optional[Dict[str, int]] = None,
+                 debug_port: str = "5002",
+                 images: Optional[Dict[str, Union[str, Output[str]]]] = None,
+                 redis: bool = False,
+                 redis_limits: Optional[Dict[str, int]] = None,
+                 mirror: bool = False,
+                 mirror_port: str = "5001",
+                 mirror_remote: str = DOCKER_HUB,
+                 mirror_ttl: str = "168h",
+                 mirror_debug_port: str = "5003",
+                 mirror_username: Optional[Input[str]] = None,
+                 mirror_password: Optional[Input[str]] = None,
+                 mirror_limits: Optional[Dict[str, int]] = None,
+                 admin_username: str = "admin",
+                 admin_password: Optional[Input[str]] = None,
+                 keep_last: int = 10,
+                 keep_pattern: str = DEFAULT_KEEP_PATTERN,
+                 maintenance_schedule: str = "03:30",
+                 maintenance_limits: Optional[Dict[str, int]] = None) -> None:
         self.host = host
         self.port = port
         self.config_path = config_path or "config/registry"
+        # Changing the fingerprint replaces the container so a rotated cert is picked up
+        self.cert_fingerprint = cert_fingerprint
+        # memory / memory_swap (MiB) and cpu_shares from the resource planner
+        self.limits = limits or {}
+        # Digest references of pre-pulled images (src/images), by tag
+        self.images = images or {}
+        # Plain-HTTP debug listener serving Prometheus metrics on /metrics
+        self.debug_port = debug_port
+        # Redis blob-descriptor cache: survives restarts and is shared by the
+        # registry, its mirror and any further replicas
+        self.redis = redis
+        self.redis_limits = redis_limits or {}
+        # Pull-through cache of `mirror_remote` on its own port and volume; cached
+        # content expires `mirror_ttl` after it was last pulled from upstream
+        self.mirror = mirror
+        self.mirror_port = mirror_port
+        self.mirror_remote = mirror_remote
+        self.mirror_ttl = mirror_ttl
+        self.mirror_debug_port = mirror_debug_port
+        # Docker Hub credentials raise the upstream pull rate limit; optional
+        self.mirror_username = mirror_username
+        self.mirror_password = mirror_password
+        self.mirror_limits = mirror_limits or {}
+        # Retention and GC (src/registry/maintenance) run daily when the admin
+        # password is known: per repository the newest `keep_last` tags and every
+        # tag matching `keep_pattern` survive
+        self.admin_username = admin_username
+        self.admin_password = admin_password
+        self.keep_last = keep_last
+        self.keep_pattern = keep_pattern
+        self.maintenance_schedule = maintenance_schedule
+        self.maintenance_limits = maintenance_limits or {}
+
+    def image(self, image: str) -> Union[str, Output[str]]:
+        return self.images.get(image, image)
+
+    def required_images(self) -> List[str]:
+        """Images the registry containers run with these arguments"""
+        images = [REGISTRY_IMAGE]
+        if self.admin_password is not None:
+            images.append(MAINTENANCE_IMAGE)
+        if self.mirror:
+            images.append(MIRROR_IMAGE)
+        if self.redis:
+            images.append(REDIS_IMAGE)
+        return images
 
 class Registry(ComponentResource):
     def __init__(self,
@@ -43,14 +130,27 @@ class Registry(ComponentResource):
             opts=ResourceOptions(parent=self)
         )
 
+        # config.yml is rendered from RegistryArgs; its digest label restarts the
+        # registry when the rendered file changes
+        config_digest = write_config(config_dir / GENERATED_CONFIG, registry_config(args))
+
+        # Optional Redis blob-descriptor cache
+        self.redis = None
+        if args.redis:
+            self._create_redis(name, network_id, args)
+
         # Container configuration
         container_config = {
             'name': name,
-            'image': 'registry:2',
+            'image': args.image(REGISTRY_IMAGE),
             'ports': [{
                 'internal': str(args.port),
                 'external': str(args.port),
                 'protocol': 'tcp'
+            }, {
+                'internal': str(args.debug_port),
+                'external': str(args.debug_port),
+                'protocol': 'tcp'
             }],
             'volumes': [
                 docker.ContainerVolumeArgs(
@@ -58,68 +158,297 @@ class Registry(ComponentResource):
                     container_path='/var/lib/registry'
                 ),
                 docker.ContainerVolumeArgs(
-                    host_path=str(config_dir / 'config.yml'),
-                    container_path='/etc/docker/registry/config.yml'
+                    host_path=str(config_dir / GENERATED_CONFIG),
+                    container_path='/etc/docker/registry/config.yml',
+                    read_only=True
                 ),
                 docker.ContainerVolumeArgs(
                     host_path=str(certs_dir),
                     container_path='/certs'
                 ),
                 docker.ContainerVolumeArgs(
-                    host_path=str(auth_dir),
+                    # With an admin password the path resolves only once its
+                    # htpasswd entry is written, so the registry never starts without it
+                    host_path=Output.unsecret(Output.from_input(args.admin_password).apply(lambda _: str(auth_dir)))
+                              if args.admin_password is not None else str(auth_dir),
                     container_path='/auth'
                 )
             ],
             'restart': 'always',
+            'labels': [
+                docker.ContainerLabelArgs(
+                    label='addi-aire.tls-fingerprint',
+                    value=args.cert_fingerprint or ''
+                ),
+                docker.ContainerLabelArgs(
+                    label='addi-aire.config-hash',
+                    value=config_digest
+                )
+            ],
             'networks_advanced': [
                 docker.ContainerNetworksAdvancedArgs(
                     name=network_id,
                     aliases=["registry"]
                 )
             ],
-            'envs': [
-                f"REGISTRY_HTTP_ADDR=0.0.0.0:{args.port}",
-                f"REGISTRY_HTTP_TLS_CERTIFICATE=/certs/registry.crt",
-                f"REGISTRY_HTTP_TLS_KEY=/certs/registry.key"
-            ],
-            'healthcheck': {
-                'test': ["CMD", "curl", "-f", f"https://localhost:{args.port}/v2/ || exit 1"],
-                'interval': "30s",
-                'timeout': "10s",
-                'retries': "3",
-                'start_period': "10s"
-            }
+            # registry:2 is Alpine based and ships busybox wget, not curl; `/` answers
+            # 200 without credentials whereas /v2/ needs auth
+            'healthcheck': docker.ContainerHealthcheckArgs(
+                tests=["CMD", "wget", "-q", "-O", "/dev/null", "--no-check-certificate",
+                       f"https://127.0.0.1:{args.port}/"],
+                interval="5s",
+                timeout="2s",
+                retries=3,
+                start_period="10s"
+            )
         }
+        container_config.update(args.limits)
 
         # Create registry container
         self.container = docker.Container(
             name,
             opts=ResourceOptions(
                 parent=self,
-                depends_on=[self.volume],
+                depends_on=[self.volume] + ([self.redis] if self.redis else []),
                 custom_timeouts={"create": "10m", "update": "10m", "delete": "10m"}
             ),
             **container_config
         )
 
-        # Prometheus monitoring configuration
-        self.monitoring_config = {
+        # Pull-through Docker Hub mirror
+        self.mirror = None
+        self.mirror_volume = None
+        self.mirror_address = None
+        if args.mirror:
+            self._create_mirror(name, network_id, args, certs_dir)
+
+        # Retention and garbage collection
+        self.maintenance = None
+        if args.admin_password is not None:
+            self._create_maintenance(name, network_id, args, certs_dir)
+
+        # Prometheus scrape jobs for the debug listeners (plain HTTP, no auth),
+        # addressed by container name on the mgmt network
+        self.scrape_configs: List[Dict[str, Any]] = [{
             'job_name': 'registry',
             'metrics_path': '/metrics',
-            'scheme': 'https',
-            'tls_config': {
-                'ca_file': '/etc/docker/certs.d/{args.host}:{args.port}/ca.crt',
-                'insecure_skip_verify': "true"
-            },
+            'scheme': 'http',
             'static_configs': [{
-                'targets': [f'{args.host}:{args.port}']
+                'targets': [f'{name}:{args.debug_port}']
             }]
-        }
+        }]
+        if self.mirror:
+            self.scrape_configs.append({
+                'job_name': 'registry-mirror',
+                'metrics_path': '/metrics',
+                'scheme': 'http',
+                'static_configs': [{
+                    'targets': [f'{name}-mirror:{args.mirror_debug_port}']
+                }]
+            })
+        self.monitoring_config = self.scrape_configs[0]
 
         # Register component outputs
         self.register_outputs({
             'volume_name': self.volume.name,
             'container_id': self.container.id,
             'registry_url': Output.concat("https://", args.host, ":", Output.from_input(args.port)),
-            'monitoring_config': self.monitoring_config
-        }) 
\ No newline at end of file
+            'monitoring_config': self.monitoring_config,
+            'scrape_configs': self.scrape_configs,
+            'mirror_url': f"https://{args.host}:{args.mirror_port}" if self.mirror else None,
+            'maintenance_metrics': f"http://{args.host}:{MAINTENANCE_PORT}/metrics" if self.maintenance else None
+        })
+
+    def _create_mirror(self, name: str, network_id: str, args: RegistryArgs, certs_dir: Path) -> None:
+        self.mirror_volume = docker.Volume(
+            f"{name}-mirror-volume",
+            name=f"{name}-mirror-volume",
+            opts=ResourceOptions(parent=self)
+        )
+        config_path = certs_dir.parent / GENERATED_MIRROR_CONFIG
+        config_digest = write_config(config_path, mirror_config(args))
+        # Upstream credentials stay out of the rendered file
+        envs = []
+        if args.mirror_username is not None and args.mirror_password is not None:
+            envs += [
+                Output.concat("REGISTRY_PROXY_USERNAME=", args.mirror_username),
+                Output.secret(Output.concat("REGISTRY_PROXY_PASSWORD=", args.mirror_password))
+            ]
+        container_config = {
+            'name': f"{name}-mirror",
+            'image': args.image(MIRROR_IMAGE),
+            'ports': [{
+                'internal': str(args.mirror_port),
+                'external': str(args.mirror_port),
+                'protocol': 'tcp'
+            }, {
+                'internal': str(args.mirror_debug_port),
+                'external': str(args.mirror_debug_port),
+                'protocol': 'tcp'
+            }],
+            'volumes': [
+                docker.ContainerVolumeArgs(
+                    volume_name=self.mirror_volume.name,
+                    container_path='/var/lib/registry'
+                ),
+                docker.ContainerVolumeArgs(
+                    host_path=str(config_path),
+                    container_path='/etc/distribution/config.yml',
+                    read_only=True
+                ),
+                docker.ContainerVolumeArgs(
+                    host_path=str(certs_dir),
+                    container_path='/certs',
+                    read_only=True
+                )
+            ],
+            'restart': 'always',
+            'labels': [
+                docker.ContainerLabelArgs(
+                    label='addi-aire.tls-fingerprint',
+                    value=args.cert_fingerprint or ''
+                ),
+                docker.ContainerLabelArgs(
+                    label='addi-aire.config-hash',
+                    value=config_digest
+                )
+            ],
+            'networks_advanced': [
+                docker.ContainerNetworksAdvancedArgs(
+                    name=network_id,
+                    aliases=["registry-mirror"]
+                )
+            ],
+            'envs': envs or None,
+            'healthcheck': docker.ContainerHealthcheckArgs(
+                tests=["CMD", "wget", "-q", "-O", "/dev/null", "--no-check-certificate",
+                       f"https://127.0.0.1:{args.mirror_port}/"],
+                interval="5s",
+                timeout="2s",
+                retries=3,
+                start_period="10s"
+            ),
+            # Every mirrored image is pulled through this container, so it must be serving first
+            'wait': True,
+            'wait_timeout': 60
+        }
+        container_config.update(args.mirror_limits)
+
+        self.mirror = docker.Container(
+            f"{name}-mirror",
+            opts=ResourceOptions(parent=self, depends_on=[self.mirror_volume] + ([self.redis] if self.redis else [])),
+            **container_config
+        )
+        # host:port for image references; resolving through it makes consumers depend on the mirror
+        self.mirror_address = self.mirror.id.apply(lambda _: f"{args.host}:{args.mirror_port}") 
+
+    def _create_maintenance(self, name: str, network_id: str, args: RegistryArgs, certs_dir: Path) -> None:
+        image = args.image(MAINTENANCE_IMAGE)
+        if image == MAINTENANCE_IMAGE and self.mirror_address is not None:
+            image = Output.concat(self.mirror_address, "/library/", image)
+        maintenance_config = {
+            'name': f"{name}-maintenance",
+            'image': image,
+            'ports': [{
+                'internal': str(MAINTENANCE_PORT),
+                'external': str(MAINTENANCE_PORT),
+                'protocol': 'tcp'
+            }],
+            'volumes': [
+                # Read-only: only used to measure blob storage
+                docker.ContainerVolumeArgs(
+                    volume_name=self.volume.name,
+                    container_path='/var/lib/registry',
+                    read_only=True
+                ),
+                docker.ContainerVolumeArgs(
+                    host_path=str(certs_dir),
+                    container_path='/certs',
+                    read_only=True
+                ),
+                # Swaps the registry for a read-only clone while GC runs
+                docker.ContainerVolumeArgs(
+                    host_path='/var/run/docker.sock',
+                    container_path='/var/run/docker.sock'
+                )
+            ],
+            'restart': 'always',
+            'networks_advanced': [
+                docker.ContainerNetworksAdvancedArgs(
+                    name=network_id,
+                    aliases=["registry-maintenance"]
+                )
+            ],
+            'command': ["python", "-m", "maintenance", "daemon", "--listen", f":{MAINTENANCE_PORT}"],
+            'healthcheck': docker.ContainerHealthcheckArgs(
+                tests=["CMD", "python", "-c",
+                       f"import urllib.request; urllib.request.urlopen('http://127.0.0.1:{MAINTENANCE_PORT}/healthz', timeout=5)"],
+                interval="30s",
+                timeout="5s",
+                retries=3,
+                start_period="10s"
+            ),
+            **agent_args(MAINTENANCE_PACKAGE, envs=[
+                "TZ=UTC",
+                # The certificate covers the host address, not the network alias
+                f"REGISTRY_URL=https://{args.host}:{args.port}",
+                f"REGISTRY_CONTAINER={name}",
+                f"REGISTRY_USERNAME={args.admin_username}",
+                Output.secret(Output.concat("REGISTRY_PASSWORD=", args.admin_password)),
+                f"REGISTRY_KEEP_LAST={args.keep_last}",
+                f"REGISTRY_KEEP_PATTERN={args.keep_pattern}",
+                f"REGISTRY_GC_SCHEDULE={args.maintenance_schedule}"
+            ], modules=[DOCKER_MODULE])
+        }
+        maintenance_config.update(args.maintenance_limits)
+
+        self.maintenance = docker.Container(
+            f"{name}-maintenance",
+            opts=ResourceOptions(parent=self, depends_on=[self.container]),
+            **maintenance_config
+        )
+
+    def _create_redis(self, name: str, network_id: str, args: RegistryArgs) -> None:
+        self.redis_volume = docker.Volume(
+            f"{name}-redis-volume",
+            name=f"{name}-redis-volume",
+            opts=ResourceOptions(parent=self)
+        )
+        # Cap Redis below the container limit so it evicts instead of being OOM-killed
+        maxmemory = int(args.redis_limits["memory"] * 0.8) if "memory" in args.redis_limits else 256
+        redis_config = {
+            'name': f"{name}-redis",
+            'image': args.image(REDIS_IMAGE),
+            'command': ["redis-server", "--appendonly", "yes", "--maxmemory", f"{maxmemory}mb",
+                        "--maxmemory-policy", "allkeys-lru"],
+            'volumes': [
+                docker.ContainerVolumeArgs(
+                    volume_name=self.redis_volume.name,
+                    container_path='/data'
+                )
+            ],
+            'restart': 'always',
+            'networks_advanced': [
+                docker.ContainerNetworksAdvancedArgs(
+                    name=network_id,
+                    aliases=[REDIS_ALIAS]
+                )
+            ],
+            'healthcheck': docker.ContainerHealthcheckArgs(
+                tests=["CMD", "redis-cli", "ping"],
+                interval="5s",
+                timeout="2s",
+                retries=3,
+                start_period="5s"
+            ),
+            # The registry fails to start without its cache backend
+            'wait': True,
+            'wait_timeout': 60
+        }
+        redis_config.update(args.redis_limits)
+
+        self.redis = docker.Container(
+            f"{name}-redis",
+            opts=ResourceOptions(parent=self, depends_on=[self.redis_volume]),
+            **redis_config
+        )
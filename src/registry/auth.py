@@ -1,26 +1,84 @@
 from pathlib import Path
-import subprocess
+from typing import Dict, Optional
+import hashlib
+import hmac
+import json
+import os
 import secrets
 import string
 
-def generate_htpasswd(auth_dir: Path, username: str) -> str:
-    """Generate htpasswd file and return the generated password"""
+from .blowfish import bcrypt_hash
+
+# Same default work factor as `htpasswd -B`
+DEFAULT_COST = 5
+
+CACHE_FILE = '.htpasswd.cache.json'
+
+
+def _cache_key(username: str, password: str, cost: int) -> str:
+    """Digest that addresses an htpasswd entry without revealing the password"""
+    message = f"{username}\0{cost}".encode()
+    return hmac.new(password.encode(), message, hashlib.sha256).hexdigest()
+
+
+def _read_entries(htpasswd_path: Path) -> Dict[str, str]:
+    entries = {}
+    if htpasswd_path.exists():
+        for line in htpasswd_path.read_text().splitlines():
+            user, sep, _ = line.partition(':')
+            if sep:
+                entries[user] = line
+    return entries
+
+
+def _write_private(path: Path, content: str) -> None:
+    """Atomically replace `path` with owner-only permissions"""
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as handle:
+        handle.write(content)
+    os.replace(tmp_path, path)
+
+
+def htpasswd_entry(username: str, password: str, cost: int = DEFAULT_COST) -> str:
+    """Return a bcrypt htpasswd line for `username`"""
+    return f"{username}:{bcrypt_hash(password.encode(), secrets.token_bytes(16), cost)}"
+
+
+def generate_htpasswd(auth_dir: Path,
+                      username: str,
+                      password: Optional[str] = None,
+                      cost: int = DEFAULT_COST) -> str:
+    """Write a bcrypt htpasswd entry for `username` and return its password.
+
+    Pass a stable `password` (e.g. from stack config) to make repeat runs free:
+    the entry is cached under a digest of username, cost and password, and is
+    only re-hashed when one of those changes. Without a password a random one
+    is generated on every call.
+    """
     auth_dir.mkdir(parents=True, exist_ok=True)
     htpasswd_path = auth_dir / 'htpasswd'
-    
-    # Generate a random password
-    alphabet = string.ascii_letters + string.digits
-    password = ''.join(secrets.choice(alphabet) for _ in range(16))
-    
-    # Create htpasswd file using httpd image
-    cmd = [
-        'docker', 'run', '--rm',
-        '--entrypoint', 'htpasswd',
-        'httpd:2',
-        '-Bbn', username, password
-    ]
-    
-    result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-    htpasswd_path.write_text(result.stdout)
-    
-    return password 
\ No newline at end of file
+    cache_path = auth_dir / CACHE_FILE
+
+    if password is None:
+        alphabet = string.ascii_letters + string.digits
+        password = ''.join(secrets.choice(alphabet) for _ in range(16))
+
+    key = _cache_key(username, password, cost)
+    entries = _read_entries(htpasswd_path)
+    try:
+        cache = json.loads(cache_path.read_text())
+    except (OSError, ValueError):
+        cache = {}
+
+    cached = cache.get(username, {})
+    if cached.get('key') == key and entries.get(username) == cached.get('entry'):
+        return password
+
+    entries[username] = htpasswd_entry(username, password, cost)
+    cache[username] = {'key': key, 'entry': entries[username]}
+
+    _write_private(htpasswd_path, ''.join(f"{line}\n" for line in entries.values()))
+    _write_private(cache_path, json.dumps(cache, indent=2, sort_keys=True))
+
+    return password
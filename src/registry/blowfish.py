@@ -0,0 +1,152 @@
+from functools import lru_cache
+from typing import List, Tuple
+import base64
+
+# Blowfish is initialised from the fractional hex digits of pi: 18 words for
+# the P-array followed by 4 x 256 words for the S-boxes.
+_P_WORDS = 18
+_S_WORDS = 4 * 256
+_MASK = 0xffffffff
+
+BCRYPT_ALPHABET = b"./ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789"
+_STD_ALPHABET = b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
+_TO_BCRYPT = bytes.maketrans(_STD_ALPHABET, BCRYPT_ALPHABET)
+_FROM_BCRYPT = bytes.maketrans(BCRYPT_ALPHABET, _STD_ALPHABET)
+
+# "OrpheanBeholderScryDoubt", the bcrypt magic ciphertext
+_CTEXT = (0x4f727068, 0x65616e42, 0x65686f6c, 0x64657253, 0x63727944, 0x6f756274)
+
+MIN_COST = 4
+MAX_COST = 31
+
+
+def _arctan_inv(x: int, one: int) -> int:
+    """Fixed-point arctan(1/x) scaled by `one`"""
+    total = term = one // x
+    x2 = x * x
+    n = 1
+    sign = -1
+    while term:
+        term //= x2
+        total += sign * (term // (2 * n + 1))
+        sign = -sign
+        n += 1
+    return total
+
+
+@lru_cache(maxsize=None)
+def _initial_state() -> Tuple[Tuple[int, ...], Tuple[int, ...]]:
+    """Compute the Blowfish P-array and S-boxes from the digits of pi"""
+    words = _P_WORDS + _S_WORDS
+    bits = words * 32
+    guard = 64
+    one = 1 << (bits + guard)
+    # Machin: pi = 16 arctan(1/5) - 4 arctan(1/239)
+    pi = 16 * _arctan_inv(5, one) - 4 * _arctan_inv(239, one)
+    fraction = (pi - 3 * one) >> guard
+    digits = [(fraction >> (bits - 32 * (i + 1))) & _MASK for i in range(words)]
+    return tuple(digits[:_P_WORDS]), tuple(digits[_P_WORDS:])
+
+
+def _stream_words(data: bytes, count: int) -> List[int]:
+    """Read `count` big-endian words from `data`, cycling as bcrypt does"""
+    words = []
+    pos = 0
+    length = len(data)
+    for _ in range(count):
+        word = 0
+        for _ in range(4):
+            word = (word << 8) | data[pos]
+            pos = (pos + 1) % length
+        words.append(word)
+    return words
+
+
+class _EksBlowfish:
+    """Expensive key schedule Blowfish state used by bcrypt"""
+
+    __slots__ = ("p", "s0", "s1", "s2", "s3")
+
+    def __init__(self) -> None:
+        p, s = _initial_state()
+        self.p = list(p)
+        self.s0 = list(s[0:256])
+        self.s1 = list(s[256:512])
+        self.s2 = list(s[512:768])
+        self.s3 = list(s[768:1024])
+
+    def encipher(self, xl: int, xr: int) -> Tuple[int, int]:
+        p, s0, s1, s2, s3 = self.p, self.s0, self.s1, self.s2, self.s3
+        xl ^= p[0]
+        for i in range(1, 17, 2):
+            xr ^= ((((s0[xl >> 24] + s1[(xl >> 16) & 0xff]) ^ s2[(xl >> 8) & 0xff])
+                    + s3[xl & 0xff]) & _MASK) ^ p[i]
+            xl ^= ((((s0[xr >> 24] + s1[(xr >> 16) & 0xff]) ^ s2[(xr >> 8) & 0xff])
+                    + s3[xr & 0xff]) & _MASK) ^ p[i + 1]
+        return xr ^ p[17], xl
+
+    def expand(self, key_words: List[int], salt_words: List[int]) -> None:
+        """Mix key and salt into the state; all-zero salt gives expand0"""
+        p = self.p
+        for i in range(_P_WORDS):
+            p[i] ^= key_words[i]
+
+        encipher = self.encipher
+        salt_len = len(salt_words)
+        j = 0
+        xl = xr = 0
+        for i in range(0, _P_WORDS, 2):
+            xl ^= salt_words[j % salt_len]
+            xr ^= salt_words[(j + 1) % salt_len]
+            j += 2
+            xl, xr = encipher(xl, xr)
+            p[i] = xl
+            p[i + 1] = xr
+
+        for box in (self.s0, self.s1, self.s2, self.s3):
+            for i in range(0, 256, 2):
+                xl ^= salt_words[j % salt_len]
+                xr ^= salt_words[(j + 1) % salt_len]
+                j += 2
+                xl, xr = encipher(xl, xr)
+                box[i] = xl
+                box[i + 1] = xr
+
+
+def bcrypt_b64encode(data: bytes) -> str:
+    """Encode bytes with the bcrypt base64 alphabet, without padding"""
+    return base64.b64encode(data).translate(_TO_BCRYPT).rstrip(b"=").decode("ascii")
+
+
+def bcrypt_b64decode(text: str) -> bytes:
+    """Decode a bcrypt base64 string"""
+    raw = text.encode("ascii").translate(_FROM_BCRYPT)
+    return base64.b64decode(raw + b"=" * (-len(raw) % 4))
+
+
+def bcrypt_hash(password: bytes, salt: bytes, cost: int, prefix: str = "2y") -> str:
+    """Return the modular-crypt bcrypt hash of `password`"""
+    if not MIN_COST <= cost <= MAX_COST:
+        raise ValueError(f"bcrypt cost must be between {MIN_COST} and {MAX_COST}, got {cost}")
+    if len(salt) != 16:
+        raise ValueError("bcrypt salt must be 16 bytes")
+
+    key = (password + b"\0")[:72]
+    key_words = _stream_words(key, _P_WORDS)
+    salt_words = _stream_words(salt, 4)
+    zero_words = [0]
+
+    state = _EksBlowfish()
+    state.expand(key_words, salt_words)
+    for _ in range(1 << cost):
+        state.expand(key_words, zero_words)
+        state.expand(salt_words * 5, zero_words)
+
+    ctext = list(_CTEXT)
+    encipher = state.encipher
+    for _ in range(64):
+        for i in range(0, 6, 2):
+            ctext[i], ctext[i + 1] = encipher(ctext[i], ctext[i + 1])
+
+    digest = b"".join(word.to_bytes(4, "big") for word in ctext)[:23]
+    return f"${prefix}${cost:02d}${bcrypt_b64encode(salt)[:22]}{bcrypt_b64encode(digest)}"
@@ -1,31 +1,189 @@
 from pathlib import Path
-import subprocess
+from typing import Iterable, NamedTuple, Optional
+import datetime
+import ipaddress
+import os
 import shutil
-from typing import Tuple
 
-def generate_registry_certs(certs_dir: Path, hostname: str) -> Tuple[Path, Path]:
-    """Generate TLS certificates for the registry"""
-    certs_dir.mkdir(parents=True, exist_ok=True)
-    
+KEY_TYPES = ('ecdsa-p256', 'rsa-2048', 'rsa-4096')
+DEFAULT_KEY_TYPE = 'ecdsa-p256'
+
+
+class RegistryCerts(NamedTuple):
+    key_path: Path
+    cert_path: Path
+    action: str  # 'reused', 'rotated' or 'created'
+    reason: Optional[str]
+    not_after: datetime.datetime
+    fingerprint: str
+
+
+def _new_private_key(key_type: str):
+    from cryptography.hazmat.primitives.asymmetric import ec, rsa
+
+    if key_type == 'ecdsa-p256':
+        return ec.generate_private_key(ec.SECP256R1())
+    if key_type == 'rsa-2048':
+        return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    if key_type == 'rsa-4096':
+        return rsa.generate_private_key(public_exponent=65537, key_size=4096)
+    raise ValueError(f"Unsupported key_type {key_type!r}, expected one of {', '.join(KEY_TYPES)}")
+
+
+def _key_type_of(public_key) -> Optional[str]:
+    from cryptography.hazmat.primitives.asymmetric import ec, rsa
+
+    if isinstance(public_key, ec.EllipticCurvePublicKey) and isinstance(public_key.curve, ec.SECP256R1):
+        return 'ecdsa-p256'
+    if isinstance(public_key, rsa.RSAPublicKey):
+        return f'rsa-{public_key.key_size}'
+    return None
+
+
+def _san_entry(hostname: str):
+    from cryptography import x509
+
+    try:
+        return x509.IPAddress(ipaddress.ip_address(hostname))
+    except ValueError:
+        return x509.DNSName(hostname)
+
+
+def _rotation_reason(cert_path: Path, key_path: Path, hostname: str,
+                     key_type: str, renew_before: datetime.timedelta,
+                     now: datetime.datetime) -> Optional[str]:
+    """Return why the existing pair must be replaced, or None if it is reusable"""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import serialization
+
+    try:
+        cert = x509.load_pem_x509_certificate(cert_path.read_bytes())
+        key = serialization.load_pem_private_key(key_path.read_bytes(), password=None)
+    except (OSError, ValueError) as e:
+        return f"unreadable ({e})"
+
+    if cert.not_valid_after_utc - now < renew_before:
+        return f"expires {cert.not_valid_after_utc:%Y-%m-%d}"
+    if _key_type_of(cert.public_key()) != key_type:
+        return f"key type is not {key_type}"
+    if cert.public_key().public_numbers() != key.public_key().public_numbers():
+        return "key does not match certificate"
+    try:
+        sans = cert.extensions.get_extension_for_class(x509.SubjectAlternativeName).value
+    except x509.ExtensionNotFound:
+        return "missing subjectAltName"
+    if _san_entry(hostname) not in sans:
+        return f"subjectAltName does not cover {hostname}"
+    return None
+
+
+def _issue(hostname: str, key_type: str, days: int, now: datetime.datetime):
+    """A new self-signed certificate and its PEM-encoded private key"""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.x509.oid import NameOID
+
+    key = _new_private_key(key_type)
+    name = x509.Name([
+        x509.NameAttribute(NameOID.COUNTRY_NAME, 'US'),
+        x509.NameAttribute(NameOID.STATE_OR_PROVINCE_NAME, 'CA'),
+        x509.NameAttribute(NameOID.LOCALITY_NAME, 'SanFrancisco'),
+        x509.NameAttribute(NameOID.ORGANIZATION_NAME, 'MyCompany'),
+        x509.NameAttribute(NameOID.COMMON_NAME, hostname),
+    ])
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(minutes=5))
+        .not_valid_after(now + datetime.timedelta(days=days))
+        .add_extension(x509.SubjectAlternativeName([_san_entry(hostname)]), critical=False)
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+
+    key_pem = key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption()
+    )
+    return cert, key_pem
+
+
+def _write_pair(key_path: Path, cert_path: Path, cert, key_pem: bytes) -> None:
+    from cryptography.hazmat.primitives import serialization
+
+    fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'wb') as handle:
+        handle.write(key_pem)
+    cert_path.write_bytes(cert.public_bytes(serialization.Encoding.PEM))
+
+
+def _sync_docker_ca(cert_path: Path, hostname: str, port: str) -> None:
+    """Keep ~/.docker/certs.d in step with the registry certificate"""
+    docker_certs_dir = Path.home() / '.docker' / 'certs.d' / f'{hostname}:{port}'
+    ca_path = docker_certs_dir / 'ca.crt'
+    if ca_path.exists() and ca_path.read_bytes() == cert_path.read_bytes():
+        return
+    docker_certs_dir.mkdir(parents=True, exist_ok=True)
+    shutil.copy2(cert_path, ca_path)
+
+
+def generate_registry_certs(certs_dir: Path,
+                            hostname: str,
+                            key_type: str = DEFAULT_KEY_TYPE,
+                            days: int = 365,
+                            renew_before_days: int = 30,
+                            ports: Iterable[str] = ('5000',),
+                            dry_run: bool = False) -> RegistryCerts:
+    """Ensure a valid self-signed TLS pair for the registry.
+
+    The existing pair is reused unless it is within `renew_before_days` of
+    expiry, uses a different key type, or does not cover `hostname`; then a
+    new pair is issued in-process. A dry run (preview) makes the same
+    decision but only issues in memory: the live files and ~/.docker/certs.d
+    are left alone.
+    """
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes
+
+    if key_type not in KEY_TYPES:
+        raise ValueError(f"Unsupported key_type {key_type!r}, expected one of {', '.join(KEY_TYPES)}")
+
+    if not dry_run:
+        certs_dir.mkdir(parents=True, exist_ok=True)
+
     key_path = certs_dir / 'registry.key'
     cert_path = certs_dir / 'registry.crt'
-    
-    if not key_path.exists() or not cert_path.exists():
-        # Generate self-signed certificate
-        cmd = [
-            'openssl', 'req', '-newkey', 'rsa:4096', '-nodes', '-sha256',
-            '-keyout', str(key_path),
-            '-x509', '-days', '365',
-            '-out', str(cert_path),
-            '-subj', f'/C=US/ST=CA/L=SanFrancisco/O=MyCompany/CN={hostname}',
-            '-addext', f'subjectAltName = IP:{hostname}'
-        ]
-        
-        subprocess.run(cmd, check=True)
-        
-        # Copy certificate to Docker certs directory
-        docker_certs_dir = Path.home() / '.docker' / 'certs.d' / f'{hostname}:5000'
-        docker_certs_dir.mkdir(parents=True, exist_ok=True)
-        shutil.copy2(cert_path, docker_certs_dir / 'ca.crt')
-    
-    return key_path, cert_path 
\ No newline at end of file
+    now = datetime.datetime.now(datetime.timezone.utc)
+
+    reason = None
+    if key_path.exists() and cert_path.exists():
+        reason = _rotation_reason(cert_path, key_path, hostname, key_type,
+                                  datetime.timedelta(days=renew_before_days), now)
+        action = 'rotated' if reason else 'reused'
+    else:
+        action = 'created'
+
+    if action == 'reused':
+        cert = x509.load_pem_x509_certificate(cert_path.read_bytes())
+    else:
+        cert, key_pem = _issue(hostname, key_type, days, now)
+        if not dry_run:
+            _write_pair(key_path, cert_path, cert, key_pem)
+
+    if not dry_run:
+        # One certificate serves the registry and its mirror; trust it on every port
+        for port in ports:
+            _sync_docker_ca(cert_path, hostname, port)
+
+    return RegistryCerts(
+        key_path=key_path,
+        cert_path=cert_path,
+        action=action,
+        reason=reason,
+        not_after=cert.not_valid_after_utc,
+        fingerprint=cert.fingerprint(hashes.SHA256()).hex()
+    )
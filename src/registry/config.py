@@ -0,0 +1,63 @@
+from pathlib import Path
+from typing import Any, Dict, Optional
+import hashlib
+import yaml
+
+GENERATED_CONFIG = "config.generated.yml"
+GENERATED_MIRROR_CONFIG = "mirror.generated.yml"
+REDIS_ALIAS = "registry-redis"
+
+
+def _base_config(service: str, port: str, debug_port: str, redis: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    return {
+        "version": 0.1,
+        "log": {"fields": {"service": service}},
+        "storage": {
+            "cache": {"blobdescriptor": "redis" if redis else "inmemory"},
+            "filesystem": {"rootdirectory": "/var/lib/registry"}
+        },
+        "http": {
+            "addr": f":{port}",
+            "headers": {"X-Content-Type-Options": ["nosniff"]},
+            "tls": {"certificate": "/certs/registry.crt", "key": "/certs/registry.key"},
+            # Plain-HTTP listener for /metrics (pull latency, cache hits and misses)
+            "debug": {"addr": f":{debug_port}", "prometheus": {"enabled": True, "path": "/metrics"}}
+        },
+        **({"redis": redis} if redis else {}),
+        "health": {"storagedriver": {"enabled": True, "interval": "10s", "threshold": 3}}
+    }
+
+
+def registry_config(args) -> Dict[str, Any]:
+    """config.yml of the registry (distribution 2) from its RegistryArgs"""
+    redis = {
+        "addr": f"{REDIS_ALIAS}:6379",
+        "db": 0,
+        "dialtimeout": "100ms",
+        "readtimeout": "100ms",
+        "writetimeout": "100ms",
+        "pool": {"maxidle": 16, "maxactive": 64, "idletimeout": "300s"}
+    } if args.redis else None
+    config = _base_config("registry", args.port, args.debug_port, redis)
+    # Retention deletes manifests through the API
+    config["storage"]["delete"] = {"enabled": True}
+    config["auth"] = {"htpasswd": {"realm": "Registry", "path": "/auth/htpasswd"}}
+    return config
+
+
+def mirror_config(args) -> Dict[str, Any]:
+    """config.yml of the pull-through mirror (distribution 3); upstream credentials come from the environment"""
+    # distribution 3 takes a list of addresses; db 1 keeps the mirror's descriptors apart
+    redis = {"addrs": [f"{REDIS_ALIAS}:6379"], "db": 1} if args.redis else None
+    config = _base_config("registry-mirror", args.mirror_port, args.mirror_debug_port, redis)
+    config["proxy"] = {"remoteurl": args.mirror_remote, "ttl": args.mirror_ttl}
+    return config
+
+
+def write_config(path: Path, config: Dict[str, Any]) -> str:
+    """Write `config` as YAML when its content changes and return its digest"""
+    text = "# Generated from RegistryArgs by the Pulumi program; do not edit\n"
+    text += yaml.safe_dump(config, sort_keys=False)
+    if not path.exists() or path.read_text() != text:
+        path.write_text(text)
+    return hashlib.sha256(text.encode()).hexdigest()
@@ -0,0 +1,15 @@
+"""Registry retention and garbage collection.
+
+Runs inside a stock python image (stdlib only) and is shipped into the
+container by the Registry component. Each run:
+
+1. applies the retention policy through the registry API: per repository
+   the newest `keep_last` tags and every tag matching `keep_pattern` are
+   kept, and manifests no kept tag points at are deleted;
+2. swaps the registry for a read-only clone (same image, volume, ports and
+   aliases), runs `registry garbage-collect` in it and swaps back, so pulls
+   keep working while blobs are swept;
+3. publishes repository sizes and reclaimed bytes on /metrics.
+
+Start it with `python -m maintenance daemon` or `python -m maintenance run`.
+"""
@@ -0,0 +1,84 @@
+import argparse
+import json
+import logging
+import os
+import signal
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
+
+from src.agents.docker import DockerClient, DockerError
+from .client import RegistryClient, RegistryError
+from .metrics import Metrics, serve
+from .policy import RetentionPolicy
+from .run import Maintenance, MaintenanceError
+
+log = logging.getLogger("maintenance")
+
+
+def next_run(at: str, now: Optional[datetime] = None) -> datetime:
+    now = now or datetime.now()
+    hour, minute = (int(part) for part in at.split(":"))
+    run = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    return run if run > now else run + timedelta(days=1)
+
+
+def build(args: argparse.Namespace, metrics: Optional[Metrics] = None) -> Maintenance:
+    client = RegistryClient(args.url, os.environ.get("REGISTRY_USERNAME", "admin"),
+                            os.environ["REGISTRY_PASSWORD"], cafile=args.cafile)
+    policy = RetentionPolicy(keep_last=args.keep_last, keep_pattern=args.keep_pattern)
+    return Maintenance(client, DockerClient(), policy, container=args.container,
+                       storage=Path(args.storage), metrics=metrics)
+
+
+def run_once(args: argparse.Namespace) -> int:
+    result = build(args).run(dry_run=args.dry_run)
+    print(json.dumps(result.as_dict(), indent=2))
+    return 0
+
+
+def daemon(args: argparse.Namespace) -> int:
+    metrics = Metrics()
+    maintenance = build(args, metrics)
+    host, _, port = args.listen.rpartition(":")
+    serve(metrics, host, int(port))
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    while not stop.is_set():
+        run = next_run(args.at)
+        log.info("Next maintenance at %s, metrics on %s", run.isoformat(timespec="minutes"), args.listen)
+        if stop.wait((run - datetime.now()).total_seconds()):
+            break
+        try:
+            maintenance.run()
+        except (RegistryError, DockerError, MaintenanceError):
+            log.exception("Maintenance failed")
+    return 0
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="maintenance", description="Registry retention and garbage collection")
+    parser.add_argument("--url", default=os.environ.get("REGISTRY_URL", "https://registry:5000"))
+    parser.add_argument("--cafile", default=os.environ.get("REGISTRY_CA", "/certs/registry.crt"))
+    parser.add_argument("--container", default=os.environ.get("REGISTRY_CONTAINER", "registry"))
+    parser.add_argument("--storage", default="/var/lib/registry", help="registry volume, mounted read-only")
+    parser.add_argument("--keep-last", type=int, default=int(os.environ.get("REGISTRY_KEEP_LAST", "10")))
+    parser.add_argument("--keep-pattern", default=os.environ.get("REGISTRY_KEEP_PATTERN",
+                                                                 r"^(latest|stable|main|deps|dev|prod|v?\d+\.\d+\.\d+)$"))
+    parser.add_argument("--log-level", default="INFO")
+    commands = parser.add_subparsers(dest="command", required=True)
+    once = commands.add_parser("run", help="run retention and GC once")
+    once.add_argument("--dry-run", action="store_true", help="only report what retention would delete")
+    schedule = commands.add_parser("daemon", help="run daily and serve /metrics")
+    schedule.add_argument("--at", default=os.environ.get("REGISTRY_GC_SCHEDULE", "03:30"), help="local time, HH:MM")
+    schedule.add_argument("--listen", default=":9116", help="[host]:port for /metrics")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    logging.basicConfig(level=arguments.log_level.upper(), format="%(asctime)s %(levelname)s %(message)s")
+    handler = {"run": run_once, "daemon": daemon}[arguments.command]
+    raise SystemExit(handler(arguments))
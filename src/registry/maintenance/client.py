@@ -0,0 +1,126 @@
+"""Registry HTTP API v2 client: catalog, tags, manifests and deletes"""
+
+import base64
+import json
+import re
+import ssl
+import urllib.error
+import urllib.parse
+import urllib.request
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+# Media types the registry may answer with; asking for all keeps digests stable
+MANIFEST_TYPES = [
+    "application/vnd.oci.image.index.v1+json",
+    "application/vnd.docker.distribution.manifest.list.v2+json",
+    "application/vnd.oci.image.manifest.v1+json",
+    "application/vnd.docker.distribution.manifest.v2+json",
+]
+_NEXT = re.compile(r'<([^>]+)>;\s*rel="next"')
+
+
+class RegistryError(Exception):
+    pass
+
+
+class RegistryClient:
+    def __init__(self, url: str, username: str, password: str, cafile: Optional[str] = None,
+                 timeout: float = 30.0) -> None:
+        self.url = url.rstrip("/")
+        token = base64.b64encode(f"{username}:{password}".encode()).decode()
+        self.headers = {"Authorization": f"Basic {token}"}
+        self.context = ssl.create_default_context(cafile=cafile)
+        self.timeout = timeout
+
+    def _request(self, method: str, path: str, headers: Optional[Dict[str, str]] = None) -> Tuple[int, Dict[str, str], bytes]:
+        request = urllib.request.Request(self.url + path, method=method, headers={**self.headers, **(headers or {})})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout, context=self.context) as response:
+                return response.status, dict(response.headers), response.read()
+        except urllib.error.HTTPError as error:
+            raise RegistryError(f"{method} {path}: {error.code} {error.read()[:200]!r}")
+        except (urllib.error.URLError, OSError) as error:
+            raise RegistryError(f"{method} {path}: {error}")
+
+    def ping(self) -> bool:
+        try:
+            self._request("GET", "/v2/")
+            return True
+        except RegistryError:
+            return False
+
+    def _paginate(self, path: str, key: str) -> Iterator[str]:
+        while path:
+            _, headers, body = self._request("GET", path)
+            yield from json.loads(body).get(key) or []
+            match = _NEXT.search(headers.get("Link", ""))
+            path = urllib.parse.urlsplit(match.group(1))._replace(scheme="", netloc="").geturl() if match else ""
+
+    def repositories(self) -> List[str]:
+        return list(self._paginate("/v2/_catalog?n=1000", "repositories"))
+
+    def tags(self, repository: str) -> List[str]:
+        try:
+            return list(self._paginate(f"/v2/{repository}/tags/list?n=1000", "tags"))
+        except RegistryError as error:
+            # Repositories whose last tag was deleted answer 404 until GC removes them
+            if " 404 " in str(error):
+                return []
+            raise
+
+    def manifest(self, repository: str, reference: str) -> Tuple[str, Dict[str, Any]]:
+        """(digest, manifest) of a tag or digest"""
+        _, headers, body = self._request("GET", f"/v2/{repository}/manifests/{reference}",
+                                         {"Accept": ", ".join(MANIFEST_TYPES)})
+        return headers["Docker-Content-Digest"], json.loads(body)
+
+    def delete_manifest(self, repository: str, digest: str) -> None:
+        self._request("DELETE", f"/v2/{repository}/manifests/{digest}")
+
+    def created(self, repository: str, manifest: Dict[str, Any]) -> str:
+        """Image creation time (RFC 3339) from the config blob; the first platform's for an index"""
+        if "manifests" in manifest:
+            if not manifest["manifests"]:
+                return ""
+            manifest = self.manifest(repository, manifest["manifests"][0]["digest"])[1]
+        config = manifest.get("config")
+        if not config:
+            return ""
+        _, _, body = self._request("GET", f"/v2/{repository}/blobs/{config['digest']}")
+        try:
+            return json.loads(body).get("created") or ""
+        except ValueError:
+            return ""
+
+    def blobs(self, repository: str, manifest: Dict[str, Any]) -> Dict[str, int]:
+        """Blob digest -> size for a manifest, following image indexes into their platform manifests"""
+        sizes: Dict[str, int] = {}
+        if "manifests" in manifest:
+            for child in manifest["manifests"]:
+                sizes.update(self.blobs(repository, self.manifest(repository, child["digest"])[1]))
+            return sizes
+        for descriptor in [manifest.get("config")] + manifest.get("layers", []):
+            if descriptor:
+                sizes[descriptor["digest"]] = descriptor.get("size", 0)
+        return sizes
+
+
+@dataclass
+class Tagged:
+    """A manifest of a repository with the tags pointing at it"""
+    tags: Set[str] = field(default_factory=set)
+    created: str = ""
+    blobs: Dict[str, int] = field(default_factory=dict)
+
+
+def referenced(client: RegistryClient, repository: str, tags: List[str]) -> Dict[str, Tagged]:
+    """Manifest digest -> its tags, creation time and blob sizes"""
+    manifests: Dict[str, Tagged] = {}
+    for tag in tags:
+        digest, manifest = client.manifest(repository, tag)
+        if digest not in manifests:
+            manifests[digest] = Tagged(created=client.created(repository, manifest),
+                                       blobs=client.blobs(repository, manifest))
+        manifests[digest].tags.add(tag)
+    return manifests
@@ -0,0 +1,85 @@
+"""Gauges and counters in the Prometheus text format, served on /metrics"""
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Sequence, Tuple
+
+
+class Metric:
+    def __init__(self, name: str, documentation: str, kind: str = "gauge", labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        self.values[tuple(labels[name] for name in self.labelnames)] = value
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = tuple(labels[name] for name in self.labelnames)
+        self.values[key] = self.values.get(key, 0.0) + amount
+
+    def clear(self) -> None:
+        self.values.clear()
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in sorted(self.values.items()):
+            labels = ",".join(f'{name}="{label}"' for name, label in zip(self.labelnames, key))
+            number = str(int(value)) if value == int(value) else repr(value)
+            lines.append(f"{self.name}{{{labels}}} {number}" if labels else f"{self.name} {number}")
+        return "\n".join(lines)
+
+
+class Metrics:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.metrics: List[Metric] = []
+        self.repository_size = self._add("addi_aire_registry_repository_size_bytes",
+                                         "Bytes of the blobs the repository's tags refer to", labelnames=["repository"])
+        self.repository_tags = self._add("addi_aire_registry_repository_tags", "Tags per repository",
+                                         labelnames=["repository"])
+        self.storage = self._add("addi_aire_registry_storage_bytes", "Bytes of blob data on the registry volume")
+        self.reclaimed = self._add("addi_aire_registry_gc_reclaimed_bytes", "Bytes freed by the last maintenance run")
+        self.reclaimed_total = self._add("addi_aire_registry_gc_reclaimed_bytes_total",
+                                         "Bytes freed by maintenance runs", kind="counter")
+        self.deleted_total = self._add("addi_aire_registry_gc_deleted_manifests_total",
+                                       "Manifests deleted by retention", kind="counter")
+        self.readonly_seconds = self._add("addi_aire_registry_gc_readonly_seconds",
+                                          "Length of the last read-only window")
+        self.duration = self._add("addi_aire_registry_gc_duration_seconds", "Duration of the last maintenance run")
+        self.last_success = self._add("addi_aire_registry_gc_last_success_timestamp_seconds",
+                                      "Unix time of the last successful maintenance run")
+        self.failures_total = self._add("addi_aire_registry_gc_failures_total", "Failed maintenance runs",
+                                        kind="counter")
+
+    def _add(self, name: str, documentation: str, kind: str = "gauge", labelnames: Sequence[str] = ()) -> Metric:
+        metric = Metric(name, documentation, kind, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        with self.lock:
+            return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+
+def serve(metrics: Metrics, host: str, port: int) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path not in ("/metrics", "/healthz"):
+                self.send_error(404)
+                return
+            body = metrics.render().encode() if self.path == "/metrics" else b"ok\n"
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,36 @@
+"""Which tags of a repository survive retention"""
+
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, List, Set, Tuple
+
+from .client import Tagged
+
+_DIGITS = re.compile(r"(\d+)")
+
+
+def natural_key(tag: str) -> Tuple[Any, ...]:
+    """Sort key that orders build numbers numerically: "9" < "10", "1.2.9" < "1.2.10" """
+    return tuple((0, int(part)) if part.isdigit() else (1, part) for part in _DIGITS.split(tag) if part)
+
+
+@dataclass
+class RetentionPolicy:
+    keep_last: int = 10
+    # Tags kept regardless of age, e.g. releases, moving tags and the app's :deps/:dev/:prod
+    keep_pattern: str = r"^(latest|stable|main|deps|dev|prod|v?\d+\.\d+\.\d+)$"
+
+    def keep(self, created: Dict[str, str]) -> Set[str]:
+        """Tags to keep, given each tag's image creation time"""
+        pattern = re.compile(self.keep_pattern) if self.keep_pattern else None
+        pinned = {tag for tag in created if pattern and pattern.search(tag)}
+        # Newest images first; build numbers break ties between images created at once
+        rest = sorted((tag for tag in created if tag not in pinned),
+                      key=lambda tag: (created[tag], natural_key(tag)), reverse=True)
+        return pinned | set(rest[:self.keep_last])
+
+    def expired(self, manifests: Dict[str, Tagged]) -> List[str]:
+        """Manifest digests to delete: deleting a digest removes every tag on it,
+        so a digest goes only when none of its tags is kept"""
+        kept = self.keep({tag: manifest.created for manifest in manifests.values() for tag in manifest.tags})
+        return sorted(digest for digest, manifest in manifests.items() if not manifest.tags & kept)
@@ -0,0 +1,159 @@
+"""One maintenance run: retention through the API, then GC in a read-only window"""
+
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from src.agents.docker import DockerClient, DockerError
+from .client import RegistryClient, RegistryError, referenced
+from .metrics import Metrics
+from .policy import RetentionPolicy
+
+log = logging.getLogger("maintenance")
+
+# distribution only reads maintenance.readonly at startup, hence the clone
+READONLY_ENV = 'REGISTRY_STORAGE_MAINTENANCE_READONLY={"enabled": true}'
+
+
+class MaintenanceError(Exception):
+    pass
+
+
+@dataclass
+class MaintenanceResult:
+    repositories: int = 0
+    deleted: List[str] = field(default_factory=list)
+    reclaimed_bytes: int = 0
+    readonly_seconds: float = 0.0
+    seconds: float = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__dataclass_fields__}
+
+
+def blob_bytes(root: Path) -> Optional[int]:
+    """Bytes of blob data under the registry's storage root, None when it is not mounted"""
+    blobs = root / "docker" / "registry" / "v2" / "blobs"
+    if not blobs.is_dir():
+        return None
+    total = 0
+    for directory, _, files in os.walk(blobs):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(directory, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+class Maintenance:
+    def __init__(self,
+                 client: RegistryClient,
+                 docker: DockerClient,
+                 policy: RetentionPolicy,
+                 container: str = "registry",
+                 storage: Path = Path("/var/lib/registry"),
+                 metrics: Optional[Metrics] = None) -> None:
+        self.client = client
+        self.docker = docker
+        self.policy = policy
+        self.container = container
+        self.storage = storage
+        self.metrics = metrics or Metrics()
+
+    def apply_retention(self, result: MaintenanceResult, dry_run: bool = False) -> None:
+        sizes: Dict[str, int] = {}
+        tags: Dict[str, int] = {}
+        for repository in self.client.repositories():
+            result.repositories += 1
+            manifests = referenced(self.client, repository, self.client.tags(repository))
+            expired = self.policy.expired(manifests)
+            for digest in expired:
+                log.info("%s %s@%s (%s)", "Would delete" if dry_run else "Deleting", repository, digest[:19],
+                         ", ".join(sorted(manifests[digest].tags)))
+                if not dry_run:
+                    self.client.delete_manifest(repository, digest)
+                result.deleted.append(f"{repository}@{digest}")
+            kept = [manifest for digest, manifest in manifests.items() if digest not in expired]
+            # Size after retention: each blob of the kept manifests counted once
+            kept_blobs: Dict[str, int] = {}
+            for manifest in kept:
+                kept_blobs.update(manifest.blobs)
+            sizes[repository] = sum(kept_blobs.values())
+            tags[repository] = sum(len(manifest.tags) for manifest in kept)
+        with self.metrics.lock:
+            self.metrics.repository_size.clear()
+            self.metrics.repository_tags.clear()
+            for repository in sizes:
+                self.metrics.repository_size.set(sizes[repository], repository=repository)
+                self.metrics.repository_tags.set(tags[repository], repository=repository)
+
+    def collect_garbage(self) -> float:
+        """Swap the registry for a read-only clone, sweep unreferenced blobs in it and swap back"""
+        source = self.docker.inspect(self.container)
+        clone = f"{self.container}-readonly"
+        try:
+            # Left behind by an interrupted run
+            self.docker.remove(clone)
+        except DockerError:
+            pass
+        clone_id = self.docker.clone(source, clone, [READONLY_ENV])
+        config = (source["Config"].get("Cmd") or ["/etc/docker/registry/config.yml"])[-1]
+        started = time.monotonic()
+        self.docker.stop(self.container)
+        try:
+            self.docker.start(clone_id)
+            self._wait_ready()
+            code, output = self.docker.exec(clone_id, ["registry", "garbage-collect", config])
+            for line in output.strip().splitlines()[-5:]:
+                log.info("gc: %s", line)
+            if code != 0:
+                raise MaintenanceError(f"garbage-collect exited with {code}")
+        finally:
+            self.docker.remove(clone_id)
+            self.docker.start(self.container)
+            self._wait_ready()
+        return time.monotonic() - started
+
+    def _wait_ready(self, timeout: float = 60.0) -> None:
+        deadline = time.monotonic() + timeout
+        while not self.client.ping():
+            if time.monotonic() > deadline:
+                raise MaintenanceError(f"registry did not answer within {timeout:.0f}s")
+            time.sleep(1)
+
+    def run(self, dry_run: bool = False) -> MaintenanceResult:
+        started = time.monotonic()
+        result = MaintenanceResult()
+        before = blob_bytes(self.storage)
+        try:
+            self.apply_retention(result, dry_run)
+            # Nothing was deleted, so there is nothing for GC to sweep beyond failed uploads
+            if result.deleted and not dry_run:
+                result.readonly_seconds = self.collect_garbage()
+        except (RegistryError, DockerError, MaintenanceError):
+            with self.metrics.lock:
+                self.metrics.failures_total.inc()
+            raise
+        after = blob_bytes(self.storage)
+        if before is not None and after is not None:
+            result.reclaimed_bytes = max(0, before - after)
+        result.seconds = time.monotonic() - started
+
+        if not dry_run:
+            with self.metrics.lock:
+                if after is not None:
+                    self.metrics.storage.set(after)
+                self.metrics.reclaimed.set(result.reclaimed_bytes)
+                self.metrics.reclaimed_total.inc(result.reclaimed_bytes)
+                self.metrics.deleted_total.inc(len(result.deleted))
+                self.metrics.readonly_seconds.set(result.readonly_seconds)
+                self.metrics.duration.set(result.seconds)
+                self.metrics.last_success.set(time.time())
+        log.info("Maintenance%s: %d repositories, %d manifests deleted, %.1f MB reclaimed, "
+                 "read-only for %.1fs, %.1fs total", " (dry run)" if dry_run else "", result.repositories,
+                 len(result.deleted), result.reclaimed_bytes / 1e6, result.readonly_seconds, result.seconds)
+        return result
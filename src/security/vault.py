@@ -1,14 +1,19 @@
 from pulumi import ResourceOptions, ComponentResource
-from pulumi_vault import AuthBackend, Mount
 from pulumi_docker import Container, Volume, ContainerCapabilitiesArgs, ContainerNetworksAdvancedArgs
+from typing import Dict, Optional, Union
 import json
 import pulumi
-from pulumi_aws import kms
+
+AUTO_VAULT_IMAGE = "hashicorp/vault:1.15.6"
+
+# Provider SDKs (pulumi_vault, pulumi_aws) are imported where they are used so
+# that importing this module does not pay for them on every preview.
 
 class VaultStack(ComponentResource):
     def __init__(self, name: str, network_id: str, opts: ResourceOptions = None):
         super().__init__("addi-aire:security:VaultStack", name, None, opts)
-        
+        from pulumi_vault import AuthBackend, Mount
+
         # Enable Kubernetes auth
         self.kubernetes_auth = AuthBackend("kubernetes",
             type="kubernetes",
@@ -93,6 +98,8 @@ class VaultStack(ComponentResource):
 
     def _configure_auto_unseal(self):
         """AWS KMS auto-unseal configuration"""
+        from pulumi_aws import kms
+
         # Create KMS key
         kms_key = kms.Key("vault-auto-unseal",
             description="Vault auto-unseal key",
@@ -132,12 +139,14 @@ class BasicVault(ComponentResource):
         )
 
 class AutoVault(ComponentResource):
-    def __init__(self, name: str, network_id: str, opts: ResourceOptions = None):
+    def __init__(self, name: str, network_id: str, limits: Optional[Dict[str, int]] = None,
+                 image: Union[str, pulumi.Output[str]] = AUTO_VAULT_IMAGE,
+                 opts: ResourceOptions = None):
         super().__init__("addi-aire:vault:AutoVault", name, None, opts)
         
         # Self-contained vault with auto-unseal
         self.vault = Container("vault",
-            image="hashicorp/vault:1.15.6",
+            image=image,
             ports=[{"internal": "8200", "external": "8220"}],
             networks_advanced=[ContainerNetworksAdvancedArgs(
                 name=network_id,
@@ -156,7 +165,8 @@ class AutoVault(ComponentResource):
             capabilities=ContainerCapabilitiesArgs(
                 adds=["IPC_LOCK"]
             ),
-            opts=ResourceOptions(parent=self)
+            opts=ResourceOptions(parent=self),
+            **(limits or {})
         )
         
         self.register_outputs({
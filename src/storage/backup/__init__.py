@@ -0,0 +1,18 @@
+"""Incremental, deduplicating volume backups.
+
+Runs inside a stock python image (stdlib only) and is shipped into the
+container by the storage stack. Every directory under the volumes root
+(e.g. /volumes/jenkins) is a component. Files are split with
+content-defined chunking; each chunk is stored once, compressed and
+addressed by its SHA-256, in the repository on the backup volume:
+
+    /backup/chunks/ab/ab12...           zlib-compressed chunk
+    /backup/snapshots/<component>/<id>.json.gz
+    /backup/catalog.db                  snapshot index and chunk reference counts
+
+Unchanged files (same size and mtime as in the previous snapshot) are not
+read at all, so a nightly run over a mostly idle volume only writes a new
+manifest. Weekly and monthly snapshots are promoted to the same layout on
+the archive volume (/archive) and both tiers are pruned by GFS retention.
+Start it with `python -m backup daemon` or `python -m backup run`.
+"""
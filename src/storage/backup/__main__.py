@@ -0,0 +1,152 @@
+import argparse
+import logging
+import os
+import signal
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from .api import RecoveryService, serve
+from .catalog import open_catalog, repository_lock
+from .consistent import hooks_from_env
+from .restore import restore_components
+from .retention import RetentionPolicy, maintain
+from .snapshot import create_snapshot
+
+log = logging.getLogger("backup")
+
+
+def components(volumes_root: Path, only: Optional[List[str]] = None) -> Dict[str, Path]:
+    """Every directory under the volumes root is a component, e.g. /volumes/jenkins"""
+    found = {path.name: path for path in sorted(volumes_root.iterdir()) if path.is_dir()}
+    return {name: path for name, path in found.items() if not only or name in only}
+
+
+def repositories(args: argparse.Namespace) -> Dict[str, Path]:
+    return {"backup": Path(args.repository), "archive": Path(args.archive)}
+
+
+def run_backup(args: argparse.Namespace) -> int:
+    targets = components(Path(args.volumes), args.component)
+    hooks = hooks_from_env()
+    failures = 0
+    with repository_lock(Path(args.repository)), open_catalog(repositories(args)) as catalog, \
+            ProcessPoolExecutor(max_workers=args.workers or None) as executor:
+        for name, path in targets.items():
+            try:
+                if name in hooks:
+                    # Back up the application's consistent copy, never the live files
+                    with hooks[name].source(path) as (source, extra):
+                        snapshot = create_snapshot(name, source, Path(args.repository), executor,
+                                                   level=args.level, extra=extra)
+                else:
+                    snapshot = create_snapshot(name, path, Path(args.repository), executor, level=args.level)
+                catalog.add("backup", snapshot.path)
+            except Exception:
+                log.exception("Backup of %s failed", name)
+                failures += 1
+    return 1 if failures else 0
+
+
+def run_retention(args: argparse.Namespace) -> int:
+    with repository_lock(Path(args.repository)), open_catalog(repositories(args)) as catalog:
+        result = maintain(catalog, repositories(args), RetentionPolicy.from_env(), dry_run=args.dry_run)
+    if args.dry_run:
+        for line in result.promoted:
+            print(f"promote {line}")
+        for line in result.pruned:
+            print(f"prune   {line}")
+    return 0
+
+
+def reindex(args: argparse.Namespace) -> int:
+    with repository_lock(Path(args.repository)), open_catalog(repositories(args)) as catalog:
+        log.info("Indexed %d snapshots", catalog.rebuild(repositories(args)))
+    return 0
+
+
+def next_run(at: str, now: Optional[datetime] = None) -> datetime:
+    now = now or datetime.now()
+    hour, minute = (int(part) for part in at.split(":"))
+    run = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    return run if run > now else run + timedelta(days=1)
+
+
+def daemon(args: argparse.Namespace) -> int:
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    while not stop.is_set():
+        run = next_run(args.at)
+        log.info("Next backup at %s", run.isoformat(timespec="minutes"))
+        if stop.wait((run - datetime.now()).total_seconds()):
+            break
+        run_backup(args)
+        run_retention(args)
+    return 0
+
+
+def show(args: argparse.Namespace) -> int:
+    with open_catalog(repositories(args)) as catalog:
+        for row in catalog.list(args.component[0] if args.component else None):
+            print(f"{row['component']:<16} {row['id']}  {row['tier']:<8} {row['files']:>8} files  "
+                  f"{row['logical_bytes'] / 1e6:>10.1f} MB  +{row['stored_bytes'] / 1e6:.1f} MB")
+    return 0
+
+
+def restore(args: argparse.Namespace) -> int:
+    names = list(components(Path(args.volumes), args.component))
+    results = restore_components(list(repositories(args).values()), Path(args.volumes), names, args.snapshot,
+                                 args.workers or None, clean=args.clean)
+    return 1 if any(result.failed for result in results) else 0
+
+
+def run_api(args: argparse.Namespace) -> int:
+    # BACKUP_VOLUME_NAMES maps components to Docker volumes: "jenkins=jenkins_home,grafana=grafana_data"
+    volume_names = dict(pair.split("=", 1) for pair in os.environ.get("BACKUP_VOLUME_NAMES", "").split(",") if pair)
+    token = os.environ.get("BACKUP_API_TOKEN", "")
+    if not token:
+        log.error("BACKUP_API_TOKEN is not set, refusing to serve the recovery API without authentication")
+        return 2
+    service = RecoveryService(repositories(args), Path(args.volumes), volume_names, workers=args.workers or None)
+    host, _, port = args.listen.rpartition(":")
+    serve(service, host, int(port), token)
+    return 0
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="backup", description="Incremental deduplicating volume backups")
+    parser.add_argument("--repository", default=os.environ.get("BACKUP_REPOSITORY", "/backup"))
+    parser.add_argument("--archive", default=os.environ.get("BACKUP_ARCHIVE", "/archive"),
+                        help="repository weekly and monthly snapshots are promoted to")
+    parser.add_argument("--volumes", default=os.environ.get("BACKUP_VOLUMES", "/volumes"))
+    parser.add_argument("--component", action="append", help="limit to these components (repeatable)")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("BACKUP_WORKERS", "0")),
+                        help="compression processes, 0 for one per CPU")
+    parser.add_argument("--level", type=int, default=int(os.environ.get("BACKUP_COMPRESSION_LEVEL", "3")))
+    parser.add_argument("--log-level", default="INFO")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("run", help="back up every component once")
+    schedule = commands.add_parser("daemon", help="back up every component daily, then apply retention")
+    schedule.add_argument("--at", default=os.environ.get("BACKUP_SCHEDULE", "02:00"), help="local time, HH:MM")
+    commands.add_parser("list", help="list snapshots")
+    retention = commands.add_parser("prune", help="promote weeklies and monthlies to the archive and prune both tiers")
+    retention.add_argument("--dry-run", action="store_true", help="only print what would be promoted and pruned")
+    commands.add_parser("reindex", help="rebuild the catalog from the manifests")
+    restore_command = commands.add_parser("restore", help="restore components in place (containers are not stopped)")
+    restore_command.add_argument("--snapshot", default="latest")
+    restore_command.add_argument("--clean", action="store_true",
+                                 help="delete files that are not in the snapshot (kept by default, as in the API)")
+    api = commands.add_parser("serve", help="recovery HTTP API")
+    api.add_argument("--listen", default=":8080", help="[host]:port")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    logging.basicConfig(level=arguments.log_level.upper(), format="%(asctime)s %(levelname)s %(message)s")
+    handler = {"run": run_backup, "daemon": daemon, "list": show, "prune": run_retention,
+               "reindex": reindex, "restore": restore, "serve": run_api}[arguments.command]
+    raise SystemExit(handler(arguments))
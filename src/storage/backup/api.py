@@ -0,0 +1,171 @@
+"""HTTP API for listing snapshots and running restores.
+
+    GET  /healthz
+    GET  /snapshots[?component=jenkins][&tier=archive]
+    POST /restore        {"components": ["jenkins", "grafana"], "snapshot": "latest", "clean": false}
+    GET  /jobs/<id>
+
+Every endpoint except /healthz requires `Authorization: Bearer <token>`.
+Restores keep files that are not in the snapshot unless `clean` is true.
+
+A restore stops the running containers that mount the affected volumes
+(other than this one), restores every component concurrently and starts
+those containers again, even when the restore fails.
+"""
+
+import hmac
+import json
+import logging
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, urlsplit
+
+from src.agents.docker import DockerClient, DockerError
+from .catalog import CATALOG_FILE, Catalog
+from .restore import RestoreError, restore_components
+
+log = logging.getLogger("backup")
+
+
+class RecoveryService:
+    def __init__(self,
+                 repositories: Dict[str, Path],
+                 volumes_root: Path,
+                 volume_names: Dict[str, str],
+                 docker: Optional[DockerClient] = None,
+                 workers: Optional[int] = None) -> None:
+        # tier -> repository, e.g. {"backup": /backup, "archive": /archive}
+        self.repositories = repositories
+        self.volumes_root = volumes_root
+        # component -> Docker volume name, used to find the containers to stop
+        self.volume_names = volume_names
+        self.docker = docker or DockerClient()
+        self.workers = workers
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self.lock = threading.Lock()
+
+    def components(self) -> List[str]:
+        return sorted(path.name for path in self.volumes_root.iterdir() if path.is_dir())
+
+    def snapshots(self, component: Optional[str] = None, tier: Optional[str] = None) -> List[Dict[str, Any]]:
+        path = self.repositories["backup"] / CATALOG_FILE
+        if not path.exists():
+            return []
+        # One connection per request: the handler runs on many threads
+        with Catalog(path, readonly=True) as catalog:
+            return [{"component": row["component"], "id": row["id"], "tier": row["tier"],
+                     "created_at": datetime.fromtimestamp(row["created_at"], timezone.utc).isoformat(),
+                     "stats": {"files": row["files"], "logical_bytes": row["logical_bytes"],
+                               "stored_bytes": row["stored_bytes"]},
+                     "extra": json.loads(row["extra"])}
+                    for row in catalog.list(component, tier)]
+
+    def start_restore(self, components: List[str], snapshot: str = "latest", clean: bool = False) -> Dict[str, Any]:
+        unknown = sorted(set(components) - set(self.components()))
+        if unknown or not components:
+            raise ValueError(f"unknown components: {', '.join(unknown) or 'none given'}")
+        with self.lock:
+            if any(job["status"] == "running" for job in self.jobs.values()):
+                raise RuntimeError("a restore is already running")
+            job = {"id": uuid.uuid4().hex[:12], "status": "running", "components": components,
+                   "snapshot": snapshot, "started_at": time.time()}
+            self.jobs[job["id"]] = job
+        threading.Thread(target=self._run, args=(job, clean), daemon=True).start()
+        return job
+
+    def _run(self, job: Dict[str, Any], clean: bool) -> None:
+        volumes = [self.volume_names[name] for name in job["components"] if name in self.volume_names]
+        own_id = socket.gethostname()
+        stopped: List[str] = []
+        try:
+            # Only containers that mount a volume being restored are interrupted
+            for container in self.docker.containers_using(volumes):
+                if container["Id"].startswith(own_id):
+                    continue
+                log.info("Stopping %s", container["Names"][0].lstrip("/"))
+                self.docker.stop(container["Id"])
+                stopped.append(container["Id"])
+            job["stopped"] = len(stopped)
+            results = restore_components(list(self.repositories.values()), self.volumes_root, job["components"],
+                                         job["snapshot"], self.workers, clean)
+            job["results"] = [result.as_dict() for result in results]
+            job["status"] = "failed" if any(result.failed for result in results) else "succeeded"
+        except (RestoreError, DockerError, OSError) as error:
+            log.exception("Restore %s failed", job["id"])
+            job.update(status="failed", error=str(error))
+        finally:
+            for container_id in stopped:
+                try:
+                    self.docker.start(container_id)
+                except DockerError as error:
+                    log.error("Cannot restart %s: %s", container_id[:12], error)
+            job["finished_at"] = time.time()
+
+
+def serve(service: RecoveryService, host: str, port: int, token: str) -> None:
+    if not token:
+        raise ValueError("the recovery API requires a token")
+    expected = f"Bearer {token}".encode()
+
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status: int, payload: Any) -> None:
+            body = json.dumps(payload, indent=2).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            if status == 401:
+                self.send_header("WWW-Authenticate", "Bearer")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _authorized(self) -> bool:
+            if hmac.compare_digest(self.headers.get("Authorization", "").encode(), expected):
+                return True
+            self._send(401, {"error": "unauthorized"})
+            return False
+
+        def do_GET(self) -> None:
+            url = urlsplit(self.path)
+            if url.path == "/healthz":
+                self._send(200, {"status": "ok"})
+            elif not self._authorized():
+                return
+            elif url.path == "/snapshots":
+                query = parse_qs(url.query)
+                self._send(200, service.snapshots(query.get("component", [None])[0], query.get("tier", [None])[0]))
+            elif url.path.startswith("/jobs/") and url.path[6:] in service.jobs:
+                self._send(200, service.jobs[url.path[6:]])
+            else:
+                self._send(404, {"error": "not found"})
+
+        def do_POST(self) -> None:
+            if not self._authorized():
+                return
+            if urlsplit(self.path).path != "/restore":
+                self._send(404, {"error": "not found"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", "0"))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                components = request.get("components") or service.components()
+                job = service.start_restore(components, request.get("snapshot", "latest"), bool(request.get("clean", False)))
+            except (ValueError, json.JSONDecodeError) as error:
+                self._send(400, {"error": str(error)})
+                return
+            except RuntimeError as error:
+                self._send(409, {"error": str(error)})
+                return
+            self._send(202, job)
+
+        def log_message(self, format: str, *args: Any) -> None:
+            log.debug(format, *args)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    log.info("Recovery API listening on %s:%d", host or "0.0.0.0", port)
+    server.serve_forever()
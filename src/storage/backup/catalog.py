@@ -0,0 +1,168 @@
+"""SQLite index of snapshots and chunk reference counts, kept next to the repository.
+
+    /backup/catalog.db
+        snapshots(tier, component, id, created_at, files, logical_bytes, stored_bytes, manifest, extra)
+        chunks(tier, digest, refs)
+
+Each tier is a repository with its own chunk store: "backup" on the backup
+volume holds the dailies, "archive" on the archive volume the promoted
+weeklies and monthlies. Chunk references are counted per tier, so pruning
+deletes exactly the chunks no remaining snapshot of that tier refers to,
+without reading any other manifest. Listing is an indexed query instead of
+a walk over every manifest.
+"""
+
+import fcntl
+import json
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+from .snapshot import list_snapshots, load_manifest
+
+CATALOG_FILE = "catalog.db"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    tier TEXT NOT NULL,
+    component TEXT NOT NULL,
+    id TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    files INTEGER NOT NULL,
+    logical_bytes INTEGER NOT NULL,
+    stored_bytes INTEGER NOT NULL,
+    manifest TEXT NOT NULL,
+    extra TEXT NOT NULL DEFAULT '{}',
+    PRIMARY KEY (tier, component, id)
+);
+CREATE INDEX IF NOT EXISTS snapshots_by_component ON snapshots (component, created_at);
+CREATE TABLE IF NOT EXISTS chunks (
+    tier TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    refs INTEGER NOT NULL,
+    PRIMARY KEY (tier, digest)
+) WITHOUT ROWID;
+"""
+
+
+def chunk_refs(manifest: Dict[str, Any]) -> Set[str]:
+    """Distinct chunks a snapshot refers to; each snapshot counts once per chunk"""
+    return {ref for entry in manifest["entries"] if entry["type"] == "file" for ref in entry["chunks"]}
+
+
+@contextmanager
+def repository_lock(repository: Path) -> Iterator[None]:
+    """Serialise backups and pruning: a prune must never delete a chunk a running backup just deduplicated against"""
+    with open(Path(repository) / ".lock", "w") as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+class Catalog:
+    def __init__(self, path: Path, readonly: bool = False) -> None:
+        self.path = Path(path)
+        if readonly:
+            # The recovery API mounts the backup volume read-only
+            self.db = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        else:
+            self.db = sqlite3.connect(self.path)
+            self.db.executescript(_SCHEMA)
+        self.db.row_factory = sqlite3.Row
+
+    def close(self) -> None:
+        self.db.close()
+
+    def __enter__(self) -> "Catalog":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def empty(self) -> bool:
+        return self.db.execute("SELECT 1 FROM snapshots LIMIT 1").fetchone() is None
+
+    def add(self, tier: str, manifest_path: Path, manifest: Optional[Dict[str, Any]] = None) -> None:
+        """Index a manifest and take its chunk references.
+
+        Raises FileExistsError when the tier already indexes a snapshot with
+        the same id, instead of silently keeping the stale row.
+        """
+        manifest = manifest or load_manifest(manifest_path)
+        stats = manifest["stats"]
+        try:
+            with self.db:
+                self.db.execute(
+                    "INSERT INTO snapshots VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (tier, manifest["component"], manifest["id"],
+                     datetime.fromisoformat(manifest["created_at"]).timestamp(), stats["files"],
+                     stats["logical_bytes"], stats["stored_bytes"], str(manifest_path),
+                     json.dumps(manifest.get("extra", {})))
+                )
+                self.db.executemany(
+                    "INSERT INTO chunks VALUES (?, ?, 1) ON CONFLICT (tier, digest) DO UPDATE SET refs = refs + 1",
+                    ((tier, digest) for digest in chunk_refs(manifest))
+                )
+        except sqlite3.IntegrityError as error:
+            raise FileExistsError(f"{tier} snapshot {manifest['component']}/{manifest['id']} "
+                                  f"is already in the catalog") from error
+
+    def remove(self, tier: str, component: str, snapshot: str) -> List[str]:
+        """Drop a snapshot and its references; returns the chunks no snapshot of the tier refers to any more.
+
+        The catalog is committed before anything is deleted, so a crash leaves
+        unreferenced chunk files behind, never references to missing chunks.
+        """
+        row = self.get(tier, component, snapshot)
+        if row is None:
+            return []
+        refs = chunk_refs(load_manifest(Path(row["manifest"])))
+        with self.db:
+            self.db.execute("DELETE FROM snapshots WHERE tier = ? AND component = ? AND id = ?",
+                            (tier, component, snapshot))
+            self.db.executemany("UPDATE chunks SET refs = refs - 1 WHERE tier = ? AND digest = ?",
+                                ((tier, digest) for digest in refs))
+            orphans = [digest for (digest,) in self.db.execute(
+                "SELECT digest FROM chunks WHERE tier = ? AND refs <= 0", (tier,))]
+            self.db.execute("DELETE FROM chunks WHERE tier = ? AND refs <= 0", (tier,))
+        return orphans
+
+    def get(self, tier: str, component: str, snapshot: str) -> Optional[sqlite3.Row]:
+        return self.db.execute("SELECT * FROM snapshots WHERE tier = ? AND component = ? AND id = ?",
+                               (tier, component, snapshot)).fetchone()
+
+    def list(self, component: Optional[str] = None, tier: Optional[str] = None) -> List[sqlite3.Row]:
+        """Snapshots oldest first"""
+        query = "SELECT * FROM snapshots WHERE (? IS NULL OR component = ?) AND (? IS NULL OR tier = ?)"
+        return self.db.execute(query + " ORDER BY component, created_at, tier",
+                               (component, component, tier, tier)).fetchall()
+
+    def components(self) -> List[str]:
+        return [name for (name,) in self.db.execute("SELECT DISTINCT component FROM snapshots ORDER BY component")]
+
+    def referenced(self, tier: str) -> Set[str]:
+        return {digest for (digest,) in self.db.execute("SELECT digest FROM chunks WHERE tier = ?", (tier,))}
+
+    def rebuild(self, repositories: Dict[str, Path]) -> int:
+        """Re-index every manifest, e.g. for a repository written before the catalog existed"""
+        with self.db:
+            self.db.execute("DELETE FROM snapshots")
+            self.db.execute("DELETE FROM chunks")
+        count = 0
+        for tier, repository in repositories.items():
+            for path in list_snapshots(repository):
+                self.add(tier, path)
+                count += 1
+        return count
+
+
+def open_catalog(repositories: Dict[str, Path], readonly: bool = False) -> Catalog:
+    """The catalog lives on the backup volume; a missing or empty one is rebuilt from the manifests"""
+    catalog = Catalog(Path(repositories["backup"]) / CATALOG_FILE, readonly)
+    if not readonly and catalog.empty():
+        catalog.rebuild(repositories)
+    return catalog
@@ -0,0 +1,80 @@
+"""Content-defined chunking (FastCDC with normalised chunk sizes).
+
+Cut points depend only on the bytes around them, so an insert near the
+start of a file changes one or two chunks instead of every chunk after it.
+"""
+
+import hashlib
+from typing import BinaryIO, Iterator
+
+MIN_SIZE = 16 * 1024
+AVG_SIZE = 64 * 1024
+MAX_SIZE = 256 * 1024
+
+_MASK64 = (1 << 64) - 1
+# Fixed, reproducible gear table: the cut points, and so the dedup, must not change between runs
+GEAR = [int.from_bytes(hashlib.sha256(bytes([value])).digest()[:8], "big") for value in range(256)]
+
+
+def _mask(bits: int) -> int:
+    # The gear hash shifts left, so its high bits depend on the most recent bytes
+    return ((1 << bits) - 1) << (64 - bits)
+
+
+_BITS = AVG_SIZE.bit_length() - 1
+# Harder to match before the average size, easier after: chunk sizes cluster around AVG_SIZE
+MASK_SMALL = _mask(_BITS + 2)
+MASK_LARGE = _mask(_BITS - 2)
+
+
+def cut_point(buffer: memoryview, length: int) -> int:
+    """Length of the first chunk of `buffer[:length]`"""
+    if length <= MIN_SIZE:
+        return length
+    limit = min(length, MAX_SIZE)
+    normal = min(limit, AVG_SIZE)
+    gear = GEAR
+    fingerprint = 0
+    index = MIN_SIZE
+    while index < normal:
+        fingerprint = ((fingerprint << 1) + gear[buffer[index]]) & _MASK64
+        if not fingerprint & MASK_SMALL:
+            return index + 1
+        index += 1
+    while index < limit:
+        fingerprint = ((fingerprint << 1) + gear[buffer[index]]) & _MASK64
+        if not fingerprint & MASK_LARGE:
+            return index + 1
+        index += 1
+    return limit
+
+
+def chunks(stream: BinaryIO, read_size: int = 4 * MAX_SIZE) -> Iterator[bytes]:
+    """Split `stream` into content-defined chunks.
+
+    Chunks are cut at an offset into the read buffer; consumed bytes are only
+    dropped when the buffer is refilled, not copied again for every chunk.
+    """
+    buffer = bytearray()
+    offset = 0
+    eof = False
+    while True:
+        if not eof and len(buffer) - offset < MAX_SIZE:
+            data = stream.read(read_size)
+            if data:
+                del buffer[:offset]
+                offset = 0
+                buffer += data
+            else:
+                eof = True
+        available = len(buffer) - offset
+        if not available:
+            return
+        if not eof and available < MAX_SIZE:
+            continue
+        # Views are released before the buffer is resized again
+        with memoryview(buffer) as view, view[offset:] as window:
+            size = cut_point(window, available)
+            chunk = window[:size].tobytes()
+        offset += size
+        yield chunk
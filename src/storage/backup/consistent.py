@@ -0,0 +1,135 @@
+"""Application-consistent sources for components that must not be copied live.
+
+A hook asks the application for a consistent point-in-time copy, yields the
+directory to back up plus details for the manifest, and cleans up after.
+
+- Prometheus: the admin API hard-links the current TSDB blocks into
+  snapshots/<name>; only that directory is backed up and then removed.
+- Elasticsearch: an `fs` snapshot repository on a dedicated volume and an
+  SLM policy; the policy is executed before the backup and the repository
+  (incremental, segment-level) is what gets backed up.
+"""
+
+import json
+import logging
+import os
+import shutil
+import time
+import urllib.error
+import urllib.request
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+log = logging.getLogger("backup")
+
+# uid the Elasticsearch image runs as; the repository directory must be writable by it
+ELASTICSEARCH_UID = 1000
+
+
+class SnapshotError(Exception):
+    """The application could not produce a consistent snapshot"""
+
+
+def _call(method: str, url: str, body: Optional[Dict[str, Any]] = None, timeout: float = 60.0) -> Dict[str, Any]:
+    data = json.dumps(body).encode() if body is not None else None
+    request = urllib.request.Request(url, data=data, method=method, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            payload = response.read()
+    except urllib.error.HTTPError as error:
+        raise SnapshotError(f"{method} {url}: {error.code} {error.read()[:300]!r}")
+    except (urllib.error.URLError, OSError) as error:
+        raise SnapshotError(f"{method} {url}: {error}")
+    return json.loads(payload) if payload else {}
+
+
+class PrometheusSnapshot:
+    def __init__(self, url: str) -> None:
+        self.url = url.rstrip("/")
+
+    @contextmanager
+    def source(self, volume: Path) -> Iterator[Tuple[Path, Dict[str, Any]]]:
+        response = _call("POST", f"{self.url}/api/v1/admin/tsdb/snapshot")
+        name = response.get("data", {}).get("name")
+        if response.get("status") != "success" or not name:
+            raise SnapshotError(f"Prometheus snapshot failed: {response}")
+        directory = volume / "snapshots" / name
+        log.info("prometheus: TSDB snapshot %s", name)
+        try:
+            yield directory, {"prometheus_snapshot": name}
+        finally:
+            # Hard links only: removing them frees nothing the live TSDB still uses
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+class ElasticsearchSnapshots:
+    def __init__(self,
+                 url: str,
+                 repository: str = "addi-aire-backup",
+                 location: str = "/usr/share/elasticsearch/snapshots",
+                 policy: str = "addi-aire-nightly",
+                 schedule: str = "0 30 1 * * ?",
+                 expire_after: str = "30d",
+                 timeout: float = 3600.0) -> None:
+        self.url = url.rstrip("/")
+        self.repository = repository
+        self.location = location
+        self.policy = policy
+        self.schedule = schedule
+        self.expire_after = expire_after
+        self.timeout = timeout
+
+    def ensure(self, volume: Path) -> None:
+        """Register the fs repository and the SLM policy (both calls are idempotent)"""
+        if volume.stat().st_uid != ELASTICSEARCH_UID:
+            os.chown(volume, ELASTICSEARCH_UID, 0)
+        _call("PUT", f"{self.url}/_snapshot/{self.repository}", {
+            "type": "fs",
+            "settings": {"location": self.location, "compress": True}
+        })
+        _call("PUT", f"{self.url}/_slm/policy/{self.policy}", {
+            "schedule": self.schedule,
+            "name": "<addi-aire-{now/d}-{now{HHmmss}}>",
+            "repository": self.repository,
+            "config": {"indices": "*", "include_global_state": True},
+            "retention": {"expire_after": self.expire_after, "min_count": 3, "max_count": 60}
+        })
+
+    def _wait(self, name: str) -> Dict[str, Any]:
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline:
+            try:
+                snapshot = _call("GET", f"{self.url}/_snapshot/{self.repository}/{name}")["snapshots"][0]
+            except (SnapshotError, KeyError, IndexError):
+                snapshot = {"state": "IN_PROGRESS"}
+            if snapshot["state"] in ("SUCCESS", "PARTIAL"):
+                return snapshot
+            if snapshot["state"] == "FAILED":
+                raise SnapshotError(f"Elasticsearch snapshot {name} failed: {snapshot.get('reason')}")
+            time.sleep(2)
+        raise SnapshotError(f"Elasticsearch snapshot {name} did not finish within {self.timeout:.0f}s")
+
+    @contextmanager
+    def source(self, volume: Path) -> Iterator[Tuple[Path, Dict[str, Any]]]:
+        self.ensure(volume)
+        name = _call("POST", f"{self.url}/_slm/policy/{self.policy}/_execute")["snapshot_name"]
+        snapshot = self._wait(name)
+        log.info("elasticsearch: snapshot %s %s (%d indices)", name, snapshot["state"], len(snapshot.get("indices", [])))
+        yield volume, {"elasticsearch": {"repository": self.repository, "snapshot": name,
+                                         "state": snapshot["state"], "indices": snapshot.get("indices", [])}}
+
+
+def hooks_from_env(environ: Dict[str, str] = os.environ) -> Dict[str, Any]:
+    """Consistency hooks by component name, configured through BACKUP_* variables"""
+    hooks: Dict[str, Any] = {}
+    if environ.get("BACKUP_PROMETHEUS_URL"):
+        hooks["prometheus"] = PrometheusSnapshot(environ["BACKUP_PROMETHEUS_URL"])
+    if environ.get("BACKUP_ELASTICSEARCH_URL"):
+        hooks["elasticsearch"] = ElasticsearchSnapshots(
+            environ["BACKUP_ELASTICSEARCH_URL"],
+            location=environ.get("BACKUP_ES_REPOSITORY_PATH", "/usr/share/elasticsearch/snapshots"),
+            schedule=environ.get("BACKUP_ES_SLM_SCHEDULE", "0 30 1 * * ?"),
+            expire_after=environ.get("BACKUP_ES_SLM_EXPIRE_AFTER", "30d")
+        )
+    return hooks
@@ -0,0 +1,163 @@
+"""Parallel, streaming restore of snapshots with per-file checksum verification"""
+
+import hashlib
+import logging
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from .snapshot import list_snapshots, load_manifest
+from .store import ChunkError, ChunkStore
+
+log = logging.getLogger("backup")
+
+
+class RestoreError(Exception):
+    """A snapshot could not be restored completely"""
+
+
+@dataclass
+class RestoreResult:
+    component: str
+    snapshot: str
+    files: int = 0
+    bytes: int = 0
+    removed: int = 0
+    failed: List[str] = field(default_factory=list)
+    seconds: float = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__dataclass_fields__}
+
+
+def find_snapshot(repositories: List[Path], component: str, snapshot: str = "latest") -> Path:
+    """Manifest of a snapshot in whichever tier has it, the backup tier first"""
+    paths = [path for repository in repositories for path in list_snapshots(repository, component)]
+    if not paths:
+        raise RestoreError(f"no snapshots of {component}")
+    if snapshot == "latest":
+        # Ids are UTC timestamps, so they sort chronologically across tiers
+        return max(paths, key=lambda path: path.name)
+    for path in paths:
+        if path.name == f"{snapshot}.json.gz":
+            return path
+    raise RestoreError(f"snapshot {snapshot} of {component} not found")
+
+
+def _restore_file(store: ChunkStore, target: Path, entry: Dict[str, Any], owner: bool) -> int:
+    """Stream one file's chunks into place, verifying its SHA-256 before replacing the old file"""
+    path = target / entry["path"]
+    temporary = path.with_name(f".{path.name}.restore")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(temporary, "wb") as handle:
+            for ref in entry["chunks"]:
+                # The whole-file digest covers every chunk, so chunks are not hashed twice
+                data = store.get(ref, verify=False)
+                digest.update(data)
+                handle.write(data)
+                size += len(data)
+        if digest.hexdigest() != entry["sha256"] or size != entry["size"]:
+            raise ChunkError(f"checksum mismatch for {entry['path']}")
+        os.chmod(temporary, entry["mode"])
+        if owner:
+            os.chown(temporary, entry["uid"], entry["gid"])
+        os.utime(temporary, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+        os.replace(temporary, path)
+    except BaseException:
+        temporary.unlink(missing_ok=True)
+        raise
+    return size
+
+
+def _clean(target: Path, keep: set) -> int:
+    """Remove everything under `target` that is not part of the snapshot"""
+    removed = 0
+    for root, directories, files in os.walk(target, topdown=False):
+        relative_root = os.path.relpath(root, target)
+        for name in files + directories:
+            relative = name if relative_root == "." else f"{relative_root}/{name}"
+            if relative in keep:
+                continue
+            path = Path(root) / name
+            if path.is_dir() and not path.is_symlink():
+                shutil.rmtree(path)
+            else:
+                path.unlink()
+            removed += 1
+    return removed
+
+
+def restore_snapshot(manifest_path: Path,
+                     target: Path,
+                     store: ChunkStore,
+                     executor: ThreadPoolExecutor,
+                     clean: bool = False) -> RestoreResult:
+    """Make `target` match the snapshot; files are restored concurrently on `executor`"""
+    started = time.monotonic()
+    manifest = load_manifest(manifest_path)
+    entries = manifest["entries"]
+    result = RestoreResult(manifest["component"], manifest["id"])
+    owner = os.geteuid() == 0
+    target.mkdir(parents=True, exist_ok=True)
+
+    if clean:
+        result.removed = _clean(target, {entry["path"] for entry in entries})
+
+    directories = [entry for entry in entries if entry["type"] == "dir"]
+    for entry in directories:
+        (target / entry["path"]).mkdir(parents=True, exist_ok=True)
+
+    files = [entry for entry in entries if entry["type"] == "file"]
+    futures = {executor.submit(_restore_file, store, target, entry, owner): entry for entry in files}
+    for future, entry in futures.items():
+        try:
+            result.bytes += future.result()
+            result.files += 1
+        except (ChunkError, OSError) as error:
+            log.error("%s: cannot restore %s: %s", result.component, entry["path"], error)
+            result.failed.append(entry["path"])
+
+    for entry in entries:
+        if entry["type"] == "symlink":
+            path = target / entry["path"]
+            if path.is_symlink() or path.exists():
+                path.unlink()
+            os.symlink(entry["target"], path)
+            if owner:
+                os.lchown(path, entry["uid"], entry["gid"])
+
+    # Directory metadata last: restoring files changes directory mtimes
+    for entry in sorted(directories, key=lambda entry: entry["path"].count("/"), reverse=True):
+        path = target / entry["path"]
+        os.chmod(path, entry["mode"])
+        if owner:
+            os.chown(path, entry["uid"], entry["gid"])
+        os.utime(path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+
+    result.seconds = round(time.monotonic() - started, 3)
+    log.info("%s: restored %s, %d files, %.1f MB, %d removed, %d failed in %.1fs", result.component,
+             result.snapshot, result.files, result.bytes / 1e6, result.removed, len(result.failed), result.seconds)
+    return result
+
+
+def restore_components(repositories: List[Path],
+                       volumes_root: Path,
+                       components: List[str],
+                       snapshot: str = "latest",
+                       workers: Optional[int] = None,
+                       clean: bool = False) -> List[RestoreResult]:
+    """Restore several components at once; all their files share one pool of workers"""
+    manifests = {name: find_snapshot(repositories, name, snapshot) for name in components}
+    # repository/snapshots/<component>/<id>.json.gz: each snapshot reads from its own tier's store
+    stores = {path.parents[2]: ChunkStore(path.parents[2]) for path in manifests.values()}
+    with ThreadPoolExecutor(max_workers=workers or min(32, (os.cpu_count() or 1) * 4)) as files:
+        with ThreadPoolExecutor(max_workers=len(components) or 1) as volumes:
+            futures = [volumes.submit(restore_snapshot, path, volumes_root / name, stores[path.parents[2]], files, clean)
+                       for name, path in manifests.items()]
+            return [future.result() for future in futures]
@@ -0,0 +1,130 @@
+"""Grandfather-father-son retention across the backup and archive tiers.
+
+- sons: the newest snapshot of each day for `daily` days stay on the backup volume
+- fathers: the newest snapshot of each ISO week for `weekly_days` days go to the archive
+- grandfathers: the newest snapshot of each month for `monthly` months go to the archive
+
+Fathers and grandfathers are promoted by copying their manifest and any
+chunks the archive does not have yet, then everything outside the policy is
+pruned tier by tier using the catalog's reference counts.
+"""
+
+import logging
+import os
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from .catalog import Catalog
+from .snapshot import load_manifest, snapshots_dir, write_manifest
+from .store import ChunkStore
+
+log = logging.getLogger("backup")
+
+
+@dataclass
+class RetentionPolicy:
+    daily: int = 7
+    weekly_days: int = 30
+    monthly: int = 12
+
+    @classmethod
+    def from_env(cls) -> "RetentionPolicy":
+        return cls(daily=int(os.environ.get("BACKUP_RETENTION_DAYS", cls.daily)),
+                   weekly_days=int(os.environ.get("ARCHIVE_RETENTION_DAYS", cls.weekly_days)),
+                   monthly=int(os.environ.get("ARCHIVE_RETENTION_MONTHS", cls.monthly)))
+
+    def select(self, snapshots: Dict[str, datetime], now: datetime) -> Dict[str, Set[str]]:
+        """Snapshot ids to keep in each tier"""
+        keep: Dict[str, Set[str]] = {"backup": set(), "archive": set()}
+        seen: Set[Tuple[Any, ...]] = set()
+        month_now = now.year * 12 + now.month
+        for identifier, created in sorted(snapshots.items(), key=lambda item: item[1], reverse=True):
+            age = now - created
+            buckets = (
+                ("backup", ("day", created.date()), age < timedelta(days=self.daily)),
+                ("archive", ("week",) + tuple(created.isocalendar()[:2]), age < timedelta(days=self.weekly_days)),
+                ("archive", ("month", created.year, created.month),
+                 month_now - (created.year * 12 + created.month) < self.monthly)
+            )
+            for tier, bucket, within in buckets:
+                # Newest first, so the first snapshot seen in a bucket is the one kept
+                if within and bucket not in seen:
+                    seen.add(bucket)
+                    keep[tier].add(identifier)
+        if snapshots:
+            # The newest backup is never pruned, however old it is
+            keep["backup"].add(max(snapshots, key=snapshots.get))
+        return keep
+
+
+@dataclass
+class MaintenanceResult:
+    promoted: List[str] = field(default_factory=list)
+    pruned: List[str] = field(default_factory=list)
+    copied_bytes: int = 0
+    freed_bytes: int = 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__dataclass_fields__}
+
+
+def promote(catalog: Catalog, repositories: Dict[str, Path], component: str, snapshot: str) -> int:
+    """Copy a snapshot from the backup tier to the archive tier; chunks first, manifest last"""
+    row = catalog.get("backup", component, snapshot)
+    manifest = load_manifest(Path(row["manifest"]))
+    source = ChunkStore(repositories["backup"])
+    target = ChunkStore(repositories["archive"])
+    copied = 0
+    for entry in manifest["entries"]:
+        if entry["type"] == "file":
+            for ref in entry["chunks"]:
+                copied += source.copy_to(target, ref)
+    path = snapshots_dir(repositories["archive"], component) / f"{snapshot}.json.gz"
+    write_manifest(path, manifest)
+    catalog.add("archive", path, manifest)
+    return copied
+
+
+def prune(catalog: Catalog, repositories: Dict[str, Path], tier: str, component: str, snapshot: str) -> int:
+    row = catalog.get(tier, component, snapshot)
+    orphans = catalog.remove(tier, component, snapshot)
+    Path(row["manifest"]).unlink(missing_ok=True)
+    store = ChunkStore(repositories[tier])
+    return sum(store.delete(digest) for digest in orphans)
+
+
+def maintain(catalog: Catalog,
+             repositories: Dict[str, Path],
+             policy: RetentionPolicy,
+             now: Optional[datetime] = None,
+             dry_run: bool = False) -> MaintenanceResult:
+    """Promote fathers and grandfathers to the archive, then prune both tiers"""
+    now = now or datetime.now(timezone.utc)
+    result = MaintenanceResult()
+    for component in catalog.components():
+        rows = catalog.list(component)
+        tiers: Dict[str, Set[str]] = {"backup": set(), "archive": set()}
+        created: Dict[str, datetime] = {}
+        for row in rows:
+            tiers[row["tier"]].add(row["id"])
+            created[row["id"]] = datetime.fromtimestamp(row["created_at"], timezone.utc)
+        keep = policy.select(created, now)
+
+        for snapshot in sorted(keep["archive"] - tiers["archive"]):
+            if snapshot not in tiers["backup"]:
+                continue
+            result.promoted.append(f"{component}/{snapshot}")
+            if not dry_run:
+                result.copied_bytes += promote(catalog, repositories, component, snapshot)
+        for tier in ("backup", "archive"):
+            for snapshot in sorted(tiers[tier] - keep[tier]):
+                result.pruned.append(f"{tier}:{component}/{snapshot}")
+                if not dry_run:
+                    result.freed_bytes += prune(catalog, repositories, tier, component, snapshot)
+
+    log.info("Retention%s: promoted %d snapshots (%.1f MB copied), pruned %d (%.1f MB freed)",
+             " (dry run)" if dry_run else "", len(result.promoted), result.copied_bytes / 1e6,
+             len(result.pruned), result.freed_bytes / 1e6)
+    return result
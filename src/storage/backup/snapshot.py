@@ -0,0 +1,233 @@
+"""Snapshots: walk a volume, store changed files as chunks and write a manifest"""
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import stat
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .chunker import chunks
+from .store import ChunkStore
+
+log = logging.getLogger("backup")
+
+MANIFEST_VERSION = 1
+# Changed files are handed to workers in batches of roughly this many bytes or files
+BATCH_BYTES = 32 * 1024 * 1024
+BATCH_FILES = 256
+
+
+@dataclass
+class SnapshotStats:
+    files: int = 0
+    reused_files: int = 0
+    read_bytes: int = 0
+    logical_bytes: int = 0
+    new_chunks: int = 0
+    stored_bytes: int = 0
+    skipped: int = 0
+    seconds: float = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__dataclass_fields__}
+
+
+@dataclass
+class Snapshot:
+    id: str
+    component: str
+    created_at: str
+    path: Path
+    stats: Dict[str, Any] = field(default_factory=dict)
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+
+def snapshot_id(now: Optional[datetime] = None) -> str:
+    # Microseconds keep back-to-back runs apart; older repositories hold second-resolution ids
+    return (now or datetime.now(timezone.utc)).strftime("%Y%m%dT%H%M%S.%fZ")
+
+
+def snapshots_dir(repository: Path, component: str) -> Path:
+    return Path(repository) / "snapshots" / component
+
+
+def list_snapshots(repository: Path, component: Optional[str] = None) -> List[Path]:
+    """Manifest paths, oldest first"""
+    root = Path(repository) / "snapshots"
+    if not root.exists():
+        return []
+    components = [component] if component else sorted(path.name for path in root.iterdir() if path.is_dir())
+    paths = []
+    for name in components:
+        directory = root / name
+        if directory.exists():
+            paths.extend(sorted(directory.glob("*.json.gz")))
+    return paths
+
+
+def load_manifest(path: Path) -> Dict[str, Any]:
+    with gzip.open(path, "rt") as handle:
+        return json.load(handle)
+
+
+def write_manifest(path: Path, manifest: Dict[str, Any], exclusive: bool = False) -> None:
+    """Write a manifest atomically; `exclusive` raises FileExistsError instead of replacing one"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_name(f".{path.name}.tmp")
+    with gzip.open(temporary, "wt", compresslevel=6) as handle:
+        json.dump(manifest, handle, separators=(",", ":"))
+    if not exclusive:
+        os.replace(temporary, path)
+        return
+    try:
+        # Unlike a rename, a hard link never replaces an existing manifest
+        os.link(temporary, path)
+    finally:
+        os.unlink(temporary)
+
+
+def scan(root: Path) -> Iterator[Tuple[str, os.stat_result]]:
+    """(relative path, lstat) for everything below `root`, directories before their contents"""
+    stack = [""]
+    while stack:
+        relative = stack.pop()
+        try:
+            entries = sorted(os.scandir(os.path.join(root, relative)), key=lambda entry: entry.name)
+        except OSError as error:
+            log.warning("Cannot list %s: %s", os.path.join(root, relative) or root, error)
+            continue
+        for entry in entries:
+            path = f"{relative}/{entry.name}" if relative else entry.name
+            try:
+                info = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            yield path, info
+            if stat.S_ISDIR(info.st_mode):
+                stack.append(path)
+
+
+def _store_files(root: str, paths: List[str], repository: str, level: int) -> List[Dict[str, Any]]:
+    """Worker: chunk, hash and store files; returns one result per path"""
+    store = ChunkStore(Path(repository), level)
+    results = []
+    for path in paths:
+        digest = hashlib.sha256()
+        refs: List[str] = []
+        stored = new = size = 0
+        try:
+            with open(os.path.join(root, path), "rb") as handle:
+                for chunk in chunks(handle):
+                    chunk_digest = hashlib.sha256(chunk).hexdigest()
+                    written = store.put(chunk, chunk_digest)
+                    stored += written
+                    new += 1 if written else 0
+                    size += len(chunk)
+                    digest.update(chunk)
+                    refs.append(chunk_digest)
+        except OSError as error:
+            results.append({"path": path, "error": str(error)})
+            continue
+        results.append({"path": path, "sha256": digest.hexdigest(), "chunks": refs,
+                        "read": size, "stored": stored, "new": new})
+    return results
+
+
+def _batches(items: List[Tuple[str, int]]) -> Iterator[List[str]]:
+    batch: List[str] = []
+    batch_bytes = 0
+    for path, size in items:
+        batch.append(path)
+        batch_bytes += size
+        if batch_bytes >= BATCH_BYTES or len(batch) >= BATCH_FILES:
+            yield batch
+            batch, batch_bytes = [], 0
+    if batch:
+        yield batch
+
+
+def create_snapshot(component: str,
+                    source: Path,
+                    repository: Path,
+                    executor: ProcessPoolExecutor,
+                    level: int = 3,
+                    extra: Optional[Dict[str, Any]] = None) -> Snapshot:
+    """Back up `source` as a new snapshot of `component`"""
+    started = time.monotonic()
+    stats = SnapshotStats()
+    previous_paths = list_snapshots(repository, component)
+    previous: Dict[str, Dict[str, Any]] = {}
+    if previous_paths:
+        previous = {entry["path"]: entry for entry in load_manifest(previous_paths[-1])["entries"]
+                    if entry["type"] == "file"}
+
+    entries: List[Dict[str, Any]] = []
+    changed: List[Tuple[str, int]] = []
+    for path, info in scan(source):
+        entry = {"path": path, "mode": stat.S_IMODE(info.st_mode), "uid": info.st_uid,
+                 "gid": info.st_gid, "mtime_ns": info.st_mtime_ns}
+        if stat.S_ISDIR(info.st_mode):
+            entry["type"] = "dir"
+        elif stat.S_ISLNK(info.st_mode):
+            entry["type"] = "symlink"
+            entry["target"] = os.readlink(os.path.join(source, path))
+        elif stat.S_ISREG(info.st_mode):
+            entry.update(type="file", size=info.st_size)
+            stats.files += 1
+            stats.logical_bytes += info.st_size
+            before = previous.get(path)
+            if before and before["size"] == info.st_size and before["mtime_ns"] == info.st_mtime_ns:
+                entry.update(sha256=before["sha256"], chunks=before["chunks"])
+                stats.reused_files += 1
+            else:
+                changed.append((path, info.st_size))
+        else:
+            # Sockets, FIFOs and devices are not backed up
+            continue
+        entries.append(entry)
+
+    by_path = {entry["path"]: entry for entry in entries}
+    futures = [executor.submit(_store_files, str(source), batch, str(repository), level)
+               for batch in _batches(changed)]
+    for future in futures:
+        for result in future.result():
+            entry = by_path[result["path"]]
+            if "error" in result:
+                # Files that vanish or cannot be read mid-backup are left out of the snapshot
+                log.warning("Skipping %s/%s: %s", component, result["path"], result["error"])
+                entry["type"] = "skipped"
+                stats.skipped += 1
+                continue
+            entry.update(sha256=result["sha256"], chunks=result["chunks"], size=result["read"])
+            stats.read_bytes += result["read"]
+            stats.stored_bytes += result["stored"]
+            stats.new_chunks += result["new"]
+    entries = [entry for entry in entries if entry["type"] != "skipped"]
+
+    created_at = datetime.now(timezone.utc)
+    identifier = snapshot_id(created_at)
+    stats.seconds = round(time.monotonic() - started, 3)
+    path = snapshots_dir(repository, component) / f"{identifier}.json.gz"
+    # A snapshot is never overwritten: its chunks are referenced by the existing manifest
+    write_manifest(path, {
+        "version": MANIFEST_VERSION,
+        "id": identifier,
+        "component": component,
+        "source": str(source),
+        "created_at": created_at.isoformat(),
+        "parent": previous_paths[-1].name if previous_paths else None,
+        "stats": stats.as_dict(),
+        "extra": extra or {},
+        "entries": entries
+    }, exclusive=True)
+    log.info("%s: snapshot %s, %d files (%d unchanged), read %.1f MB, stored %.1f MB in %d new chunks, %.1fs",
+             component, identifier, stats.files, stats.reused_files, stats.read_bytes / 1e6,
+             stats.stored_bytes / 1e6, stats.new_chunks, stats.seconds)
+    return Snapshot(identifier, component, created_at.isoformat(), path, stats.as_dict(), extra or {})
@@ -0,0 +1,92 @@
+"""Content-addressed chunk store on the backup volume"""
+
+import hashlib
+import os
+import zlib
+from pathlib import Path
+from typing import Iterator
+
+# One-byte header so incompressible chunks are stored as is
+_ZLIB = b"z"
+_RAW = b"r"
+
+
+class ChunkError(Exception):
+    """A chunk is missing or does not match its address"""
+
+
+class ChunkStore:
+    def __init__(self, root: Path, level: int = 3) -> None:
+        self.root = Path(root)
+        self.level = level
+        self.chunks = self.root / "chunks"
+        self.chunks.mkdir(parents=True, exist_ok=True)
+
+    def path(self, digest: str) -> Path:
+        return self.chunks / digest[:2] / digest
+
+    def has(self, digest: str) -> bool:
+        return self.path(digest).exists()
+
+    def put(self, data: bytes, digest: str = None) -> int:
+        """Store `data` unless present; returns the bytes written (0 when deduplicated)"""
+        digest = digest or hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        if path.exists():
+            return 0
+        compressed = zlib.compress(data, self.level)
+        payload = _ZLIB + compressed if len(compressed) < len(data) else _RAW + data
+        self._write(path, payload)
+        return len(payload)
+
+    def _write(self, path: Path, payload: bytes) -> None:
+        path.parent.mkdir(exist_ok=True)
+        # Unique temp name: parallel workers may store the same new chunk at once
+        temporary = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        with open(temporary, "wb") as handle:
+            handle.write(payload)
+        os.replace(temporary, path)
+
+    def copy_to(self, other: "ChunkStore", digest: str) -> int:
+        """Copy a chunk as stored (no recompression) into another store; returns the bytes written"""
+        target = other.path(digest)
+        if target.exists():
+            return 0
+        try:
+            payload = self.path(digest).read_bytes()
+        except FileNotFoundError:
+            raise ChunkError(f"chunk {digest} is missing")
+        other._write(target, payload)
+        return len(payload)
+
+    def get(self, digest: str, verify: bool = True) -> bytes:
+        try:
+            payload = self.path(digest).read_bytes()
+        except FileNotFoundError:
+            raise ChunkError(f"chunk {digest} is missing")
+        try:
+            data = zlib.decompress(payload[1:]) if payload[:1] == _ZLIB else payload[1:]
+        except zlib.error:
+            raise ChunkError(f"chunk {digest} is corrupt")
+        if verify and hashlib.sha256(data).hexdigest() != digest:
+            raise ChunkError(f"chunk {digest} is corrupt")
+        return data
+
+    def size(self, digest: str) -> int:
+        return self.path(digest).stat().st_size
+
+    def delete(self, digest: str) -> int:
+        path = self.path(digest)
+        try:
+            size = path.stat().st_size
+            path.unlink()
+        except FileNotFoundError:
+            return 0
+        return size
+
+    def __iter__(self) -> Iterator[str]:
+        for prefix in sorted(self.chunks.iterdir()):
+            if prefix.is_dir():
+                for path in sorted(prefix.iterdir()):
+                    if not path.name.startswith("."):
+                        yield path.name
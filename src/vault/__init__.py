@@ -1,5 +1,4 @@
 from pulumi import ComponentResource, ResourceOptions, Output
-from pulumi_vault import AuthBackend, Mount
 from pulumi_docker import Container, Volume, ContainerCapabilitiesArgs, ContainerNetworksAdvancedArgs
 
 class BasicVault(ComponentResource):